@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import builder
+
+# Synthetic input shape
+DEFAULT_SCALES = [10, 100, 1000, 10000]
+DEFAULT_MATRIX_WIDTH = 30
+DEFAULT_RESULTS_FILE = 'benchmark-results.json'
+ANALOG_PER_REPEATER = 0.5
+OTHERS_PER_REPEATER = 0.2
+
+def main():
+    args = handle_command_line_args()
+    scales = [int(scale) for scale in args.scales.split(',')]
+    results = []
+    for scale in scales:
+        with tempfile.TemporaryDirectory(prefix='codeplug-bench-') as work_dir:
+            input_dir = os.path.join(work_dir, 'input')
+            counts = generate_inputs(input_dir, scale, args.matrix_width, args.seed)
+            print(f"Scale {scale} repeaters x {args.matrix_width} talkgroups "
+                  f"({counts['channels']} channels)")
+            for stage, setup, run in benchmark_stages(input_dir, work_dir, args.config):
+                result = run_stage(stage, setup, run, args.repeat)
+                result.update({'scale': scale, 'matrix_width': args.matrix_width})
+                results.append(result)
+                print(f"  {stage:<24} {result['seconds']:>9.4f}s {result['rows_per_second']:>12.0f} rows/s "
+                      f"{result['peak_bytes'] / 1048576:>8.1f} MiB peak")
+    save_results(args.output, results)
+    print(f"Results appended to: {os.path.abspath(args.output)}")
+
+def benchmark_stages(input_dir, work_dir, config_directory):
+    """Return (stage name, setup, run) triples.
+
+    setup() prepares whatever the stage needs and is not measured; run(state) does the measured
+    work and returns the number of rows it handled.
+    """
+    files = {
+        'analog': os.path.join(input_dir, 'Analog.csv'),
+        'digital_others': os.path.join(input_dir, 'Digital-Others.csv'),
+        'digital_repeaters': os.path.join(input_dir, 'Digital-Repeaters.csv'),
+        'talkgroups': os.path.join(input_dir, 'TalkGroups.csv'),
+    }
+    defaults_file = os.path.join(config_directory, 'channel-defaults.csv')
+
+    def new_builder():
+        return builder.CodeplugBuilder(nicknames='prefix', verbose=False)
+
+    def loaded_builder():
+        code_builder = new_builder()
+        code_builder.read_talkgroups(files['talkgroups'])
+        code_builder.read_channel_csv_default(defaults_file)
+        return code_builder
+
+    def full_pipeline(_):
+        output_dir = os.path.join(work_dir, 'full')
+        os.makedirs(output_dir, exist_ok=True)
+        new_builder().write_files(output_dir, files['analog'], files['digital_others'], files['digital_repeaters'],
+                                  files['talkgroups'], config_directory)
+        return count_csv_rows(os.path.join(output_dir, 'channels.csv'))
+
+    def setup_parse_repeaters():
+        return loaded_builder(), builder.read_csv_rows(files['digital_repeaters'])
+
+    def parse_repeaters(state):
+        # Validation and matrix expansion of the repeater file, without channel emission
+        code_builder, rows = state
+        return sum(len(channels) for _, _, _, channels in code_builder.extract_dmr_repeater_rows(rows))
+
+    def setup_add_channels():
+        code_builder = loaded_builder()
+        records = list(code_builder.extract_dmr_repeater_rows(builder.read_csv_rows(files['digital_repeaters'])))
+        return code_builder, records
+
+    def add_channels(state):
+        code_builder, records = state
+        channels = builder.RowCollector()
+        code_builder.emit_channel_records(channels, records)
+        return len(channels)
+
+    def setup_generate_rows():
+        code_builder = loaded_builder()
+        code_builder.process_dmr_repeater_rows(builder.RowCollector(), builder.read_csv_rows(files['digital_repeaters']))
+        output_dir = os.path.join(work_dir, 'zones')
+        os.makedirs(output_dir, exist_ok=True)
+        return code_builder, output_dir
+
+    def generate_rows(state):
+        code_builder, output_dir = state
+        code_builder.write_zone_file(os.path.join(output_dir, 'zones.csv'))
+        code_builder.write_scanlist_file(os.path.join(output_dir, 'scanlists.csv'))
+        return len(code_builder.zone_config) + len(code_builder.scanlist_config)
+
+    def write_talkgroups(code_builder):
+        code_builder.write_talkgroup_file(os.path.join(work_dir, 'talkgroups.csv'))
+        return len(code_builder.talkgroup_mapping)
+
+    return [
+        ('full_pipeline', lambda: None, full_pipeline),
+        ('parse_repeaters', setup_parse_repeaters, parse_repeaters),
+        ('add_channel', setup_add_channels, add_channels),
+        ('generate_csv_rows', setup_generate_rows, generate_rows),
+        ('write_talkgroup_file', loaded_builder, write_talkgroups),
+    ]
+
+def run_stage(stage, setup, run, repeat):
+    """Time a stage (best of repeat runs), then run it once more under tracemalloc for the peak."""
+    best = None
+    rows = 0
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        rows = run(state)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    state = setup()
+    tracemalloc.start()
+    run(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'stage': stage,
+        'rows': rows,
+        'seconds': best,
+        'rows_per_second': rows / best if best else 0.0,
+        'peak_bytes': peak,
+    }
+
+def generate_inputs(directory, repeaters, matrix_width, seed):
+    """Write synthetic TalkGroups, Digital-Repeaters, Digital-Others and Analog CSVs."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    talkgroups = []
+    for index in range(matrix_width):
+        call_type = builder.VAL_CALL_TYPE_PRIVATE if index % 10 == 9 else builder.VAL_CALL_TYPE_GROUP
+        talkgroups.append((str(3100 + index), f"TG {index}", f"T{index}", call_type))
+    channels = 0
+
+    with open(os.path.join(directory, 'TalkGroups.csv'), 'w', newline='', encoding='utf-8') as fh:
+        csv_out = csv.writer(fh)
+        csv_out.writerow(["Radio ID", "Name", "Call Type", "Call Alert"])
+        for radio_id, name, _, call_type in talkgroups:
+            csv_out.writerow([radio_id, name, call_type, "None"])
+
+    with open(os.path.join(directory, 'Digital-Repeaters.csv'), 'w', newline='', encoding='utf-8') as fh:
+        csv_out = csv.writer(fh)
+        csv_out.writerow(["Zone Name", "Comment", "Power", "RX Freq", "TX Freq", "Color Code"] +
+                         [f"{name};{nick}" for _, name, nick, _ in talkgroups])
+        for index in range(repeaters):
+            rx_freq = 420 + (index % 4000) * 0.0125
+            row = [f"Repeater {index};R{index}", "", "High", f"{rx_freq:.4f}", f"{rx_freq + 5:.4f}", str(index % 16)]
+            for _, _, _, call_type in talkgroups:
+                timeslot = rng.choice(["1", "2", "-"])
+                if timeslot != "-":
+                    channels += 1
+                    if call_type == builder.VAL_CALL_TYPE_PRIVATE:
+                        timeslot += ";P"
+                row.append(timeslot)
+            csv_out.writerow(row)
+
+    with open(os.path.join(directory, 'Digital-Others.csv'), 'w', newline='', encoding='utf-8') as fh:
+        csv_out = csv.writer(fh)
+        csv_out.writerow(["Zone", "Channel Name", "Power", "RX Freq", "TX Freq", "RX Color Code", "TX Color Code",
+                          "Talk Group", "TimeSlot", "Call Type", "TX Permit"])
+        for index in range(max(1, int(repeaters * OTHERS_PER_REPEATER))):
+            _, name, _, call_type = talkgroups[index % matrix_width]
+            csv_out.writerow([f"Hotspot {index // 100}", f"HS{index}", "Low", "440.35", "445.35", "1", "1", name,
+                              "1", call_type, "Same Color Code"])
+            channels += 1
+
+    with open(os.path.join(directory, 'Analog.csv'), 'w', newline='', encoding='utf-8') as fh:
+        csv_out = csv.writer(fh)
+        csv_out.writerow(["Zone", "Channel Name", "Bandwidth", "Power", "RX Freq", "TX Freq",
+                          "CTCSS Decode", "CTCSS Encode", "TX Prohibit"])
+        for index in range(max(1, int(repeaters * ANALOG_PER_REPEATER))):
+            rx_freq = 144 + (index % 300) * 0.015
+            csv_out.writerow([f"Analog {index // 200}", f"A{index}", "25K", "High", f"{rx_freq:.3f}",
+                              f"{rx_freq + 0.6:.3f}", "Off", "100.0", "Off"])
+            channels += 1
+
+    return {'repeaters': repeaters, 'channels': channels}
+
+def count_csv_rows(filename):
+    with open(filename, 'r', newline='', encoding='utf-8') as fh:
+        return sum(1 for _ in fh) - 1
+
+def save_results(filename, results):
+    """Append this run to the results file so runs can be compared over time."""
+    history = []
+    if os.path.exists(filename):
+        with open(filename, 'r', encoding='utf-8') as fh:
+            history = json.load(fh)
+    history.append({
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    })
+    with open(filename, 'w', encoding='utf-8') as fh:
+        json.dump(history, fh, indent=2)
+
+def handle_command_line_args():
+    parser = argparse.ArgumentParser(
+        description="Anytone Config Builder benchmark\n\n"
+                    "Generates synthetic input files at several scales, times the full build and\n"
+                    "each stage, and appends the results to a JSON file.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        '--scales',
+        default=','.join(str(scale) for scale in DEFAULT_SCALES),
+        help='Comma separated repeater counts to benchmark. Default: 10,100,1000,10000'
+    )
+    parser.add_argument(
+        '--matrix-width',
+        type=int,
+        default=DEFAULT_MATRIX_WIDTH,
+        help=f'Number of talkgroup columns in the repeater matrix. Default: {DEFAULT_MATRIX_WIDTH}'
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Timed runs per stage; the best time is kept. Default: 3'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=1,
+        help='Random seed for the synthetic inputs. Default: 1'
+    )
+    parser.add_argument(
+        '--config',
+        default=builder.DEFAULT_CONFIG_DIRECTORY,
+        help='Directory containing channel-defaults.csv. Defaults to the bundled config directory.'
+    )
+    parser.add_argument(
+        '--output',
+        default=DEFAULT_RESULTS_FILE,
+        help=f'JSON file the results are appended to. Default: {DEFAULT_RESULTS_FILE}'
+    )
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    main()
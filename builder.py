@@ -1,11 +1,26 @@
 #!/usr/bin/env python3
 
 import csv
+import gc
 import os
 import argparse
-from collections import defaultdict
+import bisect
+import hashlib
+import heapq
+import io
+import json
+import math
+import pickle
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from collections import defaultdict, namedtuple
+from itertools import groupby, islice
+from operator import attrgetter, itemgetter
 import re
 import sys
+# concurrent.futures and the --serve modules are imported where they are used: most builds need
+# neither, and together they take longer to import than a small build takes to run
 
 # Constants for channel CSV fields
 CHAN_NUM = 0
@@ -28,8 +43,51 @@ CHAN_SCANLIST_NAME = 22
 CHAN_TX_PROHIBIT = 24
 CHAN_DMR_MODE = 45
 CHAN_PTT_PROHIBIT = 24
-ACB_ZONE_NICKNAME = 1000
-CHAN_TX_COLOR_CODE = 1001  # New field for TX Color Code
+CHAN_TX_COLOR_CODE = 55
+
+# Positions in a ChannelRecord, which only holds the values the input files supply
+REC_NAME = 0
+REC_RX_FREQ = 1
+REC_TX_FREQ = 2
+REC_MODE = 3
+REC_POWER = 4
+REC_BANDWIDTH = 5
+REC_CTCSS_DEC = 6
+REC_CTCSS_ENC = 7
+REC_CONTACT = 8
+REC_CALL_TYPE_OLD = 9
+REC_TG_ID = 10
+REC_TX_PERMIT = 11
+REC_SQUELCH_MODE = 12
+REC_RX_COLOR_CODE = 13
+REC_TIME_SLOT = 14
+REC_SCANLIST_NAME = 15
+REC_TX_PROHIBIT = 16
+REC_DMR_MODE = 17
+REC_TX_COLOR_CODE = 18
+REC_ZONE_NICKNAME = 19  # Not written to the CPS; used to build and rename channel names
+CHANNEL_RECORD_WIDTH = 20
+
+# Channel CSV column for each record position that is copied into the channel row as is
+CHANNEL_RECORD_COLUMNS = [
+    (REC_NAME, CHAN_NAME),
+    (REC_MODE, CHAN_MODE),
+    (REC_POWER, CHAN_POWER),
+    (REC_BANDWIDTH, CHAN_BANDWIDTH),
+    (REC_CTCSS_DEC, CHAN_CTCSS_DEC),
+    (REC_CTCSS_ENC, CHAN_CTCSS_ENC),
+    (REC_CONTACT, CHAN_CONTACT),
+    (REC_CALL_TYPE_OLD, CHAN_CALL_TYPE_OLD),
+    (REC_TG_ID, CHAN_TG_ID),
+    (REC_TX_PERMIT, CHAN_TX_PERMIT),
+    (REC_SQUELCH_MODE, CHAN_SQUELCH_MODE),
+    (REC_RX_COLOR_CODE, CHAN_RX_COLOR_CODE),
+    (REC_TIME_SLOT, CHAN_TIME_SLOT),
+    (REC_SCANLIST_NAME, CHAN_SCANLIST_NAME),
+    (REC_TX_PROHIBIT, CHAN_TX_PROHIBIT),
+    (REC_DMR_MODE, CHAN_DMR_MODE),
+    (REC_TX_COLOR_CODE, CHAN_TX_COLOR_CODE),
+]
 
 # Constants for values
 VAL_DIGITAL = 'D-Digital'
@@ -45,28 +103,240 @@ VAL_CTCSS_DCS = 'CTCSS/DCS'
 VAL_DMR_MODE_SIMPLEX = 0
 VAL_DMR_MODE_REPEATER = 1
 LENGTH_CHAN_NAME = 16
+HZ_PER_MHZ = 1000000
+DMR_ID_LIMIT = 1 << 24  # DMR IDs are 24 bit
+CONTACT_CAPACITY = 500000  # Digital contacts the AT-D878UV can hold
+CHANNEL_CAPACITY = 4000  # Channels, zones, scanlists and talkgroups the AT-D878UV can hold
+ZONE_CAPACITY = 250
+SCANLIST_CAPACITY = 250
+TALKGROUP_CAPACITY = 10000
+LENGTH_CONTACT_CALLSIGN = 8
+LENGTH_CONTACT_FIELD = 16  # Name, City, State and Country
+MAX_FREQ_MHZ = 1000
+INVALID_FREQ = -1  # Stands in for a frequency that failed validation, so later checks can skip it
 SCANLIST_LIMIT = 50  # Maximum channels per scanlist
+ZONE_LIMIT = 250  # Maximum channels per zone
+CSV_CHUNK_ROWS = 5000  # Formatted output rows gathered before each write
+PARALLEL_EXPANSION_MIN_CELLS = 100000  # Repeater matrix cells below which expansion stays in this process
+EXPANSION_CHUNKS_PER_JOB = 4
+WATCH_INTERVAL = 0.5  # Seconds between input file checks in --watch mode
+SERVE_CACHE_ENTRIES = 8  # Parsed results of each input stage a --serve worker keeps, by content hash
+SERVE_MAX_UPLOAD_BYTES = 64 << 20
+STALE_STAGING_SECONDS = 3600  # Age after which a leftover .codeplug-* staging directory is removed
+STREAMING_BUFFER_MEMBERS = 20000  # Zone/scanlist members held in memory before a sorted run is spilled to disk
+DEFAULT_CONFIG_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+
+# Valid values for the validators, built once
+VALID_BANDWIDTHS = frozenset({"25K", "12.5K"})
+VALID_CALL_TYPES = frozenset({"Private Call", "Group Call"})
+VALID_POWER_LEVELS = frozenset({"Low", "Mid", "High", "Turbo"})
+VALID_TIMESLOTS = frozenset({"1", "2", "-"})
+VALID_TX_PERMITS = frozenset({"Always", "ChannelFree", "Same Color Code", "Different Color Code"})
+VALID_ON_OFF = frozenset({"On", "Off"})
+VALID_SORT_MODES = frozenset({"alpha", "repeaters-first", "analog-first", "analog_and_others_first", "frequency",
+                              "band-frequency"})
+VALID_CHANNEL_SORTS = frozenset({"auto", "frequency", "band-frequency", "talkgroup-id"})
+VALID_HOTSPOT_MODES = frozenset({"always", "same-color-code"})
+VALID_NICKNAME_MODES = frozenset({"off", "prefix", "suffix", "prefix-forced", "suffix-forced"})
+VALID_TALKGROUP_SORTS = frozenset({"input", "id", "name"})
+VALID_DUPLICATE_NAME_MODES = frozenset({"allow", "warn", "error", "rename"})
+VALID_TALKGROUP_FILTERS = frozenset({"all", "used"})
+DCS_CODE_PATTERN = re.compile(r'D[0-9A-Za-z]+')
+NAME_START_PATTERN = re.compile(r'^[A-Za-z0-9]')
+
+# Column checks for each input file: (column, ChannelRecord position, validator method name)
+ANALOG_COLUMN_CHECKS = [
+    (0, REC_SCANLIST_NAME, 'validate_zone'),
+    (1, REC_NAME, 'validate_name'),
+    (2, REC_BANDWIDTH, 'validate_bandwidth'),
+    (3, REC_POWER, 'validate_power'),
+    (4, REC_RX_FREQ, 'validate_freq'),
+    (5, REC_TX_FREQ, 'validate_freq'),
+    (6, REC_CTCSS_DEC, 'validate_ctcss'),
+    (7, REC_CTCSS_ENC, 'validate_ctcss'),
+    (8, REC_TX_PROHIBIT, 'validate_tx_prohibit'),
+]
+DMR_OTHERS_COLUMN_CHECKS = [
+    (0, REC_SCANLIST_NAME, 'validate_zone'),
+    (1, REC_NAME, 'validate_name'),
+    (2, REC_POWER, 'validate_power'),
+    (3, REC_RX_FREQ, 'validate_freq'),
+    (4, REC_TX_FREQ, 'validate_freq'),
+    (5, REC_RX_COLOR_CODE, 'validate_color_code'),
+    (8, REC_TIME_SLOT, 'validate_timeslot'),
+    (9, REC_CALL_TYPE_OLD, 'validate_call_type'),
+    (10, REC_TX_PERMIT, 'validate_tx_permit'),
+]
+DMR_REPEATER_COLUMN_CHECKS = [
+    (2, REC_POWER, 'validate_power'),
+    (3, REC_RX_FREQ, 'validate_freq'),
+    (4, REC_TX_FREQ, 'validate_freq'),
+    (5, REC_RX_COLOR_CODE, 'validate_color_code'),
+]
+
+# Zone type tag for each input file, used by the zone sorting modes
+ZONE_TYPES = {"Analog": 'analog', "Digital-Others": 'digital_others', "Digital-Repeater": 'digital_repeaters'}
+
+# band-plan.csv: Type (one of BAND_PLAN_TYPES), Name, Low MHz, High MHz, Offsets MHz (';' separated, Amateur only)
+BAND_PLAN_HEADERS = ["Type", "Name", "Low MHz", "High MHz", "Offsets MHz"]
+BAND_PLAN_TYPES = frozenset({"Radio", "Amateur"})
+
+class ChannelRecord(list):
+    """A channel's values at the REC_* positions, None where the input files don't set one.
+
+    A fixed-width list is about a third of the size of an int-keyed dict and pickles smaller,
+    which matters when hundreds of thousands of generated channels are cached or held.
+    """
+    __slots__ = ()
+
+    def copy(self):
+        """Return an independent record; the repeater matrix takes one per talkgroup channel."""
+        return ChannelRecord(self)
+
+BLANK_CHANNEL_RECORD = (None,) * CHANNEL_RECORD_WIDTH
+
+# Zone/scanlist member record; sort_key is computed once when the channel is added. Frequencies are integer Hz
+ChannelMember = namedtuple('ChannelMember', ['sort_key', 'name', 'rx_freq', 'tx_freq'])
+member_sort_key = itemgetter(0)
+
+# A TalkGroups.csv entry; id_number is the Radio ID as an int for sorting and ID range filters
+TalkgroupEntry = namedtuple('TalkgroupEntry', ['radio_id', 'name', 'call_type', 'call_alert', 'id_number'])
+
+# Digital Contact List output, and the RadioID.net user dump columns it is built from
+DIGITAL_CONTACT_HEADERS = ["No.", "Radio ID", "Callsign", "Name", "City", "State", "Country", "Remarks", "Call Type", "Call Alert"]
+RADIOID_COLUMNS = ["RADIO_ID", "CALLSIGN", "FIRST_NAME", "LAST_NAME", "CITY", "STATE", "COUNTRY"]
+
+# Repeater directory export columns, and the grid used to index repeaters by location
+REPEATER_DIRECTORY_COLUMNS = ["CALLSIGN", "LATITUDE", "LONGITUDE", "OUTPUT FREQ", "INPUT FREQ", "COLOR CODE"]
+REPEATER_GRID_DEGREES = 0.5
+KM_PER_DEGREE = 111.195
+DEFAULT_REPEATER_RADIUS_KM = 50
+
+# A channel whose name was already used by an earlier channel; renamed_to is None unless it was renamed
+NameCollision = namedtuple('NameCollision', ['name', 'zone', 'rx_freq', 'tx_freq', 'first_zone', 'renamed_to'])
+NAME_COLLISION_HEADERS = ["Channel Name", "Zone", "RX Freq", "TX Freq", "First Used In Zone", "Renamed To"]
+
+# Input file headers; Digital-Repeaters rows carry a talkgroup matrix after these columns
+ANALOG_HEADERS = ["Zone", "Channel Name", "Bandwidth", "Power", "RX Freq", "TX Freq", "CTCSS Decode", "CTCSS Encode",
+                  "TX Prohibit"]
+DIGITAL_OTHERS_HEADERS = ["Zone", "Channel Name", "Power", "RX Freq", "TX Freq", "RX Color Code", "TX Color Code",
+                          "Talk Group", "TimeSlot", "Call Type", "TX Permit"]
+DIGITAL_REPEATER_HEADERS = ["Zone Name", "Comment", "Power", "RX Freq", "TX Freq", "Color Code"]
+
+# A problem found in the inputs; line and column are None when it isn't tied to a cell
+ValidationIssue = namedtuple('ValidationIssue', ['file', 'line', 'column', 'message'])
+
+class BuildError(Exception):
+    """Raised when the input files can't be turned into a codeplug."""
+
+class ValidationError(BuildError):
+    """Raised at the end of a collect-all-errors build, carrying every problem found."""
+
+    def __init__(self, issues):
+        super().__init__(f"Found {len(issues)} error(s) in the input files")
+        self.issues = issues
+
+    def report(self):
+        lines = []
+        for issue in self.issues:
+            if issue.line is None:
+                lines.append(f"ERROR: {issue.message}")
+            elif issue.column is None:
+                lines.append(f"ERROR: {issue.message} [On line {issue.line} of {issue.file} file.]")
+            else:
+                lines.append(f"ERROR: {issue.message} [On line {issue.line}, column {issue.column} of {issue.file} file.]")
+        lines.append(f"{self}.")
+        return '\n'.join(lines)
+
+    def write_json(self, filename):
+        with open(filename, 'w', encoding='utf-8') as fh:
+            json.dump({'error_count': len(self.issues), 'errors': [issue._asdict() for issue in self.issues]}, fh, indent=2)
+
+class MemberGroups(defaultdict):
+    """Zone or scanlist membership held in memory, one member list per zone/scanlist name."""
+
+    def __init__(self):
+        super().__init__(list)
+
+    def add(self, name, member):
+        self[name].append(member)
+
+class SpilledMemberGroups:
+    """Zone or scanlist membership that spills sorted runs to disk (an external sort).
+
+    Members are buffered and written out as a sorted run whenever the buffer fills. groups()
+    merges the runs back together, so memory stays flat however many channels are generated.
+    """
+
+    def __init__(self, directory, buffer_limit=STREAMING_BUFFER_MEMBERS):
+        self.directory = directory
+        self.buffer_limit = buffer_limit
+        self.counts = {}
+        self.buffer = []
+        self.runs = []
+
+    def add(self, name, member):
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.buffer.append((name, member))
+        if len(self.buffer) >= self.buffer_limit:
+            self._spill()
+
+    def keys(self):
+        return self.counts.keys()
+
+    def groups(self):
+        """Yield (name, sorted member iterator) for every group, in name order."""
+        self.buffer.sort(key=_spill_sort_key)
+        runs = [_read_spill_run(path) for path in self.runs] + [self.buffer]
+        merged = heapq.merge(*runs, key=_spill_sort_key)  # Ties keep insertion order, like sorted()
+        for name, items in groupby(merged, key=itemgetter(0)):
+            yield name, map(itemgetter(1), items)
+
+    def _spill(self):
+        self.buffer.sort(key=_spill_sort_key)
+        fd, path = tempfile.mkstemp(suffix='.run', dir=self.directory)
+        with os.fdopen(fd, 'wb') as fh:
+            for start in range(0, len(self.buffer), 1000):
+                pickle.dump(self.buffer[start:start + 1000], fh, protocol=pickle.HIGHEST_PROTOCOL)
+        self.runs.append(path)
+        self.buffer = []
+
+@contextmanager
+def gc_paused():
+    """Pause the cyclic garbage collector while channel records are generated.
+
+    Records only hold strings and ints, so they can't form cycles, but each collection would
+    rescan every live record; with hundreds of thousands of them that dominates the build.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def _spill_sort_key(item):
+    return item[0], item[1].sort_key
+
+def _read_spill_run(path):
+    with open(path, 'rb') as fh:
+        while True:
+            try:
+                chunk = pickle.load(fh)
+            except EOFError:
+                return
+            yield from chunk
 
-# Global variables
-global_sort_mode = 'alpha'
-global_hotspot_tx_permit = 'same-color-code'
-global_nickname_mode = 'off'
-global_talkgroup_sort = 'input'
-global_line_number = 0
-global_file_name = 'none'
-global_channel_number = 1
-channel_csv_field_name = {}
-channel_csv_default_value = {}
-talkgroup_mapping = {}
-zone_config = defaultdict(list)
-zone_order = {}
-zone_type = {}  # Dictionary to track zone types
-scanlist_config = defaultdict(list)
-talkgroup_config = {}
-talkgroup_order = {}
-scanlist_channel_counts = defaultdict(int)  # Dictionary to track channel counts per scanlist
-all_talkgroups = []  # List to store all talkgroups from input file
-analog_channel_index = 0
+class NullWriter:
+    """Stands in for a csv writer when channels are only being checked."""
+
+    def writerow(self, row):
+        pass
+
+class RowCollector(list):
+    """In-memory stand-in for csv.writer, used when building tables instead of files."""
+    writerow = list.append
 
 def main():
     args = handle_command_line_args()
@@ -77,76 +347,1137 @@ def main():
         print(f"Templates generated in: {os.path.abspath(templates_dir)}")
         return
 
+    if args.serve is not None:
+        serve(args)
+        return
+
     output_dir = args.output_directory or './Output'
     os.makedirs(output_dir, exist_ok=True)
 
-    analog_filename = args.analog_csv
-    digital_others_filename = args.digital_others_csv
-    digital_repeaters_filename = args.digital_repeaters_csv
-    talkgroups_filename = args.talkgroups_csv
-    config_directory = args.config
-
-    read_talkgroups(talkgroups_filename)
-    read_channel_csv_default(os.path.join(config_directory, 'channel-defaults.csv'))
+    if args.batch_manifest:
+        run_batch(args, output_dir)
+        return
 
-    with open(os.path.join(output_dir, 'channels.csv'), 'w', newline='', encoding='utf-8') as fh:
-        csv_out = csv.writer(fh, quoting=csv.QUOTE_ALL, lineterminator='\r\n')
-        print_channel_header(csv_out)
-        process_dmr_others_file(csv_out, digital_others_filename)
-        process_dmr_repeater_file(csv_out, digital_repeaters_filename)
-        process_analog_file(csv_out, analog_filename)
+    if args.watch:
+        watch(args, output_dir)
+        return
 
-    write_zone_file(os.path.join(output_dir, 'zones.csv'))
-    write_scanlist_file(os.path.join(output_dir, 'scanlists.csv'))
-    write_talkgroup_file(os.path.join(output_dir, 'talkgroups.csv'))
+    cache = InputCache(args.cache_directory) if args.cache_directory else None
+    stats = BuildStats() if args.timings or args.timings_json else None
+    try:
+        builder = CodeplugBuilder(cache=cache, stats=stats, **builder_options(args))
+    except BuildError as exc:
+        print(f"ERROR: {exc}")
+        sys.exit(1)
+    if args.capacity:
+        try:
+            capacity = builder.count_capacity(args.analog_csv, args.digital_others_csv, args.digital_repeaters_csv,
+                                              args.talkgroups_csv)
+        except (BuildError, OSError) as exc:
+            print(f"ERROR: {exc}")
+            sys.exit(1)
+        print(capacity.report())
+        full = capacity.over_capacity()
+        if full:
+            for what, used, limit in full:
+                print(f"ERROR: {what}: {used} won't fit, the radio holds {limit}.")
+            sys.exit(1)
+
+    if args.check:
+        try:
+            builder.check_files(args.analog_csv, args.digital_others_csv, args.digital_repeaters_csv,
+                                args.talkgroups_csv, args.config)
+        except BuildError as exc:
+            report_build_error(exc, args.error_report)
+            sys.exit(1)
+        print("No errors found in the input files.")
+        return
 
-    if args.dmr_id:
-        write_radio_id_list(args.dmr_id, output_dir)
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        builder.write_files(output_dir, args.analog_csv, args.digital_others_csv, args.digital_repeaters_csv,
+                            args.talkgroups_csv, args.config, args.dmr_id, args.contacts_csv,
+                            delta=args.delta or bool(args.delta_json))
+    except BuildError as exc:
+        report_build_error(exc, args.error_report)
+        sys.exit(1)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
 
     print(f"Output files generated in: {os.path.abspath(output_dir)}")
+    if args.delta:
+        print(builder.delta.report())
+    if args.delta_json:
+        builder.delta.write_json(args.delta_json)
+    if args.collision_report:
+        write_csv_rows(args.collision_report, builder.name_collision_rows())
+    if args.timings:
+        print(stats.report())
+    if args.timings_json:
+        stats.write_json(args.timings_json)
+
+def builder_options(args):
+    """CodeplugBuilder keyword arguments for the command line options."""
+    return {
+        'sorting': args.sorting,
+        'channel_sort': args.channel_sort,
+        'hotspot_tx_permit': args.hotspot_tx_permit,
+        'nicknames': args.nicknames,
+        'talkgroup_sort': args.talkgroup_sort,
+        'streaming': args.streaming,
+        'log_scanlists': not args.quiet,
+        'collect_errors': True,
+        'duplicate_names': args.duplicate_names or ('warn' if args.collision_report else 'allow'),
+        'talkgroup_filter': args.talkgroup_filter,
+        'include_talkgroups': args.include_talkgroups,
+        'contact_countries': split_list(args.contacts_country),
+        'contact_states': split_list(args.contacts_state),
+        'contact_id_prefixes': split_list(args.contacts_id_prefix),
+        'contact_limit': args.contacts_limit,
+        'repeater_directory': args.repeater_directory,
+        'repeater_points': [parse_lat_lon(point) for point in args.near or []],
+        'repeater_route': read_route(args.route) if args.route else [],
+        'repeater_radius': args.radius,
+        'expansion_jobs': args.jobs or 1,
+    }
+
+def watch(args, output_dir):
+    """Rebuild whenever an input file changes, until interrupted.
+
+    Parsed and validated inputs stay in memory between builds, so only the files that changed
+    are read again. Outputs that only depend on unchanged inputs are left as they are.
+    """
+    inputs = {
+        'analog': args.analog_csv,
+        'digital-others': args.digital_others_csv,
+        'digital-repeaters': args.digital_repeaters_csv,
+        'talkgroups': args.talkgroups_csv,
+        'channel-defaults': os.path.join(args.config, 'channel-defaults.csv'),
+        'band-plan': os.path.join(args.config, 'band-plan.csv'),
+    }
+    if args.contacts_csv:
+        inputs['contacts'] = args.contacts_csv
+    try:
+        options = builder_options(args)
+    except BuildError as exc:
+        print(f"ERROR: {exc}")
+        sys.exit(1)
+    cache = MemoryInputCache()
+    previous = built = None
+    print(f"Watching the input files for changes (every {WATCH_INTERVAL}s). Press Ctrl+C to stop.")
+    try:
+        while True:
+            stamps = {stage: file_stamp(filename) for stage, filename in inputs.items()}
+            if stamps != previous:
+                changed = [stage for stage in stamps if previous is None or stamps[stage] != previous[stage]]
+                if watch_rebuild(args, output_dir, options, cache, watch_outputs_to_skip(args, stamps, built), changed):
+                    built = stamps
+                previous = stamps
+            time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+def watch_outputs_to_skip(args, stamps, built):
+    """Output files a --watch rebuild can leave as they are.
+
+    Only files whose inputs haven't changed since the last successful build (built) are
+    skipped; a failed build writes nothing, so it can't be the baseline.
+    """
+    if built is None:
+        return set()
+    skip = {'radio_id_list.csv'}
+    if stamps['talkgroups'] == built['talkgroups'] and args.talkgroup_filter == 'all':
+        skip.add('talkgroups.csv')
+    if stamps.get('contacts') == built.get('contacts'):
+        skip.add('digital_contacts.csv')
+    return skip
+
+def watch_rebuild(args, output_dir, options, cache, skip, changed):
+    """Run one --watch build, reporting the outcome. Returns whether the output files were written."""
+    start = time.perf_counter()
+    try:
+        builder = CodeplugBuilder(cache=cache, **options)
+        builder.write_files(output_dir, args.analog_csv, args.digital_others_csv, args.digital_repeaters_csv,
+                            args.talkgroups_csv, args.config, args.dmr_id, args.contacts_csv, skip)
+    except BuildError as exc:
+        report_build_error(exc, args.error_report)
+    except OSError as exc:
+        print(f"ERROR: {exc}")
+    else:
+        print(f"Built in {time.perf_counter() - start:.2f}s (changed: {', '.join(changed)}). "
+              f"Output files generated in: {os.path.abspath(output_dir)}")
+        return True
+    return False
 
-# CSV Output Routines
-def write_zone_file(filename):
-    headers = ["No.", "Zone Name", "Zone Channel Member", "Zone Channel Member RX Frequency", "Zone Channel Member TX Frequency",
-               "A Channel", "A Channel RX Frequency", "A Channel TX Frequency",
-               "B Channel", "B Channel RX Frequency", "B Channel TX Frequency"]
-    generate_csv_file(filename, headers, zone_config, zone_row_builder, zone_sort_key)
-
-def write_scanlist_file(filename):
-    headers = ["No.", "Scan List Name", "Scan Channel Member", "Scan Channel Member RX Frequency", "Scan Channel Member TX Frequency",
-               "Scan Mode", "Priority Channel Select", "Priority Channel 1", "Priority Channel 1 RX Frequency",
-               "Priority Channel 1 TX Frequency", "Priority Channel 2", "Priority Channel 2 RX Frequency",
-               "Priority Channel 2 TX Frequency", "Revert Channel", "Look Back Time A[s]", "Look Back Time B[s]",
-               "Dropout Delay Time[s]", "Dwell Time[s]"]
-    generate_csv_file(filename, headers, scanlist_config, scanlist_row_builder, str.lower, log_scanlists=True)
-
-def write_talkgroup_file(filename):
-    headers = ["No.", "Radio ID", "Name", "Country", "Remarks", "Call Type", "Call Alert"]
+def file_stamp(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def report_build_error(exc, json_filename=None):
+    if isinstance(exc, ValidationError):
+        print(exc.report())
+        if json_filename:
+            exc.write_json(json_filename)
+    else:
+        print(f"ERROR: {exc}")
+
+def build_codeplug(talkgroups, analog, digital_others, digital_repeaters, channel_defaults=None, dmr_id=None,
+                   band_plan=None, **options):
+    """Build a codeplug from in-memory rows and return the generated tables.
+
+    Each input is an iterable of CSV rows (lists of strings) including the header row, as
+    csv.reader would produce them. channel_defaults and band_plan default to the rows of the
+    bundled config/channel-defaults.csv and config/band-plan.csv. options are the
+    CodeplugBuilder keyword arguments. Returns a dict mapping each output file name to its list of rows.
+    """
+    builder = CodeplugBuilder(**options)
+    return builder.build_tables(talkgroups, analog, digital_others, digital_repeaters, channel_defaults, dmr_id,
+                                band_plan=band_plan)
+
+def read_csv_rows(filename):
+    with open(filename, 'r', newline='', encoding='utf-8-sig') as fh:
+        return list(csv.reader(fh))
+
+def write_csv_rows(filename, rows):
     with open(filename, 'w', newline='', encoding='utf-8') as fh:
-        csv_out = csv.writer(fh, quoting=csv.QUOTE_ALL, lineterminator='\r\n')
-        csv_out.writerow(headers)
-        talkgroups = []
-        for row in all_talkgroups[1:]:  # Skip header row
-            radio_id = row[0].strip()
-            name = row[1].strip()
-            call_type = row[2].strip() if len(row) > 2 and row[2].strip() else "Group Call"
-            call_alert = row[3].strip() if len(row) > 3 and row[3].strip() else "None"
-            talkgroups.append((radio_id, name, call_type, call_alert))
-        if global_talkgroup_sort == 'id':
-            talkgroups.sort(key=lambda x: int(x[0]))
-        elif global_talkgroup_sort == 'name':
-            talkgroups.sort(key=lambda x: x[1].lower())
+        csv_out = BulkCsvWriter(fh)
+        csv_out.writerows(rows)
+        csv_out.flush()
+
+def write_tables(output_dir, tables):
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = OutputSet(output_dir)
+    try:
+        for name, rows in tables.items():
+            write_csv_rows(outputs.path(name), rows)
+        outputs.commit()
+    finally:
+        outputs.discard()
+
+def same_file_content(filename, other_filename):
+    try:
+        if os.path.getsize(filename) != os.path.getsize(other_filename):
+            return False
+    except OSError:
+        return False
+    return file_digest(filename) == file_digest(other_filename)
+
+def file_digest(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+def format_csv_row(row):
+    """Format a row exactly as csv.writer(quoting=csv.QUOTE_ALL, lineterminator='\\r\\n') would."""
+    if not row:
+        return '\r\n'
+    return '"' + '","'.join(['' if value is None else str(value).replace('"', '""') for value in row]) + '"\r\n'
+
+class BulkCsvWriter:
+    """QUOTE_ALL/CRLF csv writer that formats rows itself and writes them in large chunks.
+
+    Call flush() once the last row has been written.
+    """
+
+    def __init__(self, fh, chunk_rows=CSV_CHUNK_ROWS):
+        self.fh = fh
+        self.chunk_rows = chunk_rows
+        self.pending = []
+
+    def writerow(self, row):
+        self.pending.append(format_csv_row(row))
+        if len(self.pending) >= self.chunk_rows:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        self.fh.write(''.join(self.pending))
+        self.pending.clear()
+
+class OutputSet:
+    """A codeplug's output files, staged in a temporary directory and then moved into place.
+
+    Files are written under path(name) and only replace the ones in the output directory when
+    commit() is called, so a failed build leaves the existing files untouched. commit() replaces
+    them one file at a time: each file is either its old or its new version, never half written,
+    but a build killed part way through commit() can leave a mix of old and new files.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        remove_stale_staging_dirs(output_dir)
+        self.staging_dir = tempfile.mkdtemp(prefix='.codeplug-', dir=output_dir)
+        self.names = []
+        self.changed = []
+        self.unchanged = []  # Files whose existing copy already had the same content, left untouched
+        self.comparisons = {}
+
+    def path(self, name):
+        self.names.append(name)
+        return os.path.join(self.staging_dir, name)
+
+    def path_in_staging(self, name):
+        return os.path.join(self.staging_dir, name)
+
+    def previous_path(self, name):
+        return os.path.join(self.output_dir, name)
+
+    def is_unchanged(self, name):
+        """Whether the staged file has the same content as the one already in the output directory."""
+        if name not in self.comparisons:
+            self.comparisons[name] = same_file_content(self.path_in_staging(name), self.previous_path(name))
+        return self.comparisons[name]
+
+    def commit(self):
+        for name in self.names:
+            staged = os.path.join(self.staging_dir, name)
+            target = os.path.join(self.output_dir, name)
+            if self.is_unchanged(name):
+                os.remove(staged)
+                self.unchanged.append(name)
+            else:
+                os.replace(staged, target)
+                self.changed.append(name)
+        self.names = []
+
+    def discard(self):
+        """Remove the staging directory and anything left in it."""
+        for name in self.names:
+            try:
+                os.remove(os.path.join(self.staging_dir, name))
+            except FileNotFoundError:
+                pass
+        os.rmdir(self.staging_dir)
+
+def remove_stale_staging_dirs(output_dir):
+    """Remove the staging directories of builds that were killed before they could clean up.
+
+    Only directories untouched for STALE_STAGING_SECONDS are removed, so a build still running
+    in the same output directory keeps its own.
+    """
+    cutoff = time.time() - STALE_STAGING_SECONDS
+    with os.scandir(output_dir) as entries:
+        stale = [entry.path for entry in entries if entry.name.startswith('.codeplug-') and entry.is_dir()
+                 and entry.stat().st_mtime < cutoff]
+    for path in stale:
+        try:
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+            os.rmdir(path)
+        except OSError:
+            pass  # Not ours to worry about; the next build tries again
+
+class InputCache:
+    """On-disk cache of parsed and validated input files.
+
+    Each stage keeps its latest result, keyed by a hash of the file contents, the options that
+    affect the result and the builder source itself, so only edited sheets get re-parsed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.abspath(__file__), 'rb') as fh:
+            self.version = hashlib.sha256(fh.read()).hexdigest()
+
+    def make_key(self, content, *options):
+        digest = hashlib.sha256(self.version.encode('ascii'))
+        digest.update(content)
+        for option in options:
+            digest.update(b'\0' + str(option).encode('utf-8'))
+        return digest.hexdigest()
+
+    def load(self, stage, key):
+        try:
+            with open(self._path(stage, key), 'rb') as fh:
+                return pickle.load(fh)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            return None  # A damaged entry is just a cache miss
+
+    def store(self, stage, key, result):
+        path = self._path(stage, key)
+        with open(path + '.tmp', 'wb') as fh:
+            pickle.dump(result, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        for name in os.listdir(self.directory):
+            if name.startswith(stage + '-') and name.endswith('.pickle') and name != os.path.basename(path):
+                os.remove(os.path.join(self.directory, name))
+
+    def _path(self, stage, key):
+        return os.path.join(self.directory, f"{stage}-{key}.pickle")
+
+class MemoryInputCache(InputCache):
+    """InputCache kept in memory, used by --watch and --serve.
+
+    Results are held pickled, so every build gets its own copy to modify, just like the
+    on-disk cache. Only the `keep` most recently used results of each stage are retained.
+    """
+
+    def __init__(self, keep=1):
+        self.version = 'memory'
+        self.keep = keep
+        self.entries = defaultdict(dict)  # Stage -> {key: pickled result}, least recently used first
+
+    def load(self, stage, key):
+        entries = self.entries[stage]
+        blob = entries.pop(key, None)
+        if blob is None:
+            return None
+        entries[key] = blob
+        return pickle.loads(blob)
+
+    def store(self, stage, key, result):
+        entries = self.entries[stage]
+        entries.pop(key, None)
+        entries[key] = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        while len(entries) > self.keep:
+            del entries[next(iter(entries))]
+
+class CodeplugDelta:
+    """What changed in the output files since the previous build in the same directory.
+
+    Channels are keyed by name and RX/TX frequency (numbered in order when a key repeats), so
+    renumbering alone shows up as renumbered rather than as removed and added channels.
+    Zones and scanlists are keyed by name and compared by their channel members.
+    """
+
+    def __init__(self, outputs):
+        self.changed_files = []
+        self.unchanged_files = []
+        self.first_build = not os.path.exists(outputs.previous_path('channels.csv'))
+        self.channels = {'added': [], 'removed': [], 'changed': [], 'renumbered': 0}
+        self.zones = {'added': [], 'removed': [], 'changed': []}
+        self.scanlists = {'added': [], 'removed': [], 'changed': []}
+        if self.first_build:
+            return
+        for name in outputs.names:
+            if outputs.is_unchanged(name):
+                self.unchanged_files.append(name)
+                continue
+            self.changed_files.append(name)
+            old_rows = read_csv_rows(outputs.previous_path(name)) if os.path.exists(outputs.previous_path(name)) else []
+            new_rows = read_csv_rows(outputs.path_in_staging(name))
+            if name == 'channels.csv':
+                self.compare_channels(old_rows, new_rows)
+            elif name == 'zones.csv':
+                self.compare_groups(old_rows, new_rows, self.zones)
+            elif name == 'scanlists.csv':
+                self.compare_groups(old_rows, new_rows, self.scanlists)
+
+    def compare_channels(self, old_rows, new_rows):
+        header = new_rows[0] if new_rows else []
+        old, new = keyed_channel_rows(old_rows), keyed_channel_rows(new_rows)
+        for key, row in new.items():
+            if key not in old:
+                self.channels['added'].append(channel_key_label(key))
+                continue
+            old_row = old[key]
+            if old_row[0] != row[0]:
+                self.channels['renumbered'] += 1
+            fields = [header[index] if index < len(header) else f"Field_{index}"
+                      for index in range(1, max(len(row), len(old_row)))
+                      if index >= len(row) or index >= len(old_row) or row[index] != old_row[index]]
+            if fields:
+                self.channels['changed'].append({'channel': channel_key_label(key), 'fields': fields})
+        self.channels['removed'] = [channel_key_label(key) for key in old if key not in new]
+
+    def compare_groups(self, old_rows, new_rows, result):
+        old = {row[1]: row[2].split('|') for row in old_rows[1:] if len(row) > 2}
+        new = {row[1]: row[2].split('|') for row in new_rows[1:] if len(row) > 2}
+        result['added'] = [name for name in new if name not in old]
+        result['removed'] = [name for name in old if name not in new]
+        for name, members in new.items():
+            if name in old and members != old[name]:
+                old_set, new_set = set(old[name]), set(members)
+                result['changed'].append({
+                    'name': name,
+                    'added': [member for member in members if member not in old_set],
+                    'removed': [member for member in old[name] if member not in new_set],
+                })
+
+    def reimport_needed(self):
+        return self.first_build or bool(self.changed_files)
+
+    def as_dict(self):
+        return {
+            'first_build': self.first_build,
+            'reimport_needed': self.reimport_needed(),
+            'changed_files': self.changed_files,
+            'unchanged_files': self.unchanged_files,
+            'channels': self.channels,
+            'zones': self.zones,
+            'scanlists': self.scanlists,
+        }
+
+    def report(self, limit=10):
+        if self.first_build:
+            return "No previous build in the output directory to compare with."
+        if not self.changed_files:
+            return "Nothing changed since the previous build; there is no need to import the codeplug again."
+        lines = [f"Changed since the previous build: {', '.join(self.changed_files)}"]
+        if self.unchanged_files:
+            lines.append(f"Unchanged (left as they were): {', '.join(self.unchanged_files)}")
+        channels = self.channels
+        lines.append(f"Channels: {len(channels['added'])} added, {len(channels['removed'])} removed, "
+                     f"{len(channels['changed'])} changed, {channels['renumbered']} renumbered")
+        lines.extend(_delta_lines('+', channels['added'], limit))
+        lines.extend(_delta_lines('-', channels['removed'], limit))
+        lines.extend(_delta_lines('~', [f"{change['channel']}: {', '.join(change['fields'])}"
+                                        for change in channels['changed']], limit))
+        for title, groups in (("Zones", self.zones), ("Scanlists", self.scanlists)):
+            lines.append(f"{title}: {len(groups['added'])} added, {len(groups['removed'])} removed, "
+                         f"{len(groups['changed'])} with different channels")
+            lines.extend(_delta_lines('+', groups['added'], limit))
+            lines.extend(_delta_lines('-', groups['removed'], limit))
+            lines.extend(_delta_lines('~', [f"{change['name']}: {len(change['added'])} channel(s) added, "
+                                            f"{len(change['removed'])} removed" for change in groups['changed']], limit))
+        return '\n'.join(lines)
+
+    def write_json(self, filename):
+        with open(filename, 'w', encoding='utf-8') as fh:
+            json.dump(self.as_dict(), fh, indent=2)
+
+def keyed_channel_rows(rows):
+    keyed = {}
+    seen = defaultdict(int)
+    for row in rows[1:]:
+        if len(row) <= CHAN_TX_FREQ:
+            continue
+        key = (row[CHAN_NAME], row[CHAN_RX_FREQ], row[CHAN_TX_FREQ])
+        seen[key] += 1
+        keyed[key + (seen[key],)] = row
+    return keyed
+
+def channel_key_label(key):
+    name, rx_freq, tx_freq, occurrence = key
+    label = f"{name} (RX {rx_freq}, TX {tx_freq})"
+    return label if occurrence == 1 else f"{label} #{occurrence}"
+
+def _delta_lines(marker, items, limit):
+    lines = [f"  {marker} {item}" for item in items[:limit]]
+    if len(items) > limit:
+        lines.append(f"    ... and {len(items) - limit} more")
+    return lines
+
+class RepeaterDirectory:
+    """A bulk repeater directory export, indexed on a latitude/longitude grid.
+
+    Repeaters are bucketed into REPEATER_GRID_DEGREES cells, so a search only looks at the
+    repeaters in the cells around a point or route instead of the whole directory.
+    """
+
+    def __init__(self, rows):
+        self.repeaters = []  # (callsign, location, lat, lon, output Hz, input Hz, color code)
+        self.skipped = 0
+        self.grid = defaultdict(list)
+        header = next(rows, None) or []
+        columns = {name.strip().upper(): index for index, name in enumerate(header)}
+        missing = [name for name in REPEATER_DIRECTORY_COLUMNS if name not in columns]
+        if missing:
+            error(f"Repeater directory is missing the column(s): {', '.join(missing)}")
+        call_col, lat_col, lon_col, out_col, in_col, cc_col = [columns[name] for name in REPEATER_DIRECTORY_COLUMNS]
+        location_col = columns.get("LOCATION")
+        width = max(columns[name] for name in REPEATER_DIRECTORY_COLUMNS) + 1
+        for row in rows:
+            repeater = self.parse_row(row, width, call_col, lat_col, lon_col, out_col, in_col, cc_col, location_col)
+            if repeater is None:
+                self.skipped += 1
+                continue
+            self.grid[grid_cell(repeater[2], repeater[3])].append(len(self.repeaters))
+            self.repeaters.append(repeater)
+
+    @staticmethod
+    def parse_row(row, width, call_col, lat_col, lon_col, out_col, in_col, cc_col, location_col):
+        if len(row) < width:
+            return None
+        try:
+            lat, lon = float(row[lat_col]), float(row[lon_col])
+        except ValueError:
+            return None
+        output_hz, input_hz = parse_frequency(row[out_col]), parse_frequency(row[in_col])
+        color_code = row[cc_col].strip()
+        callsign = row[call_col].strip()
+        if (not callsign or output_hz is None or input_hz is None or not color_code.isdecimal()
+                or not -90 <= lat <= 90 or not -180 <= lon <= 180):
+            return None
+        location = row[location_col].strip() if location_col is not None and location_col < len(row) else ''
+        return callsign, location, lat, lon, output_hz, input_hz, color_code
+
+    def near(self, lat, lon, radius_km):
+        """Indexes of the repeaters within radius_km of a point."""
+        found = set()
+        for index in self.candidates(lat, lat, lon, lon, radius_km):
+            repeater = self.repeaters[index]
+            if distance_km(lat, lon, repeater[2], repeater[3]) <= radius_km:
+                found.add(index)
+        return found
+
+    def along(self, route, radius_km):
+        """Indexes of the repeaters within radius_km of a route given as (lat, lon) points."""
+        if len(route) == 1:
+            return self.near(route[0][0], route[0][1], radius_km)
+        found = set()
+        for (lat1, lon1), (lat2, lon2) in zip(route, route[1:]):
+            for index in self.candidates(min(lat1, lat2), max(lat1, lat2), min(lon1, lon2), max(lon1, lon2), radius_km):
+                if index not in found:
+                    repeater = self.repeaters[index]
+                    if segment_distance_km(repeater[2], repeater[3], lat1, lon1, lat2, lon2) <= radius_km:
+                        found.add(index)
+        return found
+
+    def candidates(self, lat_min, lat_max, lon_min, lon_max, radius_km):
+        """Repeater indexes in the grid cells covering a box grown by radius_km on every side."""
+        lat_margin = radius_km / KM_PER_DEGREE
+        widest = max(abs(lat_min), abs(lat_max)) + lat_margin
+        lon_margin = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(min(widest, 89.9))), 0.001))
+        row_min, col_min = grid_cell(lat_min - lat_margin, lon_min - lon_margin)
+        row_max, col_max = grid_cell(lat_max + lat_margin, lon_max + lon_margin)
+        for grid_row in range(row_min, row_max + 1):
+            for grid_col in range(col_min, col_max + 1):
+                yield from self.grid.get((grid_row, grid_col), ())
+
+    def select(self, points=(), route=(), radius_km=DEFAULT_REPEATER_RADIUS_KM):
+        """The repeaters near any of the points or along the route, in directory order."""
+        found = set()
+        for lat, lon in points:
+            found |= self.near(lat, lon, radius_km)
+        if route:
+            found |= self.along(route, radius_km)
+        return [self.repeaters[index] for index in sorted(found)]
+
+def grid_cell(lat, lon):
+    return math.floor(lat / REPEATER_GRID_DEGREES), math.floor(lon / REPEATER_GRID_DEGREES)
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great circle distance between two points."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * 6371.0 * math.asin(min(1.0, math.sqrt(a)))
+
+def segment_distance_km(lat, lon, lat1, lon1, lat2, lon2):
+    """Distance from a point to a route segment, on a flat projection around the point."""
+    scale = math.cos(math.radians(lat))
+    x1, y1 = (lon1 - lon) * scale, lat1 - lat
+    x2, y2 = (lon2 - lon) * scale, lat2 - lat
+    dx, dy = x2 - x1, y2 - y1
+    length = dx * dx + dy * dy
+    t = 0.0 if length == 0 else max(0.0, min(1.0, -(x1 * dx + y1 * dy) / length))
+    return math.hypot(x1 + t * dx, y1 + t * dy) * KM_PER_DEGREE
+
+def parse_lat_lon(text):
+    """Parse a 'latitude,longitude' pair."""
+    try:
+        lat, lon = (float(part) for part in text.split(','))
+    except ValueError:
+        error(f"Invalid location: '{text}' must be latitude,longitude in degrees, e.g. 45.52,-122.68")
+    return lat, lon
+
+def read_route(filename):
+    """Read a route CSV with Latitude and Longitude columns into (lat, lon) points."""
+    try:
+        rows = read_csv_rows(filename)
+    except OSError as exc:
+        error(f"Can't read the route file: {exc}")
+    columns = {name.strip().upper(): index for index, name in enumerate(rows[0] if rows else [])}
+    if "LATITUDE" not in columns or "LONGITUDE" not in columns:
+        error(f"Route file '{filename}' needs Latitude and Longitude columns")
+    return [parse_lat_lon(f"{row[columns['LATITUDE']]},{row[columns['LONGITUDE']]}") for row in rows[1:] if row]
+
+class BandPlan:
+    """The radio's tuning ranges and the amateur bands, with each band's standard repeater offsets.
+
+    Each kind of range is kept sorted by its low edge with no overlaps, so finding the range
+    holding a frequency is one bisect. A plan without ranges of a kind skips those checks.
+    """
+
+    def __init__(self, rows):
+        ranges = {kind: [] for kind in BAND_PLAN_TYPES}
+        for line, row in enumerate(rows, start=1):
+            if line == 1:
+                if row[:len(BAND_PLAN_HEADERS)] != BAND_PLAN_HEADERS:
+                    error(f"CSV header does not match for band-plan file (expected {', '.join(BAND_PLAN_HEADERS)})")
+                continue
+            if not any(value.strip() for value in row):
+                continue
+            row = [value.strip() for value in row] + [''] * (len(BAND_PLAN_HEADERS) - len(row))
+            kind, name, low, high, offsets = row[:len(BAND_PLAN_HEADERS)]
+            if kind not in BAND_PLAN_TYPES:
+                error(f"Invalid Type '{kind}' on line {line} of the band-plan file (expected Radio or Amateur)")
+            low_hz, high_hz = parse_frequency(low), parse_frequency(high)
+            offset_hz = [parse_frequency(offset) for offset in offsets.split(';') if offset.strip()]
+            if low_hz is None or high_hz is None or low_hz > high_hz or None in offset_hz:
+                error(f"Invalid band '{name}' on line {line} of the band-plan file: "
+                      f"the frequencies must be numbers in MHz, the low edge first")
+            ranges[kind].append((low_hz, high_hz, name, frozenset(offset_hz)))
+        for kind, kind_ranges in ranges.items():
+            kind_ranges.sort()
+            for previous, current in zip(kind_ranges, kind_ranges[1:]):
+                if current[0] <= previous[1]:
+                    error(f"The {kind} ranges '{previous[2]}' and '{current[2]}' overlap in the band-plan file")
+        self.radio_ranges = ranges["Radio"]
+        self.radio_lows = [low for low, _, _, _ in self.radio_ranges]
+        self.amateur_bands = ranges["Amateur"]
+        self.amateur_lows = [low for low, _, _, _ in self.amateur_bands]
+
+    def radio_can_tune(self, freq):
+        return not self.radio_ranges or _find_range(self.radio_ranges, self.radio_lows, freq) is not None
+
+    def amateur_band(self, freq):
+        """The (low, high, name, offsets) band holding freq (Hz), or None."""
+        return _find_range(self.amateur_bands, self.amateur_lows, freq)
+
+    def band_rank(self, freq):
+        """Position of the amateur band holding freq (Hz), lowest band first, or the band count when outside them all."""
+        index = bisect.bisect_right(self.amateur_lows, freq) - 1
+        if index >= 0 and freq <= self.amateur_bands[index][1]:
+            return index
+        return len(self.amateur_bands)
+
+    def radio_range_text(self):
+        return ', '.join(f"{format_mhz(low)}-{format_mhz(high)}" for low, high, _, _ in self.radio_ranges) + " MHz"
+
+def _find_range(ranges, lows, freq):
+    index = bisect.bisect_right(lows, freq) - 1
+    if index >= 0 and freq <= ranges[index][1]:
+        return ranges[index]
+    return None
+
+class CapacityCount:
+    """How much of the radio's memory a codeplug will use, counted from the raw input rows.
+
+    Only counts are kept (channels per zone, base scanlist name and talkgroup), so a count takes
+    a fraction of a build and tells up front whether the codeplug fits.
+    """
+
+    def __init__(self):
+        self.zone_channels = defaultdict(int)
+        self.scanlist_channels = defaultdict(int)  # Before splitting into SCANLIST_LIMIT sized overflow lists
+        self.talkgroup_channels = defaultdict(int)
+        self.talkgroups = 0  # Entries talkgroups.csv will get
+
+    @property
+    def channels(self):
+        return sum(self.zone_channels.values())
+
+    @property
+    def scanlists(self):
+        return sum(-(-count // SCANLIST_LIMIT) for count in self.scanlist_channels.values())
+
+    def totals(self):
+        """(what, used, capacity) for each limit of the radio."""
+        return [("Channels", self.channels, CHANNEL_CAPACITY),
+                ("Zones", len(self.zone_channels), ZONE_CAPACITY),
+                ("Scanlists", self.scanlists, SCANLIST_CAPACITY),
+                ("Talkgroups", self.talkgroups, TALKGROUP_CAPACITY)]
+
+    def over_capacity(self):
+        return [total for total in self.totals() if total[1] > total[2]]
+
+    def truncated_zones(self):
+        return sorted((name, count) for name, count in self.zone_channels.items() if count > ZONE_LIMIT)
+
+    def overflowing_scanlists(self):
+        return sorted((name, count) for name, count in self.scanlist_channels.items() if count > SCANLIST_LIMIT)
+
+    def report(self, limit=10):
+        lines = [f"{'Radio memory':<32}{'Used':>12}{'Capacity':>12}"]
+        for what, used, capacity in self.totals():
+            lines.append(f"{what:<32}{used:>12}{capacity:>12}{'  FULL' if used > capacity else ''}")
+        zones = self.truncated_zones()
+        if zones:
+            lines.append(f"Zones over {ZONE_LIMIT} channels (truncated in zones.csv): {len(zones)}")
+            lines.extend(_delta_lines('!', [f"{name}: {count} channels" for name, count in zones], limit))
+        scanlists = self.overflowing_scanlists()
+        if scanlists:
+            lines.append(f"Scanlists over {SCANLIST_LIMIT} channels (split into _OF lists): {len(scanlists)}")
+            lines.extend(_delta_lines('~', [f"{name}: {count} channels in {-(-count // SCANLIST_LIMIT)} lists"
+                                            for name, count in scanlists], limit))
+        return '\n'.join(lines)
+
+class BuildStats:
+    """Per-stage wall times and counters collected for --timings."""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def counted(self, name, func):
+        """Wrap func so every call bumps the '<name> calls' counter."""
+        counters = self.counters
+        counter_name = f"{name} calls"
+
+        def wrapper(*args):
+            counters[counter_name] += 1
+            return func(*args)
+        return wrapper
+
+    def report(self):
+        lines = [f"{'Stage':<32}{'Seconds':>12}"]
+        for name, seconds in self.stages.items():
+            lines.append(f"{name:<32}{seconds:>12.4f}")
+        lines.append(f"{'Total':<32}{sum(self.stages.values()):>12.4f}")
+        lines.append('')
+        lines.append(f"{'Counter':<32}{'Value':>12}")
+        for name in sorted(self.counters):
+            lines.append(f"{name:<32}{self.counters[name]:>12}")
+        return '\n'.join(lines)
+
+    def write_json(self, filename):
+        with open(filename, 'w', encoding='utf-8') as fh:
+            json.dump({'stages': self.stages, 'counters': dict(sorted(self.counters.items()))}, fh, indent=2)
+
+class CodeplugBuilder:
+    """State for a single codeplug build.
+
+    Every build gets its own builder, so a process can run any number of builds one
+    after another (or side by side) without them sharing zones, scanlists or channel numbers.
+    """
+
+    def __init__(self, sorting='alpha', hotspot_tx_permit='same-color-code', nicknames='off',
+                 talkgroup_sort='input', verbose=True, cache=None, streaming=False, stats=None, log_scanlists=True,
+                 collect_errors=False, duplicate_names='allow', talkgroup_filter='all', include_talkgroups=None,
+                 contact_countries=None, contact_states=None, contact_id_prefixes=None, contact_limit=CONTACT_CAPACITY,
+                 repeater_directory=None, repeater_points=(), repeater_route=(), repeater_radius=DEFAULT_REPEATER_RADIUS_KM,
+                 expansion_jobs=1, channel_sort='auto'):
+        self.line_number = 0
+        self.column_number = None
+        self.file_name = 'none'
+        self.issues = None  # Problems found so far when collecting errors instead of stopping at the first
+        self.sort_mode = self.validate_sort_mode(sorting)
+        self.channel_sort = self.validate_channel_sort(channel_sort)
+        self.hotspot_tx_permit = self.validate_hotspot_mode(hotspot_tx_permit)
+        self.nickname_mode = self.validate_nickname_mode(nicknames)
+        self.talkgroup_sort = self.validate_talkgroup_sort(talkgroup_sort)
+        self.duplicate_names = self.validate_duplicate_names_mode(duplicate_names)
+        self.talkgroup_filter = self.validate_talkgroup_filter(talkgroup_filter)
+        self.include_talkgroups = parse_talkgroup_ids(include_talkgroups) if include_talkgroups else []
+        self.contact_countries = frozenset(value.strip().lower() for value in contact_countries or ())
+        self.contact_states = frozenset(value.strip().lower() for value in contact_states or ())
+        self.contact_id_prefixes = tuple(value.strip() for value in contact_id_prefixes or ())
+        self.contact_limit = self.validate_contact_limit(contact_limit)
+        self.repeater_directory = repeater_directory  # RepeaterDirectory (or its file name) to pick repeaters from
+        self.repeater_points = list(repeater_points)
+        self.repeater_route = list(repeater_route)
+        self.repeater_radius = repeater_radius
+        self.expansion_jobs = expansion_jobs
+        self.verbose = verbose
+        self.log_scanlists = log_scanlists
+        self.cache = cache
+        self.stats = stats
+        if stats is not None:
+            for name in dir(self):
+                if name.startswith('validate_'):
+                    setattr(self, name, stats.counted(name, getattr(self, name)))
+        self.analog_checks = self.compile_column_checks(ANALOG_COLUMN_CHECKS)
+        self.dmr_others_checks = self.compile_column_checks(DMR_OTHERS_COLUMN_CHECKS)
+        self.dmr_repeater_checks = self.compile_column_checks(DMR_REPEATER_COLUMN_CHECKS)
+        self.channel_sort_key = self.select_channel_sort_key()
+        if collect_errors:
+            self.issues = []
+        self.input_keys = {}  # Cache key of each input stage read through the cache
+        self.channel_number = 1
+        self.channel_csv_field_name = {}
+        self.channel_csv_default_value = {}
+        self.channel_csv_default_row = []  # Prebuilt default channel row, compiled once from channel-defaults.csv
+        self.channel_csv_required_fields = []  # Field indices that must be supplied by the channel config
+        self.channel_record_columns = []  # (record position, CSV column) pairs copied into each channel row
+        self.talkgroup_mapping = {}
+        self.band_plan = None  # BandPlan the channel frequencies are checked against, if any
+        self.band_plan_notes = defaultdict(list)  # Warning kind -> (channel name, zone, rx, tx, channels) per input row
+        self.spill_directory = None
+        if streaming:
+            self.spill_directory = tempfile.TemporaryDirectory(prefix='codeplug-')
+        self.zone_config = self.new_member_groups()
+        self.zone_order = {}
+        self.zone_type = {}  # Dictionary to track zone types
+        self.zone_low_freq = {}  # Lowest member RX frequency (Hz) of each zone, for the frequency zone sorts
+        self.scanlist_config = self.new_member_groups()
+        self.talkgroup_config = {}
+        self.talkgroup_order = {}
+        self.scanlist_channel_counts = defaultdict(int)  # Dictionary to track channel counts per scanlist
+        self.scanlist_overflow_number = {}  # Currently open overflow bucket number per base scanlist name
+        self.talkgroup_source = ()  # Talkgroups file name or rows, read again when talkgroups.csv is written
+        self.analog_channel_index = 0
+        self.warnings = []
+        self.delta = None
+        self.unchanged_outputs = []
+        self.channel_names = {}  # Every channel name written so far, mapped to the zone of its first channel
+        self.name_counters = {}  # Next rename counter to try per clashing name
+        self.name_collisions = []
+
+    def new_member_groups(self):
+        if self.spill_directory is None:
+            return MemberGroups()
+        return SpilledMemberGroups(self.spill_directory.name)
+
+    def compile_column_checks(self, column_checks):
+        return [(col, field, getattr(self, validator)) for col, field, validator in column_checks]
+
+    def stage(self, name):
+        return self.stats.stage(name) if self.stats is not None else nullcontext()
+
+    def finish_stats(self):
+        if self.stats is None:
+            return
+        self.stats.count('channels emitted', self.channel_number - 1)
+        self.stats.count('overflow scanlists created', sum(num - 1 for num in self.scanlist_overflow_number.values()))
+
+    def close(self):
+        """Remove the temporary files used by streaming mode."""
+        if self.spill_directory is not None:
+            self.spill_directory.cleanup()
+
+    def write_files(self, output_dir, analog_filename, digital_others_filename, digital_repeaters_filename,
+                    talkgroups_filename, config_directory='config', dmr_id=None, contacts_filename=None, skip=(),
+                    delta=False):
+        """Build the codeplug and write its files; files named in skip are left as they are.
+
+        Files whose content didn't change are not rewritten. With delta, self.delta is set to a
+        CodeplugDelta against the files already in output_dir.
+        """
+        outputs = OutputSet(output_dir)
+        try:
+            with self.stage('talkgroups load'):
+                self.read_talkgroups(talkgroups_filename)
+            with self.stage('channel defaults load'):
+                self.read_channel_csv_default(os.path.join(config_directory, 'channel-defaults.csv'))
+                self.read_band_plan(os.path.join(config_directory, 'band-plan.csv'))
+
+            with open(outputs.path('channels.csv'), 'w', newline='', encoding='utf-8') as fh:
+                csv_out = BulkCsvWriter(fh)
+                self.print_channel_header(csv_out)
+                with gc_paused():
+                    with self.stage('Digital-Others file'):
+                        self.process_dmr_others_file(csv_out, digital_others_filename)
+                    with self.stage('Digital-Repeaters file'):
+                        self.process_dmr_repeater_file(csv_out, digital_repeaters_filename)
+                    with self.stage('Analog file'):
+                        self.process_analog_file(csv_out, analog_filename)
+                csv_out.flush()
+            self.report_name_collisions()
+            self.report_band_plan_notes()
+            self.raise_collected_errors()
+
+            with self.stage('zones.csv'):
+                self.write_zone_file(outputs.path('zones.csv'))
+            with self.stage('scanlists.csv'):
+                self.write_scanlist_file(outputs.path('scanlists.csv'))
+            if 'talkgroups.csv' not in skip:
+                with self.stage('talkgroups.csv'):
+                    self.write_talkgroup_file(outputs.path('talkgroups.csv'))
+
+            if dmr_id and 'radio_id_list.csv' not in skip:
+                with self.stage('radio_id_list.csv'):
+                    write_csv_rows(outputs.path('radio_id_list.csv'), self.radio_id_rows(dmr_id))
+            if contacts_filename and 'digital_contacts.csv' not in skip:
+                with self.stage('digital_contacts.csv'):
+                    write_csv_rows(outputs.path('digital_contacts.csv'), self.digital_contact_file_rows(contacts_filename))
+            if delta:
+                self.delta = CodeplugDelta(outputs)
+            outputs.commit()
+            self.unchanged_outputs = outputs.unchanged
+            self.finish_stats()
+        finally:
+            outputs.discard()
+            self.close()
+
+    def check_files(self, analog_filename, digital_others_filename, digital_repeaters_filename,
+                    talkgroups_filename, config_directory='config'):
+        """Validate every row of every input file without writing any output."""
+        try:
+            self.read_talkgroups(talkgroups_filename)
+            self.read_channel_csv_default(os.path.join(config_directory, 'channel-defaults.csv'))
+            self.read_band_plan(os.path.join(config_directory, 'band-plan.csv'))
+            channels = NullWriter()
+            with gc_paused():
+                self.process_dmr_others_file(channels, digital_others_filename)
+                self.process_dmr_repeater_file(channels, digital_repeaters_filename)
+                self.process_analog_file(channels, analog_filename)
+            self.report_name_collisions()
+            self.report_band_plan_notes()
+            self.raise_collected_errors()
+        finally:
+            self.close()
+
+    def count_capacity(self, analog_filename, digital_others_filename, digital_repeaters_filename,
+                       talkgroups_filename):
+        """Count the channels, zones, scanlists and talkgroups the inputs will produce, as a CapacityCount.
+
+        Nothing is validated or built: rows too short to be used are skipped and every time slot
+        cell of the repeater matrix counts as a channel, so on good inputs the counts are exact.
+        """
+        count = CapacityCount()
+        zone_channels, scanlist_channels = count.zone_channels, count.scanlist_channels
+        for filename, headers in ((digital_others_filename, DIGITAL_OTHERS_HEADERS), (analog_filename, ANALOG_HEADERS)):
+            with open(filename, 'r', newline='', encoding='utf-8-sig') as fh:
+                for row in islice(csv.reader(fh), 1, None):
+                    if len(row) == len(headers):
+                        zone_channels[row[0]] += 1
+                        scanlist_channels[row[0]] += 1
+                        if headers is DIGITAL_OTHERS_HEADERS:
+                            count.talkgroup_channels[row[7]] += 1
+
+        if self.repeater_directory is not None:
+            rows = iter(self.selected_repeater_rows(read_csv_rows(digital_repeaters_filename)))
+            self.count_repeater_capacity(count, rows)
+        else:
+            with open(digital_repeaters_filename, 'r', newline='', encoding='utf-8-sig') as fh:
+                self.count_repeater_capacity(count, csv.reader(fh))
+
+        used = count.talkgroup_channels
+        names = set()
+        with open(talkgroups_filename, 'r', newline='', encoding='utf-8-sig') as fh:
+            for row in islice(csv.reader(fh), 1, None):
+                if len(row) < 2 or row[1].strip() in names:
+                    continue  # Only the first row of each talkgroup name is used
+                names.add(row[1].strip())
+                if self.talkgroup_filter == 'all' or row[1].strip() in used or (
+                        row[0].strip().isdecimal() and self.is_included_talkgroup(int(row[0].strip()))):
+                    count.talkgroups += 1
+        return count
+
+    def count_repeater_capacity(self, count, rows):
+        width = len(DIGITAL_REPEATER_HEADERS)
+        header = next(rows, [])
+        column_channels = [0] * len(header)
+        channel_timeslots = VALID_TIMESLOTS - {VAL_NO_TIME_SLOT}
+        for row in rows:
+            if len(row) < width:
+                continue
+            zone_name = handle_nickname_values(row[0])[0]
+            if len(row) == width:
+                count.zone_channels[zone_name] += 1
+                count.scanlist_channels[zone_name] += 1
+                continue
+            channels = 0
+            for col in range(width, min(len(row), len(header))):
+                if row[col].split(';', 1)[0] in channel_timeslots:
+                    column_channels[col] += 1
+                    channels += 1
+            if channels:  # A row with no time slots gets no channels, so it makes no zone either
+                count.zone_channels[zone_name] += channels
+        for col in range(width, len(header)):
+            if column_channels[col]:
+                talkgroup = handle_nickname_values(header[col])[0]
+                count.scanlist_channels[talkgroup] += column_channels[col]
+                count.talkgroup_channels[talkgroup] += column_channels[col]
+
+    def raise_collected_errors(self):
+        if self.issues:
+            raise ValidationError(self.issues)
+
+    def build_tables(self, talkgroups, analog, digital_others, digital_repeaters, channel_defaults=None, dmr_id=None,
+                     band_plan=None):
+        try:
+            self.load_talkgroups(talkgroups)
+            if channel_defaults is None:
+                self.read_channel_csv_default(os.path.join(DEFAULT_CONFIG_DIRECTORY, 'channel-defaults.csv'))
+            else:
+                self.load_channel_csv_default(channel_defaults)
+            if band_plan is None:
+                self.read_band_plan(os.path.join(DEFAULT_CONFIG_DIRECTORY, 'band-plan.csv'))
+            else:
+                self.load_band_plan(band_plan)
+
+            if self.repeater_directory is not None:
+                digital_repeaters = self.selected_repeater_rows(list(digital_repeaters))
+
+            channels = RowCollector()
+            self.print_channel_header(channels)
+            with gc_paused():
+                self.process_dmr_others_rows(channels, digital_others)
+                self.process_dmr_repeater_rows(channels, digital_repeaters)
+                self.process_analog_rows(channels, analog)
+            self.report_name_collisions()
+            self.report_band_plan_notes()
+            self.raise_collected_errors()
+
+            tables = {
+                'channels.csv': channels,
+                'zones.csv': list(self.zone_rows()),
+                'scanlists.csv': list(self.scanlist_rows()),
+                'talkgroups.csv': list(self.talkgroup_rows()),
+            }
+            if dmr_id:
+                tables['radio_id_list.csv'] = self.radio_id_rows(dmr_id)
+            self.finish_stats()
+            return tables
+        finally:
+            self.close()
+
+    # CSV Output Routines
+    def write_zone_file(self, filename):
+        write_csv_rows(filename, self.zone_rows())
+
+    def write_scanlist_file(self, filename):
+        write_csv_rows(filename, self.scanlist_rows())
+
+    def write_talkgroup_file(self, filename):
+        write_csv_rows(filename, self.talkgroup_rows())
+
+    def zone_rows(self):
+        headers = ["No.", "Zone Name", "Zone Channel Member", "Zone Channel Member RX Frequency", "Zone Channel Member TX Frequency",
+                   "A Channel", "A Channel RX Frequency", "A Channel TX Frequency",
+                   "B Channel", "B Channel RX Frequency", "B Channel TX Frequency"]
+        return self.generate_csv_rows(headers, self.zone_config, self.zone_row_builder, self.zone_sort_key(), ZONE_LIMIT)
+
+    def scanlist_rows(self):
+        headers = ["No.", "Scan List Name", "Scan Channel Member", "Scan Channel Member RX Frequency", "Scan Channel Member TX Frequency",
+                   "Scan Mode", "Priority Channel Select", "Priority Channel 1", "Priority Channel 1 RX Frequency",
+                   "Priority Channel 1 TX Frequency", "Priority Channel 2", "Priority Channel 2 RX Frequency",
+                   "Priority Channel 2 TX Frequency", "Revert Channel", "Look Back Time A[s]", "Look Back Time B[s]",
+                   "Dropout Delay Time[s]", "Dwell Time[s]"]
+        return self.generate_csv_rows(headers, self.scanlist_config, self.scanlist_row_builder, str.lower, SCANLIST_LIMIT,
+                                      log_scanlists=True)
+
+    def talkgroup_rows(self):
+        """Yield the talkgroups.csv rows, filtering the talkgroups input as it is read."""
+        yield ["No.", "Radio ID", "Name", "Country", "Remarks", "Call Type", "Call Alert"]
+        talkgroups = self.talkgroup_entries(used_only=self.talkgroup_filter == 'used')
+        if self.talkgroup_sort == 'id':
+            talkgroups = sorted(talkgroups, key=attrgetter('id_number'))
+        elif self.talkgroup_sort == 'name':
+            talkgroups = sorted(talkgroups, key=lambda x: x.name.lower())
         # else: 'input', keep original order
-        row_num = 1
-        for tg in talkgroups:
-            csv_out.writerow([row_num, tg[0], tg[1], "", "", tg[2], tg[3]])
-            row_num += 1
+        for row_num, tg in enumerate(talkgroups, start=1):
+            yield [row_num, tg.radio_id, tg.name, "", "", tg.call_type, tg.call_alert]
 
-def write_radio_id_list(dmr_id, output_dir):
-    headers = ["No.", "Radio ID", "Name"]
-    with open(os.path.join(output_dir, 'radio_id_list.csv'), 'w', newline='', encoding='utf-8') as fh:
-        csv_out = csv.writer(fh, quoting=csv.QUOTE_ALL, lineterminator='\r\n')
-        csv_out.writerow(headers)
+    def is_included_talkgroup(self, id_number):
+        for low, high in self.include_talkgroups:
+            if low <= id_number <= high:
+                return True
+        return False
+
+    def radio_id_rows(self, dmr_id):
+        headers = ["No.", "Radio ID", "Name"]
         # Validate DMR ID
         try:
             dmr_id_num = int(dmr_id)
@@ -158,326 +1489,1222 @@ def write_radio_id_list(dmr_id, output_dir):
         dmr_name = 'DMR ID'  # Use DMR ID as name for consistency
         if len(dmr_name) > LENGTH_CHAN_NAME:
             error(f"Invalid DMR ID name: '{dmr_name}' is more than {LENGTH_CHAN_NAME} characters")
-        csv_out.writerow([1, dmr_id, dmr_name])
-
-def zone_row_builder(zone_number, zone_name, zone_record):
-    return generic_row_builder(zone_number, zone_name, zone_record, _zone_row_details, 250, "Zone")
-
-def scanlist_row_builder(scan_number, scan_name, scan_record):
-    return generic_row_builder(scan_number, scan_name, scan_record, _scanlist_row_details, SCANLIST_LIMIT, "Scanlist")
-
-def generic_row_builder(row_number, name, row_record, details_func, row_limit, warning_name):
-    values = [row_number, name]
-    channels = []
-    rx_freqs = []
-    tx_freqs = []
-    i = 0
-    for row_details in sorted(row_record, key=lambda x: x.lower()):
-        order, chan_name, rx_freq, tx_freq = row_details.split('\t')
-        chan_name = chan_name.rstrip()
-        if row_limit > 0 and i >= row_limit:
-            warning(f"{warning_name} '{name}' has more than {row_limit} channels. "
-                    f"It has been truncated to the first {row_limit} channels to keep the CPS software happy.")
-            break
-        channels.append(chan_name)
-        rx_freqs.append(rx_freq)
-        tx_freqs.append(tx_freq)
-        i += 1
-    values.append('|'.join(channels))
-    values.append('|'.join(rx_freqs))
-    values.append('|'.join(tx_freqs))
-    details_func(values, channels[0] if channels else '', rx_freqs[0] if rx_freqs else '', tx_freqs[0] if tx_freqs else '')
-    return values
-
-def _zone_row_details(values, channel0, rx0, tx0):
-    values.extend([channel0, rx0, tx0, channel0, rx0, tx0])
-
-def _scanlist_row_details(values, channel0, rx0, tx0):
-    values.extend(["Off", "Off", "", "", "", "", "", "Selected", "0.5", "0.5", "0.1", "0.1"])
-
-def generate_csv_file(filename, headers, data, row_func, sort_key_func, log_scanlists=False):
-    with open(filename, 'w', newline='', encoding='utf-8') as fh:
-        csv_out = csv.writer(fh, quoting=csv.QUOTE_ALL, lineterminator='\r\n')
-        csv_out.writerow(headers)
+        return [headers, [1, dmr_id, dmr_name]]
+
+    def digital_contact_file_rows(self, filename):
+        """digital_contact_rows for a RadioID.net user dump file, read as the rows are written."""
+        with open(filename, 'r', newline='', encoding='utf-8-sig', errors='replace') as fh:
+            yield from self.digital_contact_rows(csv.reader(fh))
+
+    def digital_contact_rows(self, rows):
+        """Yield the Digital Contact List rows for a RadioID.net user dump, one row at a time.
+
+        Contacts are filtered by country, state and ID prefix, deduplicated by DMR ID (with a
+        bitmap, so memory doesn't grow with the dump), trimmed to the radio's field lengths and
+        capped at contact_limit.
+        """
+        header = next(rows, None) or []
+        columns = {name.strip().upper(): index for index, name in enumerate(header)}
+        missing = [name for name in RADIOID_COLUMNS if name not in columns]
+        if missing:
+            error(f"RadioID contacts file is missing the column(s): {', '.join(missing)}")
+        id_col, call_col, first_col, last_col, city_col, state_col, country_col = [columns[name] for name in RADIOID_COLUMNS]
+        width = max(columns[name] for name in RADIOID_COLUMNS) + 1
+        countries, states, prefixes = self.contact_countries, self.contact_states, self.contact_id_prefixes
+        seen = bytearray(DMR_ID_LIMIT // 8)
+        count = duplicates = invalid = 0
+        yield DIGITAL_CONTACT_HEADERS
+        for row in rows:
+            radio_id = row[id_col].strip() if len(row) >= width else ''
+            if not radio_id.isdecimal() or int(radio_id) >= DMR_ID_LIMIT:
+                invalid += 1
+                continue
+            if countries and row[country_col].strip().lower() not in countries:
+                continue
+            if states and row[state_col].strip().lower() not in states:
+                continue
+            if prefixes and not radio_id.startswith(prefixes):
+                continue
+            id_number = int(radio_id)
+            byte, bit = id_number >> 3, 1 << (id_number & 7)
+            if seen[byte] & bit:
+                duplicates += 1
+                continue
+            if count == self.contact_limit:
+                self.warning(f"The digital contact list has been capped at {self.contact_limit} contacts. "
+                             f"Use the contact filters to choose which contacts to keep.")
+                break
+            seen[byte] |= bit
+            count += 1
+            name = f"{row[first_col].strip()} {row[last_col].strip()}".strip()
+            yield [count, radio_id, row[call_col].strip()[:LENGTH_CONTACT_CALLSIGN], name[:LENGTH_CONTACT_FIELD].rstrip(),
+                   row[city_col].strip()[:LENGTH_CONTACT_FIELD], row[state_col].strip()[:LENGTH_CONTACT_FIELD],
+                   row[country_col].strip()[:LENGTH_CONTACT_FIELD], "", VAL_CALL_TYPE_PRIVATE, "None"]
+        if invalid:
+            self.warning(f"Skipped {invalid} row(s) of the RadioID contacts file without a valid DMR ID.")
+        if self.stats is not None:
+            self.stats.count('contacts written', count)
+            self.stats.count('duplicate contacts skipped', duplicates)
+
+    def zone_row_builder(self, zone_number, zone_name, zone_record):
+        return self.generic_row_builder(zone_number, zone_name, zone_record, _zone_row_details, ZONE_LIMIT, "Zone")
+
+    def scanlist_row_builder(self, scan_number, scan_name, scan_record):
+        return self.generic_row_builder(scan_number, scan_name, scan_record, _scanlist_row_details, SCANLIST_LIMIT, "Scanlist")
+
+    def generic_row_builder(self, row_number, name, row_record, details_func, row_limit, warning_name):
+        values = [row_number, name]
+        members = sorted(row_record, key=member_sort_key)
+        if row_limit > 0 and len(members) > row_limit:
+            self.warning(f"{warning_name} '{name}' has more than {row_limit} channels. "
+                         f"It has been truncated to the first {row_limit} channels to keep the CPS software happy.")
+            if self.stats is not None:
+                self.stats.count(f"{warning_name.lower()} truncations")
+            del members[row_limit:]
+        channels = [member.name for member in members]
+        rx_freqs = [format_frequency(member.rx_freq) for member in members]
+        tx_freqs = [format_frequency(member.tx_freq) for member in members]
+        values.append('|'.join(channels))
+        values.append('|'.join(rx_freqs))
+        values.append('|'.join(tx_freqs))
+        details_func(values, channels[0] if channels else '', rx_freqs[0] if rx_freqs else '', tx_freqs[0] if tx_freqs else '')
+        return values
+
+    def generate_csv_rows(self, headers, data, row_func, sort_key_func, row_limit, log_scanlists=False):
+        if isinstance(data, SpilledMemberGroups):
+            return self.generate_spilled_csv_rows(headers, data, row_func, sort_key_func, row_limit, log_scanlists)
+        output = [headers]
         row_num = 1
         for key in sorted(data.keys(), key=sort_key_func):
-            row = row_func(row_num, key, data[key])
-            csv_out.writerow(row)
-            if log_scanlists:
+            output.append(row_func(row_num, key, data[key]))
+            if log_scanlists and self.log_scanlists and self.verbose:
                 channel_count = len(data[key])
                 print(f"Scanlist '{key}' contains {channel_count} channels")
             row_num += 1
-
-def print_channel_header(csv_out):
-    output = [channel_csv_field_name[index] for index in sorted(channel_csv_field_name.keys())]
-    csv_out.writerow(output)
-
-# Sort Functions
-def zone_sort_key(a):
-    a_i = zone_order.get(a, 9999)
-    if global_sort_mode == 'alpha':
-        return a.lower()
-    elif global_sort_mode == 'repeaters-first':
-        return (0 if zone_type.get(a, 'analog') == 'digital_repeaters' else 1, a.lower())
-    elif global_sort_mode == 'analog-first':
-        return (0 if zone_type.get(a, 'digital') == 'analog' else 1, a.lower())
-    elif global_sort_mode == 'analog_and_others_first':
-        group_key = 0 if zone_type.get(a, 'digital_repeaters') in ['analog', 'digital_others'] else 1
-        return (group_key, a.lower())
-    return f"{a_i:04d}{a.lower()}"
-
-# CSV Input Routines
-def process_analog_file(csv_out, filename):
-    headers = ["Zone", "Channel Name", "Bandwidth", "Power", "RX Freq", "TX Freq", "CTCSS Decode", "CTCSS Encode", "TX Prohibit"]
-    process_csv_file_with_header(csv_out, filename, "Analog", headers, analog_csv_field_extractor)
-
-def analog_csv_field_extractor(row):
-    chan_config = {
-        CHAN_SCANLIST_NAME: validate_zone(row[0]),
-        CHAN_NAME: validate_name(row[1]),
-        CHAN_BANDWIDTH: validate_bandwidth(row[2]),
-        CHAN_POWER: validate_power(row[3]),
-        CHAN_RX_FREQ: validate_freq(row[4]),
-        CHAN_TX_FREQ: validate_freq(row[5]),
-        CHAN_CTCSS_DEC: validate_ctcss(row[6]),
-        CHAN_CTCSS_ENC: validate_ctcss(row[7]),
-        CHAN_TX_PROHIBIT: validate_tx_prohibit(row[8]),
-        CHAN_PTT_PROHIBIT: validate_tx_prohibit(row[8]),
-        CHAN_MODE: VAL_ANALOG
-    }
-    if chan_config[CHAN_CTCSS_DEC] != "Off":
-        chan_config[CHAN_SQUELCH_MODE] = VAL_CTCSS_DCS
-    return chan_config
-
-def process_dmr_others_file(csv_out, filename):
-    headers = ["Zone", "Channel Name", "Power", "RX Freq", "TX Freq", "RX Color Code", "TX Color Code", "Talk Group", "TimeSlot", "Call Type", "TX Permit"]
-    process_csv_file_with_header(csv_out, filename, "Digital-Others", headers, dmr_others_csv_field_extractor)
-
-def dmr_others_csv_field_extractor(row):
-    talkgroup = row[7]
-    if talkgroup not in talkgroup_mapping:
-        error(f"Talkgroup '{talkgroup}' is referenced in Digital-Others.csv but not defined in TalkGroups.csv {_file_and_line()}")
-    rx_color_code = validate_color_code(row[5])
-    tx_color_code = validate_color_code(row[6] if len(row) > 6 and row[6].strip() else row[5])  # Use RX Color Code if TX Color Code is empty
-    chan_config = {
-        CHAN_SCANLIST_NAME: validate_zone(row[0]),
-        CHAN_NAME: validate_name(row[1]),
-        CHAN_POWER: validate_power(row[2]),
-        CHAN_RX_FREQ: validate_freq(row[3]),
-        CHAN_TX_FREQ: validate_freq(row[4]),
-        CHAN_RX_COLOR_CODE: rx_color_code,
-        CHAN_TX_COLOR_CODE: tx_color_code,
-        55: tx_color_code,  # Set TxCC directly at index 55
-        CHAN_CONTACT: validate_contact(talkgroup),
-        CHAN_TG_ID: talkgroup_mapping[talkgroup],
-        CHAN_TIME_SLOT: validate_timeslot(row[8]),
-        CHAN_CALL_TYPE_OLD: validate_call_type(row[9]),
-        CHAN_TX_PERMIT: validate_tx_permit(row[10]),
-        CHAN_MODE: VAL_DIGITAL
-    }
-    chan_config[CHAN_DMR_MODE] = dmr_mode(chan_config)
-    return chan_config
-
-def process_dmr_repeater_file(csv_out, filename):
-    headers = ["Zone Name", "Comment", "Power", "RX Freq", "TX Freq", "Color Code"]
-    process_csv_file_with_header(csv_out, filename, "Digital-Repeater", headers, dmr_repeater_csv_field_extractor, dmr_repeater_csv_matrix_extractor)
-
-def dmr_repeater_csv_field_extractor(row):
-    zone_full, zone_nick = handle_nickname_values(row[0])
-    rx_color_code = validate_color_code(row[5])
-    tx_color_code = validate_color_code(row[5])  # Use RX Color Code as TX Color Code
-    chan_config = {
-        CHAN_SCANLIST_NAME: validate_zone(zone_full),
-        ACB_ZONE_NICKNAME: validate_zone(zone_nick),
-        CHAN_POWER: validate_power(row[2]),
-        CHAN_RX_FREQ: validate_freq(row[3]),
-        CHAN_TX_FREQ: validate_freq(row[4]),
-        CHAN_RX_COLOR_CODE: rx_color_code,
-        CHAN_TX_COLOR_CODE: tx_color_code,
-        55: tx_color_code,  # Set TxCC directly at index 55
-        CHAN_MODE: VAL_DIGITAL
-    }
-    chan_config[CHAN_DMR_MODE] = dmr_mode(chan_config)
-    return chan_config
-
-def dmr_repeater_csv_matrix_extractor(chan_config, contact, value, headers, row, col):
-    do_multiply = False
-    timeslot, call_type = handle_repeater_value(value)
-    timeslot = validate_timeslot(timeslot)
-    if timeslot != VAL_NO_TIME_SLOT:
-        contact, chan_nick = handle_nickname_values(contact)
-        chan_name = make_channel_name(chan_config[ACB_ZONE_NICKNAME], contact, chan_nick)
-        chan_config[CHAN_CONTACT] = validate_contact(contact)
-        chan_config[CHAN_TG_ID] = talkgroup_mapping[contact]
-        chan_config[CHAN_TIME_SLOT] = timeslot
-        chan_config[CHAN_NAME] = validate_channel_name(chan_name)
-        chan_config[CHAN_CALL_TYPE_OLD] = validate_call_type(call_type)
-        do_multiply = True
-    return do_multiply, chan_config
-
-def read_channel_csv_default(filename):
-    with open(filename, 'r', newline='', encoding='utf-8-sig') as fh:
-        csv_reader = csv.reader(fh)
-        for row in csv_reader:
-            channel_csv_field_name[int(row[0])] = row[1]
-            channel_csv_default_value[int(row[0])] = row[2]
-
-def read_talkgroups(filename):
-    global talkgroup_mapping, talkgroup_order, all_talkgroups
-    index = 1
-    with open(filename, 'r', newline='', encoding='utf-8-sig') as fh:
-        csv_reader = csv.reader(fh)
-        for row in csv_reader:
-            all_talkgroups.append(row)  # Store every row, including header
+        return output
+
+    def generate_spilled_csv_rows(self, headers, data, row_func, sort_key_func, row_limit, log_scanlists=False):
+        """Yield the rows for spilled membership without holding every member in memory.
+
+        The merged runs come out grouped by name, so each group's first row_limit + 1 members
+        (enough to build the row and spot truncation) are parked in a temporary file and
+        read back in the requested sort order.
+        """
+        yield headers
+        offsets = {}
+        with tempfile.TemporaryFile(dir=data.directory) as fh:
+            for name, members in data.groups():
+                offsets[name] = fh.tell()
+                pickle.dump(list(islice(members, row_limit + 1)), fh, protocol=pickle.HIGHEST_PROTOCOL)
+            row_num = 1
+            for key in sorted(offsets, key=sort_key_func):
+                fh.seek(offsets[key])
+                yield row_func(row_num, key, pickle.load(fh))
+                if log_scanlists and self.log_scanlists and self.verbose:
+                    print(f"Scanlist '{key}' contains {data.counts[key]} channels")
+                row_num += 1
+
+    def print_channel_header(self, csv_out):
+        output = [self.channel_csv_field_name[index] for index in sorted(self.channel_csv_field_name.keys())]
+        csv_out.writerow(output)
+
+    # Sort Functions
+    def zone_sort_key(self):
+        """Return the key function for the zone sorting mode; the mode is only looked at once per sort."""
+        zone_type = self.zone_type
+        zone_low_freq = self.zone_low_freq
+        if self.sort_mode == 'repeaters-first':
+            return lambda a: (zone_type.get(a, 'analog') != 'digital_repeaters', a.lower())
+        elif self.sort_mode == 'analog-first':
+            return lambda a: (zone_type.get(a, 'digital') != 'analog', a.lower())
+        elif self.sort_mode == 'analog_and_others_first':
+            return lambda a: (zone_type.get(a, 'digital_repeaters') == 'digital_repeaters', a.lower())
+        elif self.sort_mode == 'frequency':
+            return lambda a: (zone_low_freq.get(a, 0), a.lower())
+        elif self.sort_mode == 'band-frequency':
+            band_rank = self.band_rank
+            return lambda a: (band_rank(zone_low_freq.get(a, 0)), zone_low_freq.get(a, 0), a.lower())
+        return str.lower
+
+    def select_channel_sort_key(self):
+        """Pick the method that computes a zone/scanlist member's sort key for the channel sorting mode."""
+        if self.channel_sort == 'frequency':
+            return self.frequency_channel_key
+        elif self.channel_sort == 'band-frequency':
+            return self.band_frequency_channel_key
+        elif self.channel_sort == 'talkgroup-id':
+            return self.talkgroup_id_channel_key
+        elif self.sort_mode == 'alpha':
+            return self.name_channel_key
+        return self.talkgroup_order_channel_key
+
+    def name_channel_key(self, chan_config, rx_freq, tx_freq):
+        return chan_config[REC_NAME].lower(), rx_freq, tx_freq
+
+    def talkgroup_order_channel_key(self, chan_config, rx_freq, tx_freq):
+        """Talkgroup input order for digital channels, then analog channels in the order they were added."""
+        talkgroup_index = 9999
+        analog_index = 0
+        if chan_config[REC_MODE] == VAL_DIGITAL:
+            talkgroup_index = self.talkgroup_order.get(chan_config[REC_CONTACT], 9999)
+        elif chan_config[REC_MODE] == VAL_ANALOG:
+            analog_index = self.analog_channel_index
+            self.analog_channel_index += 1
+        return talkgroup_index, analog_index, chan_config[REC_NAME].lower(), rx_freq, tx_freq
+
+    def frequency_channel_key(self, chan_config, rx_freq, tx_freq):
+        return rx_freq, tx_freq, chan_config[REC_NAME].lower()
+
+    def band_frequency_channel_key(self, chan_config, rx_freq, tx_freq):
+        return self.band_rank(rx_freq), rx_freq, tx_freq, chan_config[REC_NAME].lower()
+
+    def band_rank(self, freq):
+        """The band-frequency sorts' band order, from band-plan.csv; without a band plan they sort by frequency alone."""
+        return self.band_plan.band_rank(freq) if self.band_plan is not None else 0
+
+    def talkgroup_id_channel_key(self, chan_config, rx_freq, tx_freq):
+        """Digital channels by talkgroup ID, then analog channels, each group by frequency."""
+        if chan_config[REC_MODE] == VAL_DIGITAL:
+            tg_id = chan_config[REC_TG_ID] or ''
+            return 0, int(tg_id) if tg_id.isdigit() else DMR_ID_LIMIT, rx_freq, tx_freq, chan_config[REC_NAME].lower()
+        return 1, 0, rx_freq, tx_freq, chan_config[REC_NAME].lower()
+
+    # CSV Input Routines
+    def process_analog_file(self, csv_out, filename):
+        self.process_input_file(csv_out, 'analog', filename, self.extract_analog_rows, self.hotspot_tx_permit)
+
+    def process_analog_rows(self, csv_out, rows):
+        self.emit_channel_records(csv_out, self.extract_analog_rows(rows))
+
+    def extract_analog_rows(self, rows):
+        return self.extract_rows_with_header(rows, "Analog", ANALOG_HEADERS, self.analog_csv_field_extractor)
+
+    def analog_csv_field_extractor(self, row):
+        chan_config = self.check_columns(row, self.analog_checks)
+        chan_config[REC_MODE] = VAL_ANALOG
+        if chan_config[REC_CTCSS_DEC] != "Off":
+            chan_config[REC_SQUELCH_MODE] = VAL_CTCSS_DCS
+        return chan_config
+
+    def process_dmr_others_file(self, csv_out, filename):
+        self.process_input_file(csv_out, 'digital-others', filename, self.extract_dmr_others_rows,
+                                self.hotspot_tx_permit, self.input_keys.get('talkgroups'))
+
+    def process_dmr_others_rows(self, csv_out, rows):
+        self.emit_channel_records(csv_out, self.extract_dmr_others_rows(rows))
+
+    def extract_dmr_others_rows(self, rows):
+        return self.extract_rows_with_header(rows, "Digital-Others", DIGITAL_OTHERS_HEADERS,
+                                             self.dmr_others_csv_field_extractor)
+
+    def dmr_others_csv_field_extractor(self, row):
+        chan_config = self.check_columns(row, self.dmr_others_checks)
+        self.column_number = 6
+        if row[6].strip():
+            tx_color_code = self.validate_color_code(row[6])
+        else:
+            tx_color_code = chan_config[REC_RX_COLOR_CODE]  # Use RX Color Code if TX Color Code is empty
+        self.column_number = 7
+        talkgroup = row[7]
+        if talkgroup not in self.talkgroup_mapping:
+            self.invalid(f"Talkgroup '{talkgroup}' is referenced in Digital-Others.csv but not defined in TalkGroups.csv")
+        chan_config[REC_TX_COLOR_CODE] = tx_color_code
+        chan_config[REC_CONTACT] = self.validate_contact(talkgroup)
+        chan_config[REC_TG_ID] = self.talkgroup_mapping.get(talkgroup, '')
+        chan_config[REC_MODE] = VAL_DIGITAL
+        chan_config[REC_DMR_MODE] = dmr_mode(chan_config)
+        return chan_config
+
+    def process_dmr_repeater_file(self, csv_out, filename):
+        if self.repeater_directory is not None:
+            self.process_dmr_repeater_rows(csv_out, self.selected_repeater_rows(read_csv_rows(filename)))
+            return
+        self.process_input_file(csv_out, 'digital-repeaters', filename, self.extract_dmr_repeater_rows,
+                                self.hotspot_tx_permit, self.nickname_mode, self.input_keys.get('talkgroups'))
+
+    def process_dmr_repeater_rows(self, csv_out, rows):
+        self.emit_channel_records(csv_out, self.extract_dmr_repeater_rows(rows))
+
+    def selected_repeater_rows(self, template_rows):
+        """Digital-Repeaters rows for the directory repeaters near the chosen points or route.
+
+        The template is a Digital-Repeaters sheet: its header gives the talkgroup columns and its
+        first row gives the Power and the time slot cells used for every selected repeater.
+        """
+        if len(template_rows) < 2:
+            error("The Digital-Repeaters file needs a header and a template row when picking repeaters from a directory")
+        directory = self.repeater_directory
+        if not isinstance(directory, RepeaterDirectory):
+            try:
+                with open(directory, 'r', newline='', encoding='utf-8-sig') as fh:
+                    directory = RepeaterDirectory(csv.reader(fh))
+            except OSError as exc:
+                error(f"Can't read the repeater directory: {exc}")
+            if directory.skipped:
+                self.warning(f"Skipped {directory.skipped} row(s) of the repeater directory with missing or invalid values.")
+            self.repeater_directory = directory
+        template = template_rows[1]
+        rows = [template_rows[0]]
+        for callsign, location, _, _, output_hz, input_hz, color_code in directory.select(
+                self.repeater_points, self.repeater_route, self.repeater_radius):
+            zone_name = f"{callsign} {format_mhz(output_hz)}"
+            if len(zone_name) > 16:
+                zone_name = callsign[:16]
+            rows.append([f"{zone_name};{callsign[:16]}", location, template[2], format_frequency(output_hz),
+                         format_frequency(input_hz), color_code] + template[6:])
+        if self.stats is not None:
+            self.stats.count('directory repeaters selected', len(rows) - 1)
+        return rows
+
+    def extract_dmr_repeater_rows(self, rows):
+        headers = DIGITAL_REPEATER_HEADERS
+        if self.expansion_jobs > 1 and self.spill_directory is None:
+            rows = rows if isinstance(rows, list) else list(rows)
+            if len(rows) > 2 and (len(rows) - 1) * (len(rows[0]) - len(headers)) >= PARALLEL_EXPANSION_MIN_CELLS:
+                return self.extract_dmr_repeater_rows_in_parallel(rows, headers)
+        return self.extract_rows_with_header(rows, "Digital-Repeater", headers, self.dmr_repeater_csv_field_extractor,
+                                             self.dmr_repeater_csv_matrix_extractor)
+
+    def extract_dmr_repeater_rows_in_parallel(self, rows, headers):
+        """Expand the repeater matrix in chunks on a process pool, yielding the records in file order.
+
+        Workers only validate and expand rows; zone order is renumbered here and channel numbers,
+        overflow scanlists and the analog index are still assigned serially by
+        emit_channel_records, so the output is the same as a serial run.
+        """
+        issue_count = len(self.issues) if self.issues is not None else 0
+        list(self.extract_rows_with_header(rows[:1], "Digital-Repeater", headers, self.dmr_repeater_csv_field_extractor))
+        if self.issues and len(self.issues) > issue_count:
+            return  # Bad header, already reported
+        data_rows = len(rows) - 1
+        chunk_size = -(-data_rows // (self.expansion_jobs * EXPANSION_CHUNKS_PER_JOB))
+        tasks = [(rows[0], rows[start:start + chunk_size], start - 1) for start in range(1, len(rows), chunk_size)]
+        worker_state = ({'hotspot_tx_permit': self.hotspot_tx_permit, 'nicknames': self.nickname_mode,
+                         'collect_errors': self.issues is not None}, self.talkgroup_mapping, self.stats is not None)
+        from concurrent.futures import ProcessPoolExecutor
+        zone_order_index = 1
+        with ProcessPoolExecutor(max_workers=self.expansion_jobs, initializer=_init_expansion_worker,
+                                 initargs=worker_state) as executor:
+            for records, issues, counters in executor.map(_expand_repeater_chunk, tasks):
+                if issues:
+                    self.issues.extend(issues)
+                if counters:
+                    for name, value in counters.items():
+                        self.stats.count(name, value)
+                for zone_name, zone_type, _, channels in records:
+                    yield zone_name, zone_type, zone_order_index, channels
+                    zone_order_index += 1
+
+    def dmr_repeater_csv_field_extractor(self, row):
+        self.column_number = 0
+        zone_full, zone_nick = handle_nickname_values(row[0])
+        zone_full = self.validate_zone(zone_full)
+        zone_nick = self.validate_zone(zone_nick)
+        chan_config = self.check_columns(row, self.dmr_repeater_checks)
+        chan_config[REC_SCANLIST_NAME] = zone_full
+        chan_config[REC_ZONE_NICKNAME] = zone_nick
+        chan_config[REC_TX_COLOR_CODE] = chan_config[REC_RX_COLOR_CODE]  # Use RX Color Code as TX Color Code
+        chan_config[REC_MODE] = VAL_DIGITAL
+        chan_config[REC_DMR_MODE] = dmr_mode(chan_config)
+        return chan_config
+
+    def dmr_repeater_csv_matrix_extractor(self, chan_config, contact, value, headers, row, col):
+        do_multiply = False
+        timeslot, call_type = handle_repeater_value(value)
+        timeslot = self.validate_timeslot(timeslot)
+        if timeslot != VAL_NO_TIME_SLOT:
+            contact, chan_nick = handle_nickname_values(contact)
+            if contact not in self.talkgroup_mapping:
+                self.invalid(f"Talkgroup '{contact}' is referenced in Digital-Repeaters.csv but not defined in TalkGroups.csv")
+            chan_name = self.make_channel_name(chan_config[REC_ZONE_NICKNAME], contact, chan_nick)
+            chan_config[REC_CONTACT] = self.validate_contact(contact)
+            chan_config[REC_TG_ID] = self.talkgroup_mapping.get(contact, '')
+            chan_config[REC_TIME_SLOT] = timeslot
+            chan_config[REC_NAME] = self.validate_channel_name(chan_name)
+            chan_config[REC_CALL_TYPE_OLD] = self.validate_call_type(call_type)
+            do_multiply = True
+        return do_multiply, chan_config
+
+    def read_channel_csv_default(self, filename):
+        if self.cache is None:
+            with open(filename, 'r', newline='', encoding='utf-8-sig') as fh:
+                self.load_channel_csv_default(csv.reader(fh))
+        else:
+            self.channel_csv_field_name, self.channel_csv_default_value = self.cached_input_stage(
+                'channel-defaults', filename, extract_channel_csv_default)
+            self.compile_channel_emit_plan()
+
+    def load_channel_csv_default(self, rows):
+        self.channel_csv_field_name, self.channel_csv_default_value = extract_channel_csv_default(rows)
+        self.compile_channel_emit_plan()
+
+    def read_band_plan(self, filename):
+        if not os.path.exists(filename):
+            return  # Config folders from before band-plan.csv existed build without the band checks
+        with open(filename, 'r', newline='', encoding='utf-8-sig') as fh:
+            self.load_band_plan(csv.reader(fh))
+
+    def load_band_plan(self, rows):
+        self.band_plan = BandPlan(rows)
+
+    def compile_channel_emit_plan(self):
+        """Build the default channel row, record column map and required field list used by add_channel."""
+        num_fields = max(self.channel_csv_default_value.keys()) + 1
+        self.channel_csv_default_row = [self.channel_csv_default_value.get(index, '') for index in range(num_fields)]
+        self.channel_record_columns = [(position, index) for position, index in CHANNEL_RECORD_COLUMNS
+                                       if index < num_fields]
+        record_positions = {index: position for position, index in CHANNEL_RECORD_COLUMNS}
+        record_positions.update({CHAN_RX_FREQ: REC_RX_FREQ, CHAN_TX_FREQ: REC_TX_FREQ})
+        self.channel_csv_required_fields = [(index, record_positions.get(index))
+                                            for index, value in enumerate(self.channel_csv_default_row)
+                                            if value == "REQUIRED" and index != CHAN_NUM]
+
+    def read_talkgroups(self, filename):
+        if self.cache is None:
+            with open(filename, 'r', newline='', encoding='utf-8-sig') as fh:
+                result = self.extract_talkgroups(csv.reader(fh))
+        else:
+            result = self.cached_input_stage('talkgroups', filename, self.extract_talkgroups)
+        self.set_talkgroups(filename, *result)
+
+    def load_talkgroups(self, rows):
+        rows = rows if isinstance(rows, list) else list(rows)
+        self.set_talkgroups(rows, *self.extract_talkgroups(rows))
+
+    def set_talkgroups(self, source, talkgroup_mapping, talkgroup_order, duplicates):
+        self.talkgroup_source = source
+        self.talkgroup_mapping = talkgroup_mapping
+        self.talkgroup_order = talkgroup_order
+        if duplicates:
+            self.warning(f"{len(duplicates)} talkgroup name(s) are listed more than once in the talkgroups file "
+                         f"(first: '{duplicates[0]}'). Only the first row of each name is used.")
+
+    def extract_talkgroups(self, rows):
+        """Validate the talkgroups file, returning (name -> Radio ID, name -> input order, duplicate names).
+
+        Only the names are kept; the rows themselves are read again by talkgroup_entries when
+        talkgroups.csv is written, so a full network catalog is never held in memory. The first row
+        of a name wins and later ones are listed as duplicates.
+        """
+        talkgroup_mapping = {}
+        talkgroup_order = {}
+        duplicates = []
+        self.file_name = "TalkGroups"
+        self.column_number = None
+        index = 1
+        for row in rows:
+            self.line_number = index - 1
             if index == 1:
                 index += 1
-                continue  # Skip header row for mapping
+                continue  # Skip header row
             if len(row) < 2:
-                error(f"Invalid TalkGroups.csv format: each row must have at least two columns (Radio ID, Name) {_file_and_line()}")
+                self.invalid("Invalid TalkGroups.csv format: each row must have at least two columns (Radio ID, Name)")
+                index += 1
+                continue
             talkgroup_name = row[1].strip()
             talkgroup_id = row[0].strip()
             if not talkgroup_name or not talkgroup_id:
-                error(f"Invalid TalkGroups.csv entry: Name or Radio ID is empty in row {index} {_file_and_line()}")
-            talkgroup_mapping[talkgroup_name] = talkgroup_id
-            talkgroup_order[talkgroup_name] = index
+                self.invalid(f"Invalid TalkGroups.csv entry: Name or Radio ID is empty in row {index}")
+            elif not talkgroup_id.isdecimal():
+                self.invalid(f"Invalid Radio ID: '{talkgroup_id}' must be a whole number")
+            if talkgroup_name in talkgroup_mapping:
+                duplicates.append(talkgroup_name)
+            else:
+                talkgroup_mapping[talkgroup_name] = talkgroup_id
+                talkgroup_order[talkgroup_name] = index
             index += 1
+        return talkgroup_mapping, talkgroup_order, duplicates
 
-def process_csv_file_with_header(csv_out, filename, file_nickname, header_ref, field_extractor, matrix_field_extractor=None):
-    global global_file_name, global_line_number
-    global_file_name = file_nickname
-    headers = []
-    zone_order_index = 1
-    with open(filename, 'r', newline='', encoding='utf-8-sig') as fh:
-        csv_reader = csv.reader(fh)
-        for line_no, row in enumerate(csv_reader, start=0):
-            global_line_number = line_no
+    def talkgroup_entries(self, used_only=False):
+        """Yield a TalkgroupEntry for the first row of each talkgroup name, reading the input again.
+
+        With used_only, rows for talkgroups no channel uses (and not in include_talkgroups) are
+        skipped as they are read.
+        """
+        if isinstance(self.talkgroup_source, str):
+            with open(self.talkgroup_source, 'r', newline='', encoding='utf-8-sig') as fh:
+                yield from self._talkgroup_entries(csv.reader(fh), used_only)
+        else:
+            yield from self._talkgroup_entries(iter(self.talkgroup_source), used_only)
+
+    def _talkgroup_entries(self, rows, used_only):
+        first_rows, used = self.talkgroup_order, self.talkgroup_config
+        for index, row in enumerate(islice(rows, 1, None), start=2):  # Numbered like extract_talkgroups
+            if len(row) < 2:
+                continue
+            talkgroup_name = row[1].strip()
+            if first_rows.get(talkgroup_name) != index:
+                continue  # A later row for a name already listed
+            talkgroup_id = row[0].strip()
+            id_number = int(talkgroup_id) if talkgroup_id.isdecimal() else 0
+            if used_only and talkgroup_name not in used and not self.is_included_talkgroup(id_number):
+                continue
+            call_type = row[2].strip() if len(row) > 2 and row[2].strip() else "Group Call"
+            call_alert = row[3].strip() if len(row) > 3 and row[3].strip() else "None"
+            yield TalkgroupEntry(talkgroup_id, talkgroup_name, call_type, call_alert, id_number)
+
+    def process_input_file(self, csv_out, stage, filename, extractor, *options):
+        if self.cache is None:
+            with open(filename, 'r', newline='', encoding='utf-8-sig') as fh:
+                self.emit_channel_records(csv_out, extractor(csv.reader(fh)))
+        else:
+            records = self.cached_input_stage(stage, filename, lambda rows: list(extractor(rows)), *options)
+            self.emit_channel_records(csv_out, records)
+
+    def cached_input_stage(self, stage, filename, extractor, *options):
+        """Parse and validate an input file, reusing the cached result when nothing relevant changed."""
+        with open(filename, 'rb') as fh:
+            content = fh.read()
+        key = self.cache.make_key(content, *options)
+        self.input_keys[stage] = key
+        result = self.cache.load(stage, key)
+        if result is None:
+            issue_count = len(self.issues) if self.issues is not None else 0
+            result = extractor(csv.reader(io.StringIO(content.decode('utf-8-sig'), newline='')))
+            if not self.issues or len(self.issues) == issue_count:
+                self.cache.store(stage, key, result)
+        return result
+
+    def extract_rows_with_header(self, rows, file_nickname, header_ref, field_extractor, matrix_field_extractor=None,
+                                 line_offset=0):
+        """Validate an input file, yielding a (zone name, zone type, zone order, channels) record per row.
+
+        Channels are (base scanlist name, chan_config) pairs. Overflow scanlists, channel numbers
+        and zone membership are assigned later by emit_channel_records. line_offset is added to
+        the line numbers in messages when rows is a chunk of a larger file.
+        """
+        self.file_name = file_nickname
+        zone_type = ZONE_TYPES[file_nickname]
+        headers = []
+        zone_order_index = 1
+        for line_no, row in enumerate(rows, start=0):
+            self.line_number = line_no + line_offset if line_no else 0
+            self.column_number = None
             if line_no == 0:
+                header_ok = True
                 for col, expected in enumerate(header_ref):
                     if col < len(row) and row[col] != expected:
-                        error(f"CSV header does not match for {file_nickname} file (found '{row[col]}' expected '{expected}')")
+                        self.invalid(f"CSV header does not match for {file_nickname} file (found '{row[col]}' expected '{expected}')",
+                                     located=False)
+                        header_ok = False
+                if not header_ok:
+                    return  # The columns can't be trusted, so the rows aren't checked
                 headers = row
+                continue
+            if len(row) < len(header_ref):
+                self.invalid(f"Row has {len(row)} columns but the {file_nickname} file needs at least {len(header_ref)}")
+                continue
+            chan_config = field_extractor(row)
+            self.column_number = None
+            zone_name = chan_config[REC_SCANLIST_NAME]
+            channels = []
+            if self.stats is not None and len(row) > len(header_ref):
+                self.stats.count('matrix cells expanded', len(row) - len(header_ref))
+            if len(row) == len(header_ref):
+                chan_config[REC_TX_PERMIT] = self.tx_permit(chan_config)
+                channels.append((zone_name, chan_config))
+            for col in range(len(header_ref), len(row)):
+                if not matrix_field_extractor:
+                    self.invalid(f"There are too many columns in '{file_nickname}' file, line {self.line_number}.", located=False)
+                    break
+                self.column_number = col
+                if col >= len(headers):
+                    if row[col].strip():  # Empty cells past the header, like a trailing comma, are harmless
+                        self.invalid(f"Row has {len(row)} columns but the {file_nickname} file header only has {len(headers)}")
+                    continue
+                do_matrix, chan_config = matrix_field_extractor(chan_config, headers[col], row[col], headers, row, col)
+                if do_matrix:
+                    chan_config[REC_TX_PERMIT] = self.tx_permit(chan_config)
+                    channels.append((chan_config[REC_CONTACT], chan_config.copy()))
+            yield zone_name, zone_type, zone_order_index, channels
+            zone_order_index += 1
+
+    def emit_channel_records(self, csv_out, records):
+        band_plan = self.band_plan
+        for zone_name, zone_type, zone_order_index, channels in records:
+            self.zone_type[zone_name] = zone_type
+            if band_plan is not None and channels:
+                self.check_band_plan(channels[0][1], zone_name, len(channels))
+            for base_scanlist_name, chan_config in channels:
+                scanlist_name = self.get_overflow_scanlist_name(base_scanlist_name)
+                chan_config[REC_SCANLIST_NAME] = scanlist_name
+                self.scanlist_channel_counts[scanlist_name] += 1
+                self.add_channel(csv_out, chan_config, zone_name, scanlist_name, zone_order_index)
+
+    def check_band_plan(self, chan_config, zone_name, channel_count):
+        """Check the frequencies of an input row's channels against the band plan.
+
+        All the channels of a row share its frequencies, so this runs once per row however wide
+        the talkgroup matrix is. A frequency the radio can't tune is an error; transmitting
+        outside the amateur bands or with an unusual repeater offset is noted for a warning.
+        """
+        band_plan = self.band_plan
+        rx_freq, tx_freq = chan_config[REC_RX_FREQ], chan_config[REC_TX_FREQ]
+        if rx_freq == INVALID_FREQ or tx_freq == INVALID_FREQ:
+            return  # Already reported by validate_freq
+        for what, freq in (("RX", rx_freq), ("TX", tx_freq)):
+            if not band_plan.radio_can_tune(freq):
+                self.invalid(f"{what} frequency {format_mhz(freq)} MHz of channel '{chan_config[REC_NAME]}' "
+                             f"(Zone: '{zone_name}') is outside what the radio can tune ({band_plan.radio_range_text()})",
+                             located=False)
+                return
+        if chan_config[REC_TX_PROHIBIT] == "On" or not band_plan.amateur_bands:
+            return
+        note = (chan_config[REC_NAME], zone_name, rx_freq, tx_freq, channel_count)
+        tx_band = band_plan.amateur_band(tx_freq)
+        if tx_band is None:
+            self.band_plan_notes['outside'].append(note)
+        elif rx_freq != tx_freq and abs(tx_freq - rx_freq) not in tx_band[3]:
+            rx_band = band_plan.amateur_band(rx_freq)
+            if rx_band is not None:  # Receiving outside the bands (e.g. a link input) is left alone
+                self.band_plan_notes['offset'].append(note)
+
+    def report_band_plan_notes(self):
+        notes = self.band_plan_notes
+        if notes['outside']:
+            name, zone, _, tx_freq, _ = notes['outside'][0]
+            self.warning(f"{sum(note[4] for note in notes['outside'])} channel(s) transmit outside the amateur bands "
+                         f"(first: '{name}' in zone '{zone}', TX {format_mhz(tx_freq)} MHz). "
+                         f"Check for typos, or set TX Prohibit for receive-only analog channels.")
+        if notes['offset']:
+            name, zone, rx_freq, tx_freq, _ = notes['offset'][0]
+            self.warning(f"{sum(note[4] for note in notes['offset'])} channel(s) have an unusual repeater offset for "
+                         f"their band (first: '{name}' in zone '{zone}', RX {format_mhz(rx_freq)} MHz, "
+                         f"TX {format_mhz(tx_freq)} MHz). Check the TX Freq, or add the offset to band-plan.csv.")
+
+    def get_overflow_scanlist_name(self, base_name):
+        """Determine the appropriate scanlist name, creating overflow if necessary.
+
+        Channel counts only ever grow, so the first scanlist with room for a base name never
+        moves backwards. The open bucket is remembered per base name and only advanced once full.
+        """
+        num = self.scanlist_overflow_number.get(base_name, 1)
+        while True:
+            name = base_name if num == 1 else f"{base_name}_OF{num}"
+            if self.scanlist_channel_counts.get(name, 0) < SCANLIST_LIMIT:
+                self.scanlist_overflow_number[base_name] = num
+                return name
+            num += 1
+
+    def add_channel(self, csv_out, chan_config, zone_name, scanlist_name, zone_order_index):
+        if self.duplicate_names != 'allow':
+            self.index_channel_name(chan_config, zone_name)
+        output = self.channel_csv_default_row.copy()
+        for position, index in self.channel_record_columns:
+            value = chan_config[position]
+            if value is not None:
+                output[index] = value
+        for index, position in self.channel_csv_required_fields:
+            if position is None or chan_config[position] is None:
+                self.invalid(f"Missing required value for '{self.channel_csv_field_name.get(index, f'Field_{index}')}' "
+                             f"in channel '{chan_config[REC_NAME] or 'unknown'}'", located=False)
+        output[CHAN_RX_FREQ] = format_frequency(chan_config[REC_RX_FREQ])
+        output[CHAN_TX_FREQ] = format_frequency(chan_config[REC_TX_FREQ])
+        output[CHAN_NUM] = self.channel_number
+        self.channel_number += 1
+        csv_out.writerow(output)
+        self.build_zone_config(chan_config, zone_name, zone_order_index)
+        self.build_scanlist_config(chan_config, scanlist_name)
+        if chan_config[REC_MODE] == VAL_DIGITAL:
+            self.build_talkgroup_config(chan_config, zone_name)
+
+    def index_channel_name(self, chan_config, zone_name):
+        """Record the channel's name, dealing with a clash with an earlier channel per duplicate_names."""
+        name = chan_config[REC_NAME].rstrip()
+        first_zone = self.channel_names.get(name)
+        if first_zone is None:
+            self.channel_names[name] = zone_name
+            return
+        renamed_to = None
+        if self.duplicate_names == 'rename':
+            renamed_to = self.unused_channel_name(chan_config, name)
+            chan_config[REC_NAME] = renamed_to
+            self.channel_names[renamed_to] = zone_name
+        elif self.duplicate_names == 'error':
+            self.invalid(f"Channel name '{name}' in zone '{zone_name}' is already used by a channel in zone '{first_zone}'",
+                         located=False)
+        self.name_collisions.append(NameCollision(name, zone_name, format_frequency(chan_config[REC_RX_FREQ]),
+                                                  format_frequency(chan_config[REC_TX_FREQ]), first_zone, renamed_to))
+
+    def unused_channel_name(self, chan_config, name):
+        """Find a free name of at most LENGTH_CHAN_NAME characters for a clashing channel.
+
+        The other nickname forms of a repeater channel are tried first, then the name with a
+        -2, -3, ... counter, shortened to make room for it.
+        """
+        for candidate in self.alternate_channel_names(chan_config):
+            if candidate not in self.channel_names:
+                return candidate
+        counter = self.name_counters.get(name, 2)
+        while True:
+            suffix = f"-{counter}"
+            candidate = name[:LENGTH_CHAN_NAME - len(suffix)].rstrip() + suffix
+            counter += 1
+            if candidate not in self.channel_names:
+                self.name_counters[name] = counter
+                return candidate
+
+    def alternate_channel_names(self, chan_config):
+        zone_nick = chan_config[REC_ZONE_NICKNAME]
+        contact = chan_config[REC_CONTACT]
+        if not zone_nick or not contact:
+            return []
+        if self.nickname_mode in ('suffix', 'suffix-forced'):
+            forms = [f"{contact} {zone_nick}", f"{contact}{zone_nick}"]
+        else:
+            forms = [f"{zone_nick} {contact}", f"{zone_nick}{contact}"]
+        return [form for form in forms if len(form) <= LENGTH_CHAN_NAME]
+
+    def report_name_collisions(self):
+        if not self.name_collisions or self.duplicate_names == 'error':
+            return
+        first = self.name_collisions[0]
+        if self.duplicate_names == 'rename':
+            self.warning(f"Renamed {len(self.name_collisions)} channel(s) whose names were already used by another channel "
+                         f"(first: '{first.name}' in zone '{first.zone}' became '{first.renamed_to}').")
+        else:
+            self.warning(f"{len(self.name_collisions)} channel(s) have the same name as an earlier channel "
+                         f"(first: '{first.name}' in zone '{first.zone}', already used in zone '{first.first_zone}'). "
+                         f"Use --duplicate-names rename to fix them automatically.")
+
+    def name_collision_rows(self):
+        return [NAME_COLLISION_HEADERS] + [[collision.name, collision.zone, collision.rx_freq, collision.tx_freq,
+                                            collision.first_zone, collision.renamed_to or '']
+                                           for collision in self.name_collisions]
+
+    def build_zone_config(self, chan_config, zone_name, zone_order_index):
+        self.zone_order[zone_name] = zone_order_index
+        rx_freq = chan_config[REC_RX_FREQ]
+        if rx_freq < self.zone_low_freq.get(zone_name, rx_freq + 1):
+            self.zone_low_freq[zone_name] = rx_freq
+        self.zone_config.add(zone_name, self.make_channel_member(chan_config))
+
+    def build_scanlist_config(self, chan_config, scanlist_name):
+        self.scanlist_config.add(scanlist_name, self.make_channel_member(chan_config))
+
+    def make_channel_member(self, chan_config):
+        rx_freq = chan_config[REC_RX_FREQ]
+        tx_freq = chan_config[REC_TX_FREQ]
+        return ChannelMember(self.channel_sort_key(chan_config, rx_freq, tx_freq), chan_config[REC_NAME].rstrip(),
+                             rx_freq, tx_freq)
+
+    def build_talkgroup_config(self, chan_config, zone_name):
+        talkgroup = chan_config[REC_CONTACT]
+        call_type = chan_config[REC_CALL_TYPE_OLD]
+        if talkgroup not in self.talkgroup_mapping:
+            if self.issues is None:  # When collecting, the input file checks have already reported it
+                error(f"Talkgroup '{talkgroup}' is referenced but not defined in the talkgroup input CSV file")
+            return
+        if talkgroup in self.talkgroup_config and self.talkgroup_config[talkgroup] != call_type:
+            other_call_type = self.talkgroup_config[talkgroup]
+            chan_name = chan_config[REC_NAME]
+            rx_freq = format_frequency(chan_config[REC_RX_FREQ])
+            tx_freq = format_frequency(chan_config[REC_TX_FREQ])
+            self.invalid(f"Talkgroup '{talkgroup}' was previously identified as a '{other_call_type}', but is now trying to be "
+                         f"used as a '{call_type}' on channel '{chan_name}' (Zone: '{zone_name}', RX: {rx_freq}, TX: {tx_freq}). "
+                         f"The Anytone CPS won't allow this to be imported. To fix this, create a second entry in your "
+                         f"talkgroups CSV input file for this talkgroup with a different name.", located=False)
+            return
+        self.talkgroup_config[talkgroup] = call_type
+
+    def tx_permit(self, chan_config):
+        result = VAL_TX_PERMIT_SAME
+        if self.hotspot_tx_permit == "always" and chan_config[REC_RX_FREQ] == chan_config[REC_TX_FREQ]:
+            result = VAL_TX_PERMIT_ALWAYS
+        elif chan_config[REC_RX_COLOR_CODE] is not None and chan_config[REC_TX_COLOR_CODE] is not None:
+            if chan_config[REC_RX_COLOR_CODE] != chan_config[REC_TX_COLOR_CODE]:
+                result = VAL_TX_PERMIT_DIFFERENT
+        return result
+
+    def make_channel_name(self, zone_nick, chan_full, chan_nick):
+        if self.nickname_mode == 'off' or not zone_nick:
+            return chan_full
+        if not chan_nick:
+            chan_nick = chan_full
+        if self.nickname_mode in ('prefix-forced', 'suffix-forced'):
+            chan_full = chan_nick
+        if len(zone_nick) + len(chan_full) + 1 <= LENGTH_CHAN_NAME:
+            chan_name, sep = chan_full, ' '
+        elif len(zone_nick) + len(chan_nick) + 1 <= LENGTH_CHAN_NAME:
+            chan_name, sep = chan_nick, ' '
+        elif len(zone_nick) + len(chan_nick) <= LENGTH_CHAN_NAME:
+            chan_name, sep = chan_nick, ''
+        else:
+            self.invalid(f"Can't make a channel name fit into 16 characters for '{zone_nick}' and '{chan_nick}'", located=False)
+            return chan_full
+        if not NAME_START_PATTERN.match(zone_nick):
+            sep = ''
+        if self.nickname_mode in ('prefix', 'prefix-forced'):
+            return f"{zone_nick}{sep}{chan_name}"
+        return f"{chan_name}{sep}{zone_nick}"
+
+    # Data Validation Routines
+    def validate_bandwidth(self, mode):
+        return self._validate_membership(mode, VALID_BANDWIDTHS, "Analog Mode")
+
+    def validate_call_type(self, call_type):
+        return self._validate_membership(call_type, VALID_CALL_TYPES, "Call Type")
+
+    def validate_channel_name(self, contact):
+        return self._validate_string_length("Channel Name", contact, LENGTH_CHAN_NAME)
+
+    def validate_color_code(self, color_code):
+        return self._validate_num_in_range("Color Code", color_code, 0, 15)
+
+    def validate_contact(self, contact):
+        return self._validate_string_length("Contact (aka Talk Group)", contact, LENGTH_CHAN_NAME)
+
+    def validate_ctcss(self, ctcss):
+        if ctcss == 'Off':
+            return ctcss
+        if DCS_CODE_PATTERN.match(ctcss) and len(ctcss) < 10:
+            return ctcss
+        return self._validate_num_in_range('CTCSS/DCS', ctcss, 0, 300)
+
+    def validate_freq(self, freq):
+        """Check a frequency in MHz and return it as integer Hz."""
+        hz = parse_frequency(freq)
+        if hz is None or hz < 0 or hz > MAX_FREQ_MHZ * HZ_PER_MHZ:
+            self.invalid(f"Invalid Frequency: '{freq}' must be a number between 0 and {MAX_FREQ_MHZ} (inclusive)")
+            return INVALID_FREQ
+        return hz
+
+    def validate_name(self, name):
+        return self._validate_string_length('Channel Name', name, LENGTH_CHAN_NAME)
+
+    def validate_power(self, power):
+        return self._validate_membership(power, VALID_POWER_LEVELS, "Power Level")
+
+    def validate_timeslot(self, timeslot):
+        return self._validate_membership(timeslot, VALID_TIMESLOTS, "Time Slot")
+
+    def validate_tx_prohibit(self, tx_prohibit):
+        return self._validate_on_off(tx_prohibit, "TX Prohibit")
+
+    def validate_zone(self, zone):
+        return self._validate_string_length('Zone', zone, 16)
+
+    def validate_sort_mode(self, sort_order):
+        return self._validate_membership(sort_order, VALID_SORT_MODES, "Sort Order")
+
+    def validate_channel_sort(self, channel_sort):
+        return self._validate_membership(channel_sort, VALID_CHANNEL_SORTS, "Channel Sort")
+
+    def validate_hotspot_mode(self, hotspot_mode):
+        return self._validate_membership(hotspot_mode, VALID_HOTSPOT_MODES, "Hotspot TX Permit")
+
+    def validate_nickname_mode(self, nickname_mode):
+        return self._validate_membership(nickname_mode, VALID_NICKNAME_MODES, "Nickname Mode")
+
+    def validate_talkgroup_sort(self, sort_mode):
+        return self._validate_membership(sort_mode, VALID_TALKGROUP_SORTS, "Talkgroup Sort")
+
+    def validate_duplicate_names_mode(self, mode):
+        return self._validate_membership(mode, VALID_DUPLICATE_NAME_MODES, "Duplicate Names")
+
+    def validate_contact_limit(self, limit):
+        if limit < 1:
+            self.invalid(f"Invalid Contact Limit: '{limit}' must be at least 1")
+        return limit
+
+    def validate_talkgroup_filter(self, talkgroup_filter):
+        return self._validate_membership(talkgroup_filter, VALID_TALKGROUP_FILTERS, "Talkgroup Filter")
+
+    def validate_tx_permit(self, tx_permit):
+        return self._validate_membership(tx_permit, VALID_TX_PERMITS, "TX Permit")
+
+    # Validation Helpers
+    def _validate_membership(self, value, valid_set, error_type):
+        if value not in valid_set:
+            self.invalid(f"Invalid {error_type}: '{value}' is not one of: {', '.join(valid_set)}")
+        return value
+
+    def _validate_num_in_range(self, type_name, value, min_val, max_val):
+        try:
+            num = float(value)
+        except ValueError:
+            num = None
+        if num is None or num < min_val or num > max_val:
+            self.invalid(f"Invalid {type_name}: '{value}' must be a number between {min_val} and {max_val} (inclusive)")
+        return value
+
+    def _validate_on_off(self, value, error_type):
+        return self._validate_membership(value, VALID_ON_OFF, error_type)
+
+    def _validate_string_length(self, type_name, string, length):
+        if len(string) > length:
+            self.invalid(f"Invalid {type_name}: '{string}' is more than {length} characters")
+        return string
+
+    def check_columns(self, row, column_checks):
+        """Run the precompiled column validators over a row, returning the partial chan_config."""
+        chan_config = ChannelRecord(BLANK_CHANNEL_RECORD)
+        for col, field, validate in column_checks:
+            self.column_number = col
+            chan_config[field] = validate(row[col])
+        return chan_config
+
+    def invalid(self, message, located=True):
+        """Report a problem with the inputs.
+
+        Stops the build straight away, unless the builder is collecting errors, in which case
+        the problem is recorded with its file, line and column and checking carries on.
+        """
+        if self.issues is None:
+            error(f"{message} {self._file_and_line()}" if located else message)
+        if located:
+            column = self.column_number + 1 if self.column_number is not None else None
+            self.issues.append(ValidationIssue(self.file_name, self.line_number, column, message))
+        else:
+            self.issues.append(ValidationIssue(None, None, None, message))
+
+    def _file_and_line(self):
+        return f"[On line {self.line_number} of {self.file_name} file.]"
+
+    def warning(self, message):
+        self.warnings.append(message)
+        if self.verbose:
+            warning(message)
+
+# Batch Builds
+BATCH_MANIFEST_HEADERS = ["Profile", "DMR ID", "Sorting", "Nicknames", "Talkgroup Sort", "Hotspot TX Permit", "Channel Sort"]
+_batch_inputs = None  # Shared parsed inputs, set once per batch worker process
+_expansion_builder = None  # Builder used by a repeater matrix expansion worker process
+
+def read_batch_manifest(filename, defaults, dmr_id=None):
+    """Read the batch manifest into a list of (profile name, dmr_id, builder options).
+
+    defaults are the builder options from the command line; the manifest columns override
+    them per profile, and blank cells keep them (dmr_id included).
+    """
+    profiles = []
+    seen = set()
+    rows = read_csv_rows(filename)
+    if not rows:
+        error(f"Batch manifest '{filename}' is empty")
+    for col, expected in enumerate(BATCH_MANIFEST_HEADERS):
+        if col < len(rows[0]) and rows[0][col] != expected:
+            error(f"CSV header does not match for batch manifest (found '{rows[0][col]}' expected '{expected}')")
+    for line_no, row in enumerate(rows[1:], start=1):
+        row = [value.strip() for value in row] + [''] * (len(BATCH_MANIFEST_HEADERS) - len(row))
+        name = row[0]
+        if not name or name in ('.', '..') or os.sep in name or '/' in name:
+            error(f"Invalid Profile: '{name}' must be a plain directory name [On line {line_no} of batch manifest.]")
+        if name in seen:
+            error(f"Duplicate Profile: '{name}' [On line {line_no} of batch manifest.]")
+        seen.add(name)
+        options = dict(defaults)
+        for option, value in zip(('sorting', 'nicknames', 'talkgroup_sort', 'hotspot_tx_permit', 'channel_sort'), row[2:7]):
+            if value:
+                options[option] = value
+        profiles.append((name, row[1] or dmr_id, options))
+    return profiles
+
+def run_batch(args, output_dir):
+    try:
+        # Every command line option applies to every profile. Each profile reports its first error,
+        # and profiles already run in parallel, so they don't split the repeater matrix further.
+        defaults = dict(builder_options(args), collect_errors=False, expansion_jobs=1)
+        profiles = read_batch_manifest(args.batch_manifest, defaults, args.dmr_id)
+        inputs = {
+            'talkgroups': read_csv_rows(args.talkgroups_csv),
+            'analog': read_csv_rows(args.analog_csv),
+            'digital_others': read_csv_rows(args.digital_others_csv),
+            'digital_repeaters': read_csv_rows(args.digital_repeaters_csv),
+            'channel_defaults': read_csv_rows(os.path.join(args.config, 'channel-defaults.csv')),
+            'band_plan': [],
+        }
+        if os.path.exists(os.path.join(args.config, 'band-plan.csv')):
+            inputs['band_plan'] = read_csv_rows(os.path.join(args.config, 'band-plan.csv'))
+    except (BuildError, OSError) as exc:
+        print(f"ERROR: {exc}")
+        sys.exit(1)
+
+    results = build_batch(profiles, inputs, output_dir, args.jobs, args.contacts_csv)
+    failed = False
+    for name, warnings, message in results:
+        for text in warnings:
+            warning(f"[{name}] {text}")
+        if message:
+            print(f"ERROR: [{name}] {message}")
+            failed = True
+        else:
+            print(f"Profile '{name}' generated in: {os.path.abspath(os.path.join(output_dir, name))}")
+    if failed:
+        sys.exit(1)
+
+def build_batch(profiles, inputs, output_dir, jobs=None, contacts_filename=None):
+    """Build every profile on a process pool, sharing one copy of the parsed inputs per worker.
+
+    The contacts file is only passed by name: each profile streams it through its own contact
+    filters, so a full RadioID dump is never held in memory. Results come back in manifest order
+    as (profile name, warnings, error message or None).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    tasks = [(name, dmr_id, options, os.path.join(output_dir, name), contacts_filename)
+             for name, dmr_id, options in profiles]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker, initargs=(inputs,)) as executor:
+        return list(executor.map(_build_batch_profile, tasks))
+
+def _init_batch_worker(inputs):
+    global _batch_inputs
+    _batch_inputs = inputs
+
+def _build_batch_profile(task):
+    name, dmr_id, options, profile_dir, contacts_filename = task
+    try:
+        builder = CodeplugBuilder(verbose=False, **options)
+        tables = builder.build_tables(dmr_id=dmr_id, **_batch_inputs)
+        if contacts_filename:
+            tables['digital_contacts.csv'] = builder.digital_contact_file_rows(contacts_filename)
+        write_tables(profile_dir, tables)
+    except (BuildError, OSError) as exc:
+        return name, [], str(exc)
+    return name, builder.warnings, None
+
+def _init_expansion_worker(options, talkgroup_mapping, with_stats):
+    global _expansion_builder
+    _expansion_builder = CodeplugBuilder(verbose=False, stats=BuildStats() if with_stats else None, **options)
+    _expansion_builder.talkgroup_mapping = talkgroup_mapping
+
+def _expand_repeater_chunk(task):
+    header, rows, line_offset = task
+    builder = _expansion_builder
+    if builder.issues is not None:
+        builder.issues = []
+    if builder.stats is not None:
+        builder.stats.counters.clear()
+    with gc_paused():
+        records = list(builder.extract_rows_with_header([header] + rows, "Digital-Repeater",
+                                                        DIGITAL_REPEATER_HEADERS,
+                                                        builder.dmr_repeater_csv_field_extractor,
+                                                        builder.dmr_repeater_csv_matrix_extractor, line_offset))
+    counters = dict(builder.stats.counters) if builder.stats is not None else None
+    return records, builder.issues, counters
+
+# Build Service
+
+# Form fields a --serve request may send: the input files, and the command line options that only
+# affect the codeplug. Options naming files or directories on the server are not accepted.
+SERVE_FILE_FIELDS = ['analog-csv', 'digital-others-csv', 'digital-repeaters-csv', 'talkgroups-csv', 'contacts-csv']
+SERVE_OPTION_FIELDS = ['sorting', 'channel-sort', 'hotspot-tx-permit', 'nicknames', 'talkgroup-sort', 'dmr-id',
+                       'duplicate-names', 'talkgroup-filter', 'include-talkgroups', 'contacts-country',
+                       'contacts-state', 'contacts-id-prefix', 'contacts-limit']
+
+_serve_state = None  # (MemoryInputCache, config directory) of a --serve worker process
+
+def serve(args):
+    """Answer build requests over HTTP until interrupted.
+
+    The server threads only read requests; builds run on a process pool whose workers each keep
+    a MemoryInputCache, so talkgroups, channel defaults and any other unchanged upload are parsed
+    once per worker and reused by content hash. Every request gets its own CodeplugBuilder.
+    """
+    import multiprocessing
+    import signal
+    from concurrent.futures import ProcessPoolExecutor
+    from http.server import ThreadingHTTPServer
+    # Workers start on demand, once the socket is bound and the server threads are running, so
+    # they are spawned rather than forked: they don't inherit the listening socket
+    executor = ProcessPoolExecutor(max_workers=args.jobs, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_serve_worker, initargs=(os.path.abspath(args.config),))
+    server = ThreadingHTTPServer((args.host, args.serve), make_build_request_handler(executor, args.quiet))
+    server.daemon_threads = True
+    print(f"Serving codeplug builds on http://{args.host}:{server.server_port}/build. Press Ctrl+C to stop.")
+    signal.signal(signal.SIGTERM, _stop_serving)  # Shut the workers down on kill too, not just on Ctrl+C
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopped serving.")
+    finally:
+        server.server_close()
+        executor.shutdown(cancel_futures=True)
+
+def _stop_serving(signum, frame):
+    raise KeyboardInterrupt
+
+def make_build_request_handler(executor, quiet=False):
+    from http.server import BaseHTTPRequestHandler
+
+    class BuildRequestHandler(BaseHTTPRequestHandler):
+        """POST /build with a multipart form of SERVE_FILE_FIELDS and SERVE_OPTION_FIELDS."""
+
+        def do_POST(self):
+            if self.path.split('?')[0] != '/build':
+                self.send_body(404, "Not found. POST the form to /build.")
+                return
+            length = self.headers.get('Content-Length', '').strip()
+            if not length.isdecimal():
+                self.send_body(400, "The request needs a Content-Length header with the size of the upload.")
+                return
+            length = int(length)
+            if length > SERVE_MAX_UPLOAD_BYTES:
+                self.send_body(413, f"The upload is larger than {SERVE_MAX_UPLOAD_BYTES >> 20} MB.")
+                return
+            try:
+                files, options = parse_build_form(self.headers.get('Content-Type', ''), self.rfile.read(length))
+            except BuildError as exc:
+                self.send_body(400, f"ERROR: {exc}")
+                return
+            try:
+                self.send_body(*executor.submit(_serve_build, files, options).result())
+            except Exception as exc:  # The build never got as far as an answer; say so rather than drop the connection
+                self.send_body(500, f"ERROR: The build failed unexpectedly: {exc}")
+
+        def do_GET(self):
+            self.send_body(405, "POST the input CSVs as a multipart form to /build.")
+
+        def send_body(self, status, body):
+            """Send a zip file, or a line of text."""
+            if isinstance(body, str):
+                body = (body + '\n').encode('utf-8')
+                content_type = 'text/plain; charset=utf-8'
             else:
-                chan_config = field_extractor(row)
-                zone_name = chan_config[CHAN_SCANLIST_NAME]
-                # Tag zone type based on file source
-                if file_nickname == "Analog":
-                    zone_type[zone_name] = 'analog'
-                elif file_nickname == "Digital-Others":
-                    zone_type[zone_name] = 'digital_others'
-                elif file_nickname == "Digital-Repeater":
-                    zone_type[zone_name] = 'digital_repeaters'
-                if len(row) == len(header_ref):
-                    chan_config[CHAN_TX_PERMIT] = tx_permit(chan_config)
-                    base_scanlist_name = chan_config[CHAN_SCANLIST_NAME]
-                    actual_scanlist_name = get_overflow_scanlist_name(base_scanlist_name)
-                    chan_config[CHAN_SCANLIST_NAME] = actual_scanlist_name
-                    scanlist_channel_counts[actual_scanlist_name] += 1
-                    add_channel(csv_out, chan_config, zone_name, actual_scanlist_name, zone_order_index)
-                for col in range(len(header_ref), len(row)):
-                    if not matrix_field_extractor:
-                        error(f"There are too many columns in '{file_nickname}' file, line {line_no}.")
-                    do_matrix, chan_config = matrix_field_extractor(chan_config, headers[col], row[col], headers, row, col)
-                    if do_matrix:
-                        base_scanlist_name = chan_config[CHAN_CONTACT]
-                        actual_scanlist_name = get_overflow_scanlist_name(base_scanlist_name)
-                        chan_config[CHAN_SCANLIST_NAME] = actual_scanlist_name
-                        chan_config[CHAN_TX_PERMIT] = tx_permit(chan_config)
-                        scanlist_channel_counts[actual_scanlist_name] += 1
-                        add_channel(csv_out, chan_config, zone_name, actual_scanlist_name, zone_order_index)
-                zone_order_index += 1
-
-def get_overflow_scanlist_name(base_name):
-    """Determine the appropriate scanlist name, creating overflow if necessary."""
-    num = 1
-    while True:
-        if num == 1:
-            name = base_name
+                content_type = 'application/zip'
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            if content_type == 'application/zip':
+                self.send_header('Content-Disposition', 'attachment; filename="codeplug.zip"')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            if not quiet:
+                super().log_message(format, *args)
+
+    return BuildRequestHandler
+
+def parse_build_form(content_type, body):
+    """Split a multipart/form-data body into ({field: file bytes}, [(option, value)])."""
+    from email.parser import BytesParser
+    from email.policy import HTTP
+    if not content_type.startswith('multipart/form-data'):
+        error("The request must be a multipart/form-data upload")
+    message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body)
+    files = {}
+    options = []
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        value = part.get_payload(decode=True) or b''
+        if name in SERVE_FILE_FIELDS:
+            if name != 'contacts-csv':  # Contacts are read leniently, like on the command line
+                decode_upload(name, value)
+            files[name] = value
+        elif name in SERVE_OPTION_FIELDS:
+            value = decode_upload(name, value).strip()
+            if value:
+                options.append((name, value))
         else:
-            name = f"{base_name}_OF{num}"
-        current_count = scanlist_channel_counts[name]
-        if current_count < SCANLIST_LIMIT:
-            return name
-        num += 1
-        if num > 1000:  # Safety limit to prevent infinite loop
-            error(f"Infinite loop detected in scanlist overflow for '{base_name}'")
-
-def add_channel(csv_out, chan_config, zone_name, scanlist_name, zone_order_index):
-    global global_channel_number, analog_channel_index
-    num_fields = max(channel_csv_default_value.keys()) + 1
-    output = [''] * num_fields
-    for index in range(num_fields):
-        value = channel_csv_default_value.get(index, '')
-        if index in chan_config:
-            value = chan_config[index]
-        if index == CHAN_NUM:
-            value = global_channel_number
-            global_channel_number += 1
-        if value == "REQUIRED" and not chan_config.get(index):
-            error(f"Missing required value for '{channel_csv_field_name.get(index, f'Field_{index}')}' in channel '{chan_config.get(CHAN_NAME, 'unknown')}'")
-        output[index] = value
-    csv_out.writerow(output)
-    build_zone_config(chan_config, zone_name, zone_order_index)
-    build_scanlist_config(chan_config, scanlist_name)
-    if chan_config[CHAN_MODE] == VAL_DIGITAL:
-        build_talkgroup_config(chan_config, zone_name)
-
-def build_zone_config(chan_config, zone_name, zone_order_index):
-    chan_name = chan_config[CHAN_NAME]
-    rx_freq = chan_config[CHAN_RX_FREQ]
-    tx_freq = chan_config[CHAN_TX_FREQ]
-    zone_order[zone_name] = zone_order_index
-    order = channel_order_name(chan_config)
-    zone_config[zone_name].append(f"{order}\t{chan_name}\t{rx_freq}\t{tx_freq}")
-
-def build_scanlist_config(chan_config, scanlist_name):
-    chan_name = chan_config[CHAN_NAME]
-    rx_freq = chan_config[CHAN_RX_FREQ]
-    tx_freq = chan_config[CHAN_TX_FREQ]
-    order = channel_order_name(chan_config)
-    scanlist_config[scanlist_name].append(f"{order}\t{chan_name}\t{rx_freq}\t{tx_freq}")
-
-def build_talkgroup_config(chan_config, zone_name):
-    talkgroup = chan_config[CHAN_CONTACT]
-    call_type = chan_config[CHAN_CALL_TYPE_OLD]
-    if talkgroup not in talkgroup_mapping:
-        error(f"Talkgroup '{talkgroup}' is referenced but not defined in the talkgroup input CSV file")
-    if talkgroup in talkgroup_config and talkgroup_config[talkgroup] != call_type:
-        other_call_type = talkgroup_config[talkgroup]
-        chan_name = chan_config[CHAN_NAME]
-        rx_freq = chan_config[CHAN_RX_FREQ]
-        tx_freq = chan_config[CHAN_TX_FREQ]
-        error(f"Talkgroup '{talkgroup}' was previously identified as a '{other_call_type}', but is now trying to be "
-              f"used as a '{call_type}' on channel '{chan_name}' (Zone: '{zone_name}', RX: {rx_freq}, TX: {tx_freq}). "
-              f"The Anytone CPS won't allow this to be imported. To fix this, create a second entry in your "
-              f"talkgroups CSV input file for this talkgroup with a different name.")
-    talkgroup_config[talkgroup] = call_type
-
-def channel_order_name(chan_config):
-    global analog_channel_index
-    index1 = 9999
-    index2 = 0
-    chan_name = chan_config[CHAN_NAME]
-    if global_sort_mode != 'alpha':
-        if chan_config[CHAN_MODE] == VAL_DIGITAL:
-            if chan_config[CHAN_CONTACT] in talkgroup_order:
-                index1 = talkgroup_order[chan_config[CHAN_CONTACT]]
-        elif chan_config[CHAN_MODE] == VAL_ANALOG:
-            index2 = analog_channel_index
-            analog_channel_index += 1
-    return f"{index1:04d}{index2:04d}{chan_name}"
-
-def tx_permit(chan_config):
-    result = VAL_TX_PERMIT_SAME
-    if global_hotspot_tx_permit == "always" and chan_config[CHAN_RX_FREQ] == chan_config[CHAN_TX_FREQ]:
-        result = VAL_TX_PERMIT_ALWAYS
-    elif CHAN_RX_COLOR_CODE in chan_config and CHAN_TX_COLOR_CODE in chan_config:
-        if chan_config[CHAN_RX_COLOR_CODE] != chan_config[CHAN_TX_COLOR_CODE]:
-            result = VAL_TX_PERMIT_DIFFERENT
-    return result
+            error(f"Unknown form field '{name}'. Files: {', '.join(SERVE_FILE_FIELDS)}. "
+                  f"Options: {', '.join(SERVE_OPTION_FIELDS)}")
+    missing = [name for name in SERVE_FILE_FIELDS[:4] if name not in files]
+    if missing:
+        error(f"Missing input file(s): {', '.join(missing)}")
+    return files, options
+
+def decode_upload(name, value):
+    try:
+        return value.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        error(f"The '{name}' field is not UTF-8 text. Save the sheet as \"CSV UTF-8\" and try again.")
+
+def _init_serve_worker(config_directory):
+    global _serve_state
+    _serve_state = (MemoryInputCache(keep=SERVE_CACHE_ENTRIES), config_directory)
+
+def _serve_build(files, options):
+    """Build one --serve request in a worker, returning (HTTP status, zip file or error text)."""
+    import zipfile
+    cache, config_directory = _serve_state
+    with tempfile.TemporaryDirectory(prefix='codeplug-serve-') as work_dir:
+        argv = ['--config', config_directory]
+        for name, content in files.items():
+            path = os.path.join(work_dir, f"{name}.csv")
+            with open(path, 'wb') as fh:
+                fh.write(content)
+            argv += [f"--{name}", path]
+        for name, value in options:
+            argv.append(f"--{name}={value}")
+        output_dir = os.path.join(work_dir, 'output')
+        try:
+            args, extra = make_argument_parser(exit_on_error=False).parse_known_args(argv)
+            if extra:
+                return 400, f"ERROR: Unexpected value(s): {' '.join(extra)}"
+            builder = CodeplugBuilder(cache=cache, verbose=False,
+                                      **dict(builder_options(args), log_scanlists=False))
+            os.makedirs(output_dir)
+            builder.write_files(output_dir, args.analog_csv, args.digital_others_csv, args.digital_repeaters_csv,
+                                args.talkgroups_csv, args.config, args.dmr_id, args.contacts_csv)
+        except argparse.ArgumentError as exc:
+            return 400, f"ERROR: {exc}"
+        except ValidationError as exc:
+            return 422, exc.report()
+        except BuildError as exc:
+            return 422, f"ERROR: {exc}"
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name in sorted(os.listdir(output_dir)):
+                archive.write(os.path.join(output_dir, name), name)
+            if builder.warnings:
+                archive.writestr('warnings.txt', ''.join(f"WARNING: {message}\n" for message in builder.warnings))
+        return 200, buffer.getvalue()
+
+def extract_channel_csv_default(rows):
+    channel_csv_field_name = {}
+    channel_csv_default_value = {}
+    for row in rows:
+        channel_csv_field_name[int(row[0])] = row[1]
+        channel_csv_default_value[int(row[0])] = row[2]
+    return channel_csv_field_name, channel_csv_default_value
+
+def _zone_row_details(values, channel0, rx0, tx0):
+    values.extend([channel0, rx0, tx0, channel0, rx0, tx0])
+
+def _scanlist_row_details(values, channel0, rx0, tx0):
+    values.extend(["Off", "Off", "", "", "", "", "", "Selected", "0.5", "0.5", "0.1", "0.1"])
+
+def split_list(text):
+    """Split a comma separated command line value, ignoring empty items."""
+    return [item.strip() for item in text.split(',') if item.strip()] if text else []
+
+def parse_talkgroup_ids(spec):
+    """Parse a list of talkgroup IDs and ID ranges such as '91,310-319' into (low, high) pairs."""
+    ranges = []
+    for part in spec.split(','):
+        low, _, high = part.strip().partition('-')
+        if not low.strip().isdecimal() or (high and not high.strip().isdecimal()):
+            error(f"Invalid Talkgroup IDs: '{part.strip()}' in '{spec}' must be an ID like 91 or a range like 310-319")
+        low = int(low)
+        high = int(high) if high else low
+        ranges.append((min(low, high), max(low, high)))
+    return ranges
+
+def parse_frequency(text):
+    """Parse a frequency in MHz into integer Hz, or None if it isn't a number."""
+    whole, _, fraction = text.strip().partition('.')
+    if whole.isdecimal() and len(fraction) <= 6 and (not fraction or fraction.isdecimal()):
+        return int(whole) * HZ_PER_MHZ + int(fraction.ljust(6, '0'))
+    try:
+        mhz = float(text)
+    except ValueError:
+        return None
+    if mhz != mhz or mhz in (float('inf'), float('-inf')):
+        return None
+    return round(mhz * HZ_PER_MHZ)
+
+def format_mhz(hz):
+    """Format integer Hz as MHz without trailing zeros, for messages."""
+    return format_frequency(hz).rstrip('0').rstrip('.')
+
+def format_frequency(hz):
+    """Format integer Hz the way the CPS writes frequencies: MHz with five decimal places."""
+    tens = (hz + 5) // 10
+    return f"{tens // 100000}.{tens % 100000:05d}"
 
 def dmr_mode(chan_config):
     result = VAL_DMR_MODE_SIMPLEX
-    if chan_config[CHAN_RX_FREQ] != chan_config[CHAN_TX_FREQ]:
+    if chan_config[REC_RX_FREQ] != chan_config[REC_TX_FREQ]:
         result = VAL_DMR_MODE_REPEATER
     return result
 
@@ -496,133 +2723,37 @@ def handle_nickname_values(value):
     nick = subvalues[1] if len(subvalues) > 1 else ''
     return full, nick
 
-def make_channel_name(zone_nick, chan_full, chan_nick):
-    if global_nickname_mode == 'off' or not zone_nick:
-        return chan_full
-    if not chan_nick:
-        chan_nick = chan_full
-    if global_nickname_mode in ('prefix-forced', 'suffix-forced'):
-        chan_full = chan_nick
-    if len(zone_nick) + len(chan_full) + 1 <= LENGTH_CHAN_NAME:
-        chan_name, sep = chan_full, ' '
-    elif len(zone_nick) + len(chan_nick) + 1 <= LENGTH_CHAN_NAME:
-        chan_name, sep = chan_nick, ' '
-    elif len(zone_nick) + len(chan_nick) <= LENGTH_CHAN_NAME:
-        chan_name, sep = chan_nick, ''
-    else:
-        error(f"Can't make a channel name fit into 16 characters for '{zone_nick}' and '{chan_nick}'")
-    if not re.match(r'^[A-Za-z0-9]', zone_nick):
-        sep = ''
-    if global_nickname_mode in ('prefix', 'prefix-forced'):
-        return f"{zone_nick}{sep}{chan_name}"
-    return f"{chan_name}{sep}{zone_nick}"
-
-# Data Validation Routines
-def validate_bandwidth(mode):
-    valid_modes = {"25K", "12.5K"}
-    return _validate_membership(mode, valid_modes, "Analog Mode")
-
-def validate_call_type(call_type):
-    valid_call_types = {"Private Call", "Group Call"}
-    return _validate_membership(call_type, valid_call_types, "Call Type")
-
-def validate_channel_name(contact):
-    return _validate_string_length("Channel Name", contact, LENGTH_CHAN_NAME)
-
-def validate_color_code(color_code):
-    return _validate_num_in_range("Color Code", color_code, 0, 15)
-
-def validate_contact(contact):
-    return _validate_string_length("Contact (aka Talk Group)", contact, LENGTH_CHAN_NAME)
-
-def validate_ctcss(ctcss):
-    if ctcss == 'Off':
-        return ctcss
-    if re.match(r'D[0-9A-Za-z]+', ctcss) and len(ctcss) < 10:
-        return ctcss
-    return _validate_num_in_range('CTCSS/DCS', ctcss, 0, 300)
-
-def validate_freq(freq):
-    return _validate_num_in_range('Frequency', freq, 0, 1000)
-
-def validate_name(name):
-    return _validate_string_length('Channel Name', name, LENGTH_CHAN_NAME)
-
-def validate_power(power):
-    valid_power_levels = {"Low", "Mid", "High", "Turbo"}
-    return _validate_membership(power, valid_power_levels, "Power Level")
-
-def validate_timeslot(timeslot):
-    valid_timeslots = {"1", "2", "-"}
-    return _validate_membership(timeslot, valid_timeslots, "Time Slot")
-
-def validate_tx_prohibit(tx_prohibit):
-    return _validate_on_off(tx_prohibit, "TX Prohibit")
-
-def validate_zone(zone):
-    return _validate_string_length('Zone', zone, 16)
-
-def validate_sort_mode(sort_order):
-    valid_sort_orders = {"alpha", "repeaters-first", "analog-first", "analog_and_others_first"}
-    return _validate_membership(sort_order, valid_sort_orders, "Sort Order")
-
-def validate_hotspot_mode(hotspot_mode):
-    valid_modes = {"always", "same-color-code"}
-    return _validate_membership(hotspot_mode, valid_modes, "Hotspot TX Permit")
-
-def validate_nickname_mode(nickname_mode):
-    valid_modes = {"off", "prefix", "suffix", "prefix-forced", "suffix-forced"}
-    return _validate_membership(nickname_mode, valid_modes, "Nickname Mode")
-
-def validate_talkgroup_sort(sort_mode):
-    valid_modes = {"input", "id", "name"}
-    return _validate_membership(sort_mode, valid_modes, "Talkgroup Sort")
-
-# Validation Helpers
-def _validate_membership(value, valid_set, error_type):
-    if value not in valid_set:
-        error_msg = f"Invalid {error_type}: '{value}' is not one of: {', '.join(valid_set)} {_file_and_line()}"
-        error(error_msg)
-    return value
-
-def _validate_num_in_range(type_name, value, min_val, max_val):
-    try:
-        num = float(value)
-        if num < min_val or num > max_val:
-            error(f"Invalid {type_name}: '{value}' must be a number between {min_val} and {max_val} (inclusive) {_file_and_line()} ")
-    except ValueError:
-        error(f"Invalid {type_name}: '{value}' must be a number between {min_val} and {max_val} (inclusive) {_file_and_line()}")
-    return value
-
-def _validate_on_off(value, error_type):
-    valid_on_off = {"On", "Off"}
-    return _validate_membership(value, valid_on_off, error_type)
-
-def _validate_string_length(type_name, string, length):
-    if len(string) > length:
-        error(f"Invalid {type_name}: '{string}' is more than {length} characters {_file_and_line()}")
-    return string
-
-def _file_and_line():
-    return f"[On line {global_line_number} of {global_file_name} file.]"
-
-def validate_tx_permit(tx_permit):
-    valid_tx_permits = {"Always", "ChannelFree", "Same Color Code", "Different Color Code"}
-    return _validate_membership(tx_permit, valid_tx_permits, "TX Permit")
-
 def error(message):
-    print(f"ERROR: {message}")
-    sys.exit(1)
+    raise BuildError(message)
 
 def warning(message):
     print(f"WARNING: {message}")
 
 def handle_command_line_args():
+    parser = make_argument_parser()
+    args = parser.parse_args()
+
+    if args.serve is not None and not 0 <= args.serve <= 65535:
+        parser.error("--serve needs a port from 0 to 65535.")
+    if args.contacts_limit < 1:
+        parser.error("--contacts-limit needs to be at least 1.")
+    if args.collision_report and args.duplicate_names == 'allow':
+        parser.error("--collision-report needs a --duplicate-names mode that looks for clashes, not allow.")
+
+    if not args.generate_templates and args.serve is None:
+        if not all([args.analog_csv, args.digital_others_csv, args.digital_repeaters_csv, args.talkgroups_csv]):
+            parser.error("All input CSV files (--analog-csv, --digital-others-csv, --digital-repeaters-csv, --talkgroups-csv) "
+                         "are required unless --generate-templates is used.")
+
+    return args
+
+def make_argument_parser(exit_on_error=True):
     parser = argparse.ArgumentParser(
         description="Anytone Config Builder\n\n"
                     "This script generates CSV files for Anytone CPS from input CSV files.\n"
                     "Use --generate-templates to create example CSV files with headers.",
-        formatter_class=argparse.RawTextHelpFormatter
+        formatter_class=argparse.RawTextHelpFormatter,
+        exit_on_error=exit_on_error
     )
 
     parser.add_argument(
@@ -660,15 +2791,30 @@ def handle_command_line_args():
     parser.add_argument(
         '--sorting',
         default='alpha',
-        choices=['alpha', 'repeaters-first', 'analog-first', 'analog_and_others_first'],
+        choices=['alpha', 'repeaters-first', 'analog-first', 'analog_and_others_first', 'frequency', 'band-frequency'],
         help='Zone sorting mode:\n'
              '  alpha: Sort all zones alphabetically.\n'
              '  repeaters-first: Place digital repeater zones first, then others, each sorted alphabetically.\n'
              '  analog-first: Place analog zones first, then others, each sorted alphabetically.\n'
              '  analog_and_others_first: Place analog and digital-others zones first, sorted alphabetically,\n'
              '                           followed by digital-repeater zones, sorted alphabetically.\n'
+             '  frequency: Sort zones by their lowest RX frequency.\n'
+             '  band-frequency: Sort zones by the amateur band of their lowest RX frequency, then by that\n'
+             '                  frequency. Zones outside the amateur bands come last.\n'
              'Default: alpha'
     )
+    parser.add_argument(
+        '--channel-sort',
+        default='auto',
+        choices=['auto', 'frequency', 'band-frequency', 'talkgroup-id'],
+        help='Channel order inside each zone and scan list:\n'
+             '  auto: Alphabetical with --sorting alpha, otherwise talkgroup input order with analog\n'
+             '        channels in input order.\n'
+             '  frequency: By RX frequency, then TX frequency.\n'
+             '  band-frequency: By amateur band, then RX frequency. Channels outside the amateur bands come last.\n'
+             '  talkgroup-id: Digital channels by talkgroup ID, then analog channels by RX frequency.\n'
+             'Default: auto'
+    )
     parser.add_argument(
         '--hotspot-tx-permit',
         default='same-color-code',
@@ -691,6 +2837,21 @@ def handle_command_line_args():
              '  name: Sort by Talkgroup Name alphabetically (case-insensitive).\n'
              'Default: input'
     )
+    parser.add_argument(
+        '--talkgroup-filter',
+        default='all',
+        choices=['all', 'used'],
+        help='Which talkgroups to write to talkgroups.csv:\n'
+             '  all  - every talkgroup in the talkgroups input file (default)\n'
+             '  used - only the talkgroups used by a channel, plus any --include-talkgroups.\n'
+             '         Lets you use a full network talkgroup list as the input file.'
+    )
+    parser.add_argument(
+        '--include-talkgroups',
+        required=False,
+        help='With --talkgroup-filter used, also keep these talkgroup IDs. A comma separated\n'
+             'list of IDs and ID ranges, e.g. 91,93,3100-3199'
+    )
     parser.add_argument(
         '--generate-templates',
         action='store_true',
@@ -704,20 +2865,179 @@ def handle_command_line_args():
              'This will utilize the standard naming convention to match the\n'
              'channels for your DMR ID.'
     )
-
-    args = parser.parse_args()
-
-    if not args.generate_templates:
-        if not all([args.analog_csv, args.digital_others_csv, args.digital_repeaters_csv, args.talkgroups_csv]):
-            parser.error("All input CSV files (--analog-csv, --digital-others-csv, --digital-repeaters-csv, --talkgroups-csv) "
-                         "are required unless --generate-templates is used.")
-
-    global global_sort_mode, global_hotspot_tx_permit, global_nickname_mode, global_talkgroup_sort
-    global_sort_mode = validate_sort_mode(args.sorting)
-    global_hotspot_tx_permit = validate_hotspot_mode(args.hotspot_tx_permit)
-    global_nickname_mode = validate_nickname_mode(args.nicknames)
-    global_talkgroup_sort = validate_talkgroup_sort(args.talkgroup_sort)
-    return args
+    parser.add_argument(
+        '--contacts-csv',
+        required=False,
+        help='A RadioID.net user dump (user.csv). Adds a digital_contacts.csv file for the\n'
+             "radio's Digital Contact List."
+    )
+    parser.add_argument(
+        '--contacts-country',
+        required=False,
+        help='Only keep contacts from these countries (comma separated), e.g. "United States,Canada"'
+    )
+    parser.add_argument(
+        '--contacts-state',
+        required=False,
+        help='Only keep contacts from these states/provinces (comma separated), e.g. "Oregon,Washington"'
+    )
+    parser.add_argument(
+        '--contacts-id-prefix',
+        required=False,
+        help='Only keep contacts whose DMR ID starts with one of these (comma separated), e.g. 310,311'
+    )
+    parser.add_argument(
+        '--contacts-limit',
+        type=int,
+        default=CONTACT_CAPACITY,
+        help=f'Maximum number of contacts to write. Default: {CONTACT_CAPACITY}, what the AT-D878UV holds.'
+    )
+    parser.add_argument(
+        '--repeater-directory',
+        required=False,
+        help='Pick the DMR repeaters from this repeater directory export instead of listing them\n'
+             'in the Digital-Repeaters file. Needs the columns Callsign, Latitude, Longitude,\n'
+             'Output Freq, Input Freq and Color Code (Location is optional). The Digital-Repeaters\n'
+             'file then only needs its header and one template row with the Power and time slots\n'
+             'to use for every picked repeater. Use with --near and/or --route.'
+    )
+    parser.add_argument(
+        '--near',
+        action='append',
+        help='Pick the directory repeaters within --radius of this point, given as latitude,longitude\n'
+             '(e.g. 45.52,-122.68). Can be given more than once.'
+    )
+    parser.add_argument(
+        '--route',
+        required=False,
+        help='Pick the directory repeaters within --radius of a route: a CSV file of points with\n'
+             'Latitude and Longitude columns, in driving order.'
+    )
+    parser.add_argument(
+        '--radius',
+        type=float,
+        default=DEFAULT_REPEATER_RADIUS_KM,
+        help=f'Distance in km used by --near and --route. Default: {DEFAULT_REPEATER_RADIUS_KM}'
+    )
+    parser.add_argument(
+        '--cache-directory',
+        required=False,
+        help='Directory for the incremental build cache. Parsed and validated input files are\n'
+             'kept here and reused until the file or a relevant option changes.'
+    )
+    parser.add_argument(
+        '--streaming',
+        action='store_true',
+        help='Keep memory use flat for very large inputs by spilling zone and scanlist\n'
+             'membership to sorted temporary files and merging them when writing.'
+    )
+    parser.add_argument(
+        '--duplicate-names',
+        choices=['warn', 'error', 'rename', 'allow'],
+        help='What to do when two channels end up with the same name (zones and scanlists pick\n'
+             'channels by name, so the CPS may use the wrong one):\n'
+             '  warn   - build anyway and print a warning\n'
+             '  error  - stop with an error listing every clash\n'
+             '  rename - give the later channels a free name, trying the other nickname\n'
+             '           form first and then a -2, -3, ... counter (max 16 characters)\n'
+             '  allow  - don\'t check (default, or warn with --collision-report; the other modes\n'
+             '           keep every channel name in memory, which adds up on very large or --streaming builds)'
+    )
+    parser.add_argument(
+        '--collision-report',
+        required=False,
+        help='Write every channel name clash (and its new name when renamed) to this CSV file.\n'
+             'Turns on --duplicate-names warn unless another mode is given; can\'t be used with allow.'
+    )
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='Check every row of every input file and list all the errors found, without\n'
+             'writing any output files.'
+    )
+    parser.add_argument(
+        '--capacity',
+        action='store_true',
+        help='Before building, count the channels, zones, scanlists and talkgroups the input files\n'
+             'will produce and print how much of the radio they fill. Stops without writing anything\n'
+             'if the codeplug won\'t fit.'
+    )
+    parser.add_argument(
+        '--error-report',
+        required=False,
+        help='Also save the list of input errors to this JSON file (file, line, column and message\n'
+             'for each error).'
+    )
+    parser.add_argument(
+        '--quiet',
+        action='store_true',
+        help="Don't list every scanlist and its channel count. Warnings and errors are still shown."
+    )
+    parser.add_argument(
+        '--timings',
+        action='store_true',
+        help='Print how long each build stage took, plus counters such as channels emitted,\n'
+             'matrix cells expanded, overflow scanlists and validator calls.'
+    )
+    parser.add_argument(
+        '--timings-json',
+        required=False,
+        help='Write the --timings stage times and counters to this JSON file.'
+    )
+    parser.add_argument(
+        '--profile',
+        required=False,
+        help='Run the build under cProfile and save the profile to this file\n'
+             '(view it with: python -m pstats <file>).'
+    )
+    parser.add_argument(
+        '--delta',
+        action='store_true',
+        help='Compare the new files with the ones already in the output directory and print\n'
+             'what changed (channels added, removed or changed, and zone/scanlist members).'
+    )
+    parser.add_argument(
+        '--delta-json',
+        required=False,
+        help='Write the --delta comparison to this JSON file.'
+    )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Keep running and rebuild the output files every time one of the input files\n'
+             'is saved. Stop with Ctrl+C.'
+    )
+    parser.add_argument(
+        '--batch-manifest',
+        required=False,
+        help='Path to a batch manifest CSV with one codeplug profile per row\n'
+             '(Profile, DMR ID, Sorting, Nicknames, Talkgroup Sort, Hotspot TX Permit).\n'
+             'Each profile is written to its own folder inside the output directory.\n'
+             'Blank cells use the value given on the command line.'
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        required=False,
+        help='Number of worker processes for --batch-manifest builds. Defaults to the CPU count.\n'
+             'For single builds, a value above 1 also splits a very large Digital-Repeaters talkgroup\n'
+             'matrix across that many processes. With --serve, the number of builds run at once.'
+    )
+    parser.add_argument(
+        '--serve',
+        type=int,
+        metavar='PORT',
+        required=False,
+        help='Run a build service on this port instead of building once. POST the input CSVs and\n'
+             'options as a multipart form to /build and get the codeplug back as a zip file.\n'
+             'Port 0 picks a free port and prints it.'
+    )
+    parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help='Address the --serve build service listens on. Default: 127.0.0.1 (this computer only)'
+    )
+    return parser
 
 def generate_templates(templates_dir):
     os.makedirs(templates_dir, exist_ok=True)
@@ -766,4 +3086,4 @@ def generate_templates(templates_dir):
         csv_out.writerow(["31666", "DMR Anarchy", "Group Call", "None"])
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
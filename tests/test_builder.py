@@ -0,0 +1,721 @@
+import contextlib
+import io
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import builder  # noqa: E402
+
+
+class TemplateInputs(unittest.TestCase):
+    """Runs each test in a scratch directory holding the generated template sheets."""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='codeplug-test-')
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        builder.generate_templates(self.work_dir)
+        self.output_dir = os.path.join(self.work_dir, 'Output')
+        os.makedirs(self.output_dir)
+
+    def input_path(self, name):
+        return os.path.join(self.work_dir, f"{name}_template.csv")
+
+    def input_args(self):
+        return ['--analog-csv', self.input_path('Analog'),
+                '--digital-others-csv', self.input_path('Digital-Others'),
+                '--digital-repeaters-csv', self.input_path('Digital-Repeaters'),
+                '--talkgroups-csv', self.input_path('TalkGroups'),
+                '--config', builder.DEFAULT_CONFIG_DIRECTORY,
+                '--output-directory', self.output_dir, '--quiet']
+
+    def parse_args(self, *extra):
+        return builder.make_argument_parser().parse_args(self.input_args() + list(extra))
+
+    def append_row(self, name, row):
+        with open(self.input_path(name), 'a', encoding='utf-8') as fh:
+            fh.write(row + '\n')
+
+    def write_rows(self, name, rows):
+        """Replace an input sheet's data rows, keeping its header."""
+        header = builder.read_csv_rows(self.input_path(name))[0]
+        with open(self.input_path(name), 'w', encoding='utf-8') as fh:
+            fh.write(','.join(header) + '\n')
+        for row in rows:
+            self.append_row(name, row)
+
+    def build_tables(self, **options):
+        inputs = [builder.read_csv_rows(self.input_path(name))
+                  for name in ('TalkGroups', 'Analog', 'Digital-Others', 'Digital-Repeaters')]
+        return builder.build_codeplug(*inputs, verbose=False, log_scanlists=False, **options)
+
+
+class WatchTest(TemplateInputs):
+
+    def test_failed_build_is_not_the_baseline(self):
+        analog = self.input_path('Analog')
+        with open(analog, encoding='utf-8') as fh:
+            good = fh.read()
+        self.append_row('Analog', 'Calling,Broken,25K,High,14x.52,146.52,Off,Off,Off')
+        args = self.parse_args('--dmr-id', '3112345')
+        options = builder.builder_options(args)
+        cache = builder.MemoryInputCache()
+        stamps = {'talkgroups': (1, 1), 'analog': (1, 1)}
+        with contextlib.redirect_stdout(io.StringIO()):
+            built = None
+            if builder.watch_rebuild(args, self.output_dir, options, cache,
+                                     builder.watch_outputs_to_skip(args, stamps, built), ['analog']):
+                built = stamps
+            self.assertIsNone(built)
+
+            with open(analog, 'w', encoding='utf-8') as fh:
+                fh.write(good)
+            stamps = {'talkgroups': (1, 1), 'analog': (2, 1)}
+            self.assertTrue(builder.watch_rebuild(args, self.output_dir, options, cache,
+                                                  builder.watch_outputs_to_skip(args, stamps, built), ['analog']))
+        for name in ('channels.csv', 'talkgroups.csv', 'radio_id_list.csv'):
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, name)), name)
+
+    def test_unchanged_inputs_are_skipped_after_a_good_build(self):
+        args = self.parse_args()
+        stamps = {'talkgroups': (1, 1), 'analog': (2, 1)}
+        self.assertEqual(builder.watch_outputs_to_skip(args, stamps, dict(stamps, analog=(1, 1))),
+                         {'radio_id_list.csv', 'talkgroups.csv', 'digital_contacts.csv'})
+        self.assertEqual(builder.watch_outputs_to_skip(args, stamps, None), set())
+
+
+class CountingCache(builder.InputCache):
+    """InputCache that records which stages were loaded from the cache."""
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.hits = set()
+
+    def load(self, stage, key):
+        result = super().load(stage, key)
+        if result is not None:
+            self.hits.add(stage)
+        return result
+
+
+class InputCacheTest(TemplateInputs):
+
+    def build(self, **options):
+        cache = CountingCache(os.path.join(self.work_dir, 'cache'))
+        builder.CodeplugBuilder(verbose=False, cache=cache, **options).write_files(
+            self.output_dir, self.input_path('Analog'), self.input_path('Digital-Others'),
+            self.input_path('Digital-Repeaters'), self.input_path('TalkGroups'), builder.DEFAULT_CONFIG_DIRECTORY)
+        outputs = {}
+        for name in os.listdir(self.output_dir):
+            with open(os.path.join(self.output_dir, name), 'rb') as fh:
+                outputs[name] = fh.read()
+        return cache.hits, outputs
+
+    def test_cache_hit_gives_the_same_outputs(self):
+        hits, first = self.build()
+        self.assertEqual(hits, set())
+        hits, second = self.build()
+        self.assertEqual(hits, {'talkgroups', 'channel-defaults', 'analog', 'digital-others', 'digital-repeaters'})
+        self.assertEqual(second, first)
+
+    def test_changed_file_is_read_again(self):
+        self.build()
+        self.append_row('Analog', 'Calling,Simplex 70cm,25K,High,446.5,446.5,Off,Off,Off')
+        hits, outputs = self.build()
+        self.assertNotIn('analog', hits)
+        self.assertIn('digital-repeaters', hits)
+        self.assertIn(b'Simplex 70cm', outputs['channels.csv'])
+
+    def test_changed_option_is_read_again(self):
+        self.build()
+        hits, _ = self.build(nicknames='prefix')
+        self.assertNotIn('digital-repeaters', hits)
+        self.assertIn('analog', hits)
+
+    def test_changed_talkgroups_invalidate_the_channel_files(self):
+        self.build()
+        self.append_row('TalkGroups', '3199,Unused,Group Call,None')
+        hits, _ = self.build()
+        self.assertEqual(hits, {'channel-defaults', 'analog'})
+
+
+class StreamingTest(TemplateInputs):
+
+    def build(self, output_dir, **options):
+        os.makedirs(output_dir)
+        builder.CodeplugBuilder(verbose=False, log_scanlists=False, **options).write_files(
+            output_dir, self.input_path('Analog'), self.input_path('Digital-Others'),
+            self.input_path('Digital-Repeaters'), self.input_path('TalkGroups'), builder.DEFAULT_CONFIG_DIRECTORY)
+        outputs = {}
+        for name in os.listdir(output_dir):
+            with open(os.path.join(output_dir, name), 'rb') as fh:
+                outputs[name] = fh.read()
+        return outputs
+
+    def test_streaming_output_is_identical(self):
+        for i in range(80):
+            self.append_row('Digital-Repeaters', f"Rpt{i % 7};R{i % 7},,High,{441 + i * 0.025:.3f},"
+                                                 f"{446 + i * 0.025:.3f},1,1,2,{1 + i % 2}")
+        spill = builder.SpilledMemberGroups._spill
+        with mock.patch.object(builder.SpilledMemberGroups.__init__, '__defaults__', (7,)), \
+                mock.patch.object(builder.SpilledMemberGroups, '_spill', autospec=True, side_effect=spill) as spilled:
+            for sorting, channel_sort in (('alpha', 'auto'), ('repeaters-first', 'auto'), ('frequency', 'talkgroup-id')):
+                options = {'sorting': sorting, 'channel_sort': channel_sort, 'nicknames': 'prefix'}
+                name = f"{sorting}-{channel_sort}"
+                normal = self.build(os.path.join(self.work_dir, name), **options)
+                streamed = self.build(os.path.join(self.work_dir, f"{name}-streaming"), streaming=True, **options)
+                self.assertEqual(streamed, normal, name)
+        self.assertTrue(spilled.called)
+
+
+class DeltaTest(TemplateInputs):
+
+    def build(self):
+        code_builder = builder.CodeplugBuilder(verbose=False, log_scanlists=False)
+        code_builder.write_files(self.output_dir, self.input_path('Analog'), self.input_path('Digital-Others'),
+                                 self.input_path('Digital-Repeaters'), self.input_path('TalkGroups'),
+                                 builder.DEFAULT_CONFIG_DIRECTORY, delta=True)
+        return code_builder.delta
+
+    def test_first_and_unchanged_builds(self):
+        self.assertTrue(self.build().first_build)
+        delta = self.build()
+        self.assertFalse(delta.reimport_needed())
+        self.assertEqual(delta.changed_files, [])
+
+    def test_added_removed_and_changed_channels(self):
+        self.build()
+        rows = builder.read_csv_rows(self.input_path('Analog'))[1:]
+        rows = [row for row in rows if row[1] != 'NOAA7']
+        for row in rows:
+            if row[1] == 'Simplex 2m Call':
+                row[3] = 'High'
+        rows.append(['Calling', 'Simplex 70cm', '25K', 'High', '446.5', '446.5', 'Off', 'Off', 'Off'])
+        self.write_rows('Analog', [','.join(row) for row in rows])
+
+        delta = self.build()
+        self.assertTrue(delta.reimport_needed())
+        self.assertEqual(sorted(delta.changed_files), ['channels.csv', 'scanlists.csv', 'zones.csv'])
+        self.assertEqual(delta.unchanged_files, ['talkgroups.csv'])
+        self.assertEqual(delta.channels['added'], ['Simplex 70cm (RX 446.50000, TX 446.50000)'])
+        self.assertEqual(delta.channels['removed'], ['NOAA7 (RX 162.55000, TX 440.00000)'])
+        self.assertEqual(delta.channels['changed'],
+                         [{'channel': 'Simplex 2m Call (RX 146.52000, TX 146.52000)', 'fields': ['Transmit Power']}])
+        self.assertEqual(delta.channels['renumbered'], 4)  # The Calling zone's channels move up one
+        self.assertEqual(delta.zones['changed'], [{'name': 'Calling', 'added': ['Simplex 70cm'], 'removed': []},
+                                                  {'name': 'NOAA', 'added': [], 'removed': ['NOAA7']}])
+        self.assertEqual((delta.zones['added'], delta.zones['removed']), ([], []))
+
+
+class ParallelExpansionTest(TemplateInputs):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(60):
+            self.append_row('Digital-Repeaters', f"Rpt{i:02d};R{i:02d},,High,{441 + i * 0.025:.3f},"
+                                                 f"{446 + i * 0.025:.3f},{1 + i % 15},1,{2 - i % 2},-")
+        patcher = mock.patch.object(builder, 'PARALLEL_EXPANSION_MIN_CELLS', 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parallel_output_matches_serial(self):
+        parallel = builder.CodeplugBuilder.extract_dmr_repeater_rows_in_parallel
+        with mock.patch.object(builder.CodeplugBuilder, 'extract_dmr_repeater_rows_in_parallel', autospec=True,
+                               side_effect=parallel) as expanded:
+            for options in ({}, {'nicknames': 'prefix', 'sorting': 'frequency'}):
+                self.assertEqual(self.build_tables(expansion_jobs=2, **options), self.build_tables(**options), options)
+        self.assertEqual(expanded.call_count, 2)
+
+    def test_parallel_errors_match_serial(self):
+        self.append_row('Digital-Repeaters', 'Broken;BR,,High,44x.000,447.000,1,1,1,1')
+        self.append_row('Digital-Repeaters', 'Broken2;BR2,,High,442.000,447.000,99,1,1,1')
+        issues = []
+        for jobs in (2, 1):
+            with self.assertRaises(builder.ValidationError) as caught:
+                self.build_tables(expansion_jobs=jobs, collect_errors=True)
+            issues.append(caught.exception.issues)
+        self.assertEqual(len(issues[1]), 2)
+        self.assertEqual(issues[0], issues[1])
+
+
+class SortTest(TemplateInputs):
+
+    def setUp(self):
+        super().setUp()
+        self.append_row('Analog', 'Calling,Marine 16,25K,High,156.8,156.8,Off,Off,On')
+        self.append_row('Digital-Others', 'Alpha Hotspot,Hot/Parrot,Low,433.1,433.1,1,1,Parrot,1,Private Call,Same Color Code')
+
+    def zones(self, **options):
+        return {row[1]: row[2].split('|') for row in self.build_tables(**options)['zones.csv'][1:]}
+
+    def test_zone_sorts(self):
+        expected = {
+            'alpha': ['Alpha Hotspot', 'Calling', 'NOAA', 'Oakland/Cherry', 'Oakland/Valley', 'PiStar', 'Salem/MT'],
+            'repeaters-first': ['Oakland/Cherry', 'Oakland/Valley', 'Salem/MT', 'Alpha Hotspot', 'Calling', 'NOAA', 'PiStar'],
+            'analog-first': ['Calling', 'NOAA', 'Alpha Hotspot', 'Oakland/Cherry', 'Oakland/Valley', 'PiStar', 'Salem/MT'],
+            'analog_and_others_first': ['Alpha Hotspot', 'Calling', 'NOAA', 'PiStar',
+                                        'Oakland/Cherry', 'Oakland/Valley', 'Salem/MT'],
+            # By each zone's lowest RX frequency
+            'frequency': ['Calling', 'NOAA', 'Alpha Hotspot', 'Oakland/Cherry', 'Salem/MT', 'Oakland/Valley', 'PiStar'],
+            # The same, but amateur bands first in band plan order and NOAA (outside them) last
+            'band-frequency': ['Calling', 'Alpha Hotspot', 'Oakland/Cherry', 'Salem/MT', 'Oakland/Valley', 'PiStar', 'NOAA'],
+        }
+        self.assertEqual(set(expected), builder.VALID_SORT_MODES)
+        for sorting, zones in expected.items():
+            self.assertEqual(list(self.zones(sorting=sorting)), zones, sorting)
+
+    def test_channel_sorts(self):
+        expected = {
+            # Talkgroup input order, then analog channels in input order
+            ('repeaters-first', 'auto'): (['Calling 2m', 'Simplex 2m Call', '70CM Calling', '70CM Calling1', 'Marine 16'],
+                                          ['Bridge 2', 'N America', 'DMR Anarchy']),
+            ('alpha', 'auto'): (['70CM Calling', '70CM Calling1', 'Calling 2m', 'Marine 16', 'Simplex 2m Call'],
+                                ['Bridge 2', 'DMR Anarchy', 'N America']),
+            ('alpha', 'frequency'): (['Calling 2m', 'Simplex 2m Call', 'Marine 16', '70CM Calling', '70CM Calling1'],
+                                     ['Bridge 2', 'DMR Anarchy', 'N America']),
+            ('alpha', 'band-frequency'): (['Calling 2m', 'Simplex 2m Call', '70CM Calling', '70CM Calling1', 'Marine 16'],
+                                          ['Bridge 2', 'DMR Anarchy', 'N America']),
+            # Talkgroup IDs 93, 3100 and 31666; analog channels by frequency
+            ('alpha', 'talkgroup-id'): (['Calling 2m', 'Simplex 2m Call', 'Marine 16', '70CM Calling', '70CM Calling1'],
+                                        ['N America', 'Bridge 2', 'DMR Anarchy']),
+        }
+        self.assertEqual({channel_sort for _, channel_sort in expected}, builder.VALID_CHANNEL_SORTS)
+        for (sorting, channel_sort), (calling, valley) in expected.items():
+            zones = self.zones(sorting=sorting, channel_sort=channel_sort)
+            self.assertEqual((zones['Calling'], zones['Oakland/Valley']), (calling, valley), (sorting, channel_sort))
+
+
+class OverflowScanlistTest(TemplateInputs):
+
+    def test_full_scanlists_overflow_in_order(self):
+        self.write_rows('Digital-Repeaters', [f"Rpt{i:03d},,High,{441 + i * 0.025:.3f},{446 + i * 0.025:.3f},1,1,2,-"
+                                              for i in range(120)])
+        tables = self.build_tables()
+        members = {row[1]: len(row[2].split('|')) for row in tables['scanlists.csv'][1:]}
+        for talkgroup in ('DMR Anarchy', 'Bridge 2'):
+            self.assertEqual([members.get(talkgroup), members.get(f"{talkgroup}_OF2"), members.get(f"{talkgroup}_OF3")],
+                             [builder.SCANLIST_LIMIT, builder.SCANLIST_LIMIT, 120 - 2 * builder.SCANLIST_LIMIT])
+            self.assertNotIn(f"{talkgroup}_OF4", members)
+
+        channels = tables['channels.csv']
+        scan_list = channels[0].index('Scan List')
+        anarchy = [row[scan_list] for row in channels[1:] if row[1] == 'DMR Anarchy']
+        limit = builder.SCANLIST_LIMIT
+        self.assertEqual(anarchy, ['DMR Anarchy'] * limit + ['DMR Anarchy_OF2'] * limit + ['DMR Anarchy_OF3'] * (120 - 2 * limit))
+
+    def test_overflow_numbers_are_kept_per_base_name(self):
+        code_builder = builder.CodeplugBuilder(verbose=False)
+        names = []
+        for _ in range(builder.SCANLIST_LIMIT + 1):
+            for base_name in ('A', 'B'):
+                name = code_builder.get_overflow_scanlist_name(base_name)
+                code_builder.scanlist_channel_counts[name] += 1
+                names.append(name)
+        self.assertEqual(names.count('A'), builder.SCANLIST_LIMIT)
+        self.assertEqual(names[-2:], ['A_OF2', 'B_OF2'])
+
+
+class OutputTest(TemplateInputs):
+
+    def build(self):
+        builder.CodeplugBuilder(verbose=False).write_files(
+            self.output_dir, self.input_path('Analog'), self.input_path('Digital-Others'),
+            self.input_path('Digital-Repeaters'), self.input_path('TalkGroups'), builder.DEFAULT_CONFIG_DIRECTORY)
+
+    def output_files(self):
+        contents = {}
+        for name in os.listdir(self.output_dir):
+            with open(os.path.join(self.output_dir, name), 'rb') as fh:
+                contents[name] = fh.read()
+        return contents
+
+    def test_failed_build_leaves_outputs_untouched(self):
+        self.build()
+        before = self.output_files()
+        self.append_row('Digital-Others', 'PiStar,Typo,Low,44x.35,445.35,1,1,Bridge 2,1,Group Call,Same Color Code')
+        with self.assertRaises(builder.BuildError):
+            self.build()
+        self.assertEqual(self.output_files(), before)
+
+    def test_stale_staging_directories_are_removed(self):
+        stale = os.path.join(self.output_dir, '.codeplug-killed')
+        recent = os.path.join(self.output_dir, '.codeplug-running')
+        for path in (stale, recent):
+            os.mkdir(path)
+            with open(os.path.join(path, 'channels.csv'), 'w', encoding='utf-8'):
+                pass
+        old = os.stat(stale).st_mtime - builder.STALE_STAGING_SECONDS - 1
+        os.utime(stale, (old, old))
+        self.build()
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(recent))
+
+
+class RepeaterDirectoryTest(TemplateInputs):
+
+    def test_missing_route_file_is_a_build_error(self):
+        args = self.parse_args('--repeater-directory', 'directory.csv', '--route', os.path.join(self.work_dir, 'nope.csv'))
+        with self.assertRaisesRegex(builder.BuildError, "Can't read the route file"):
+            builder.builder_options(args)
+
+    def test_missing_directory_file_is_a_build_error(self):
+        code_builder = builder.CodeplugBuilder(verbose=False, repeater_directory=os.path.join(self.work_dir, 'nope.csv'),
+                                               repeater_points=[(45.5, -122.6)])
+        with self.assertRaisesRegex(builder.BuildError, "Can't read the repeater directory"):
+            code_builder.write_files(self.output_dir, self.input_path('Analog'), self.input_path('Digital-Others'),
+                                     self.input_path('Digital-Repeaters'), self.input_path('TalkGroups'),
+                                     builder.DEFAULT_CONFIG_DIRECTORY)
+
+
+class BatchTest(TemplateInputs):
+
+    def run_batch(self, *extra):
+        manifest = os.path.join(self.work_dir, 'manifest.csv')
+        with open(manifest, 'w', encoding='utf-8') as fh:
+            fh.write('Profile,DMR ID,Sorting,Nicknames,Talkgroup Sort,Hotspot TX Permit\n')
+            fh.write('alice,3112345,,,,\n')
+        args = self.parse_args('--batch-manifest', manifest, '--jobs', '1', *extra)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            try:
+                builder.run_batch(args, self.output_dir)
+            except SystemExit:
+                return False, output.getvalue()
+        return True, output.getvalue()
+
+    def profile_rows(self, name):
+        return builder.read_csv_rows(os.path.join(self.output_dir, 'alice', name))
+
+    def test_duplicate_names_option_applies_to_profiles(self):
+        ok, output = self.run_batch('--duplicate-names', 'error')
+        self.assertFalse(ok)
+        self.assertIn('[alice]', output)
+        self.assertIn('is already used by a channel', output)
+
+        ok, output = self.run_batch('--duplicate-names', 'rename')
+        self.assertTrue(ok, output)
+        names = [row[1] for row in self.profile_rows('channels.csv')[1:]]
+        self.assertEqual(len(names), len(set(names)))
+
+    def test_input_errors_are_reported_per_profile(self):
+        self.append_row('Analog', 'Calling,Typo,25K,High,14x.52,146.52,Off,Off,Off')
+        ok, output = self.run_batch()
+        self.assertFalse(ok)
+        self.assertIn("ERROR: [alice] Invalid Frequency: '14x.52'", output)
+
+    def test_unwritable_profile_is_a_profile_error(self):
+        with open(os.path.join(self.output_dir, 'alice'), 'w', encoding='utf-8'):
+            pass  # A file where the profile's folder should go
+        ok, output = self.run_batch()
+        self.assertFalse(ok)
+        self.assertIn('ERROR: [alice]', output)
+
+    def test_talkgroup_filter_applies_to_profiles(self):
+        self.append_row('TalkGroups', '3199,Unused,Group Call,None')
+        self.assertTrue(self.run_batch('--talkgroup-filter', 'used')[0])
+        self.assertNotIn('Unused', [row[2] for row in self.profile_rows('talkgroups.csv')])
+
+        self.assertTrue(self.run_batch('--talkgroup-filter', 'used', '--include-talkgroups', '3199')[0])
+        self.assertIn('Unused', [row[2] for row in self.profile_rows('talkgroups.csv')])
+
+    def test_contacts_apply_to_profiles(self):
+        contacts = os.path.join(self.work_dir, 'user.csv')
+        with open(contacts, 'w', encoding='utf-8') as fh:
+            fh.write('RADIO_ID,CALLSIGN,FIRST_NAME,LAST_NAME,CITY,STATE,COUNTRY\n')
+            fh.write('3112345,N0CALL,Pat,Smith,Salem,Oregon,United States\n')
+            fh.write('2341234,G0CALL,Sam,Jones,Leeds,England,United Kingdom\n')
+        self.assertTrue(self.run_batch('--contacts-csv', contacts, '--contacts-country', 'United States')[0])
+        self.assertEqual([row[1] for row in self.profile_rows('digital_contacts.csv')[1:]], ['3112345'])
+
+        self.assertTrue(self.run_batch('--contacts-csv', contacts, '--contacts-limit', '1')[0])
+        self.assertEqual(len(self.profile_rows('digital_contacts.csv')), 2)
+
+    def test_contacts_limit_must_be_positive(self):
+        with self.assertRaisesRegex(builder.BuildError, 'Invalid Contact Limit'):
+            builder.CodeplugBuilder(verbose=False, contact_limit=-1)
+        with mock.patch.object(sys, 'argv', ['builder.py'] + self.input_args() + ['--contacts-limit', '0']), \
+                contextlib.redirect_stderr(io.StringIO()) as stderr, self.assertRaises(SystemExit):
+            builder.handle_command_line_args()
+        self.assertIn('--contacts-limit needs to be at least 1', stderr.getvalue())
+
+    def test_repeater_directory_applies_to_profiles(self):
+        directory = os.path.join(self.work_dir, 'directory.csv')
+        with open(directory, 'w', encoding='utf-8') as fh:
+            fh.write('Callsign,Latitude,Longitude,Output Freq,Input Freq,Color Code,Location\n')
+            fh.write('W7NEAR,45.52,-122.68,443.125,448.125,1,Portland\n')
+            fh.write('W7FAR,47.60,-122.33,444.100,449.100,2,Seattle\n')
+        self.assertTrue(self.run_batch('--repeater-directory', directory, '--near', '45.5,-122.6')[0])
+        zones = [row[1] for row in self.profile_rows('zones.csv')[1:]]
+        self.assertIn('W7NEAR 443.125', zones)
+        self.assertNotIn('W7FAR 444.1', zones)
+        self.assertNotIn('Salem/MT', zones)  # The template's own repeaters are replaced
+
+
+class TalkgroupTest(TemplateInputs):
+
+    def build(self, **options):
+        code_builder = builder.CodeplugBuilder(verbose=False, **options)
+        code_builder.write_files(self.output_dir, self.input_path('Analog'), self.input_path('Digital-Others'),
+                                 self.input_path('Digital-Repeaters'), self.input_path('TalkGroups'),
+                                 builder.DEFAULT_CONFIG_DIRECTORY)
+        return code_builder, builder.read_csv_rows(os.path.join(self.output_dir, 'talkgroups.csv'))[1:]
+
+    def test_duplicate_names_use_the_first_row(self):
+        self.append_row('TalkGroups', '3198,Unused,Group Call,None')
+        self.append_row('TalkGroups', '3199,Unused,Group Call,None')
+        self.append_row('TalkGroups', '9999,DMR Anarchy,Group Call,None')
+        for talkgroup_filter in ('all', 'used'):
+            code_builder, rows = self.build(talkgroup_filter=talkgroup_filter, talkgroup_sort='id')
+            names = [row[2] for row in rows]
+            self.assertEqual(len(names), len(set(names)), talkgroup_filter)
+            self.assertNotIn('9999', [row[1] for row in rows])
+            self.assertEqual('3198' in [row[1] for row in rows], talkgroup_filter == 'all')
+            self.assertEqual(code_builder.talkgroup_mapping['DMR Anarchy'], rows[names.index('DMR Anarchy')][1])
+            self.assertTrue(any('listed more than once' in text for text in code_builder.warnings))
+
+
+class CheckTest(TemplateInputs):
+
+    def check(self):
+        code_builder = builder.CodeplugBuilder(verbose=False, collect_errors=True)
+        code_builder.check_files(self.input_path('Analog'), self.input_path('Digital-Others'),
+                                 self.input_path('Digital-Repeaters'), self.input_path('TalkGroups'),
+                                 builder.DEFAULT_CONFIG_DIRECTORY)
+
+    def test_row_longer_than_its_header_is_reported(self):
+        self.append_row('Digital-Repeaters', 'Extra;EX,,High,442.000,447.000,1,1,-,-,2')
+        self.append_row('Analog', 'Calling,Typo,25K,High,14x.52,146.52,Off,Off,Off')
+        with self.assertRaises(builder.ValidationError) as caught:
+            self.check()
+        issues = caught.exception.issues
+        self.assertEqual(len(issues), 2)
+        self.assertEqual((issues[0].file, issues[0].column), ('Digital-Repeater', 10))
+        self.assertIn('header only has 9', issues[0].message)
+        self.assertIn("Invalid Frequency: '14x.52'", issues[1].message)
+
+    def test_trailing_empty_cells_are_ignored(self):
+        self.append_row('Digital-Repeaters', 'Extra;EX,,High,442.000,447.000,1,1,-,-,')
+        self.check()
+
+
+class CapacityTest(TemplateInputs):
+
+    def test_counts_match_the_build(self):
+        self.append_row('Digital-Repeaters', 'Quiet;QT,,High,442.000,447.000,1,-,-,-')
+        code_builder = builder.CodeplugBuilder(verbose=False, log_scanlists=False)
+        capacity = code_builder.count_capacity(self.input_path('Analog'), self.input_path('Digital-Others'),
+                                               self.input_path('Digital-Repeaters'), self.input_path('TalkGroups'))
+        code_builder.write_files(self.output_dir, self.input_path('Analog'), self.input_path('Digital-Others'),
+                                 self.input_path('Digital-Repeaters'), self.input_path('TalkGroups'),
+                                 builder.DEFAULT_CONFIG_DIRECTORY)
+
+        def rows(name):
+            return len(builder.read_csv_rows(os.path.join(self.output_dir, name))) - 1
+
+        self.assertEqual({what: used for what, used, _ in capacity.totals()},
+                         {'Channels': rows('channels.csv'), 'Zones': rows('zones.csv'),
+                          'Scanlists': rows('scanlists.csv'), 'Talkgroups': rows('talkgroups.csv')})
+
+
+class DuplicateNamesTest(TemplateInputs):
+
+    def build(self, **options):
+        code_builder = builder.CodeplugBuilder(verbose=False, **options)
+        code_builder.write_files(self.output_dir, self.input_path('Analog'), self.input_path('Digital-Others'),
+                                 self.input_path('Digital-Repeaters'), self.input_path('TalkGroups'),
+                                 builder.DEFAULT_CONFIG_DIRECTORY)
+        return code_builder
+
+    def test_default_build_does_not_track_names(self):
+        code_builder = self.build()
+        self.assertEqual(code_builder.name_collisions, [])
+        self.assertFalse([w for w in code_builder.warnings if 'same name' in w])
+
+    def test_warn_mode_reports_template_clashes(self):
+        code_builder = self.build(duplicate_names='warn')
+        self.assertTrue(code_builder.name_collisions)
+        self.assertTrue([w for w in code_builder.warnings if 'same name' in w])
+
+    def test_collision_report_turns_on_warn(self):
+        report = os.path.join(self.work_dir, 'collisions.csv')
+        with mock.patch.object(sys, 'argv', ['builder.py'] + self.input_args() + ['--collision-report', report]), \
+                contextlib.redirect_stdout(io.StringIO()):
+            builder.main()
+        self.assertGreater(len(builder.read_csv_rows(report)), 1)
+
+    def test_collision_report_rejects_allow(self):
+        argv = ['builder.py'] + self.input_args() + ['--collision-report', 'out.csv', '--duplicate-names', 'allow']
+        with mock.patch.object(sys, 'argv', argv), contextlib.redirect_stderr(io.StringIO()) as stderr, \
+                self.assertRaises(SystemExit):
+            builder.handle_command_line_args()
+        self.assertIn('--collision-report needs a --duplicate-names mode', stderr.getvalue())
+
+
+class BandPlanTest(TemplateInputs):
+
+    def build(self, **options):
+        code_builder = builder.CodeplugBuilder(verbose=False, collect_errors=True, **options)
+        code_builder.write_files(self.output_dir, self.input_path('Analog'), self.input_path('Digital-Others'),
+                                 self.input_path('Digital-Repeaters'), self.input_path('TalkGroups'),
+                                 builder.DEFAULT_CONFIG_DIRECTORY)
+        return code_builder
+
+    def test_bad_frequency_is_reported_once(self):
+        self.append_row('Analog', 'Calling,Typo,25K,High,14x.52,146.52,Off,Off,Off')
+        with self.assertRaises(builder.ValidationError) as caught:
+            self.build()
+        self.assertEqual(len(caught.exception.issues), 1)
+        self.assertIn("Invalid Frequency: '14x.52'", caught.exception.issues[0].message)
+
+    def test_frequency_the_radio_cannot_tune_is_an_error(self):
+        self.append_row('Analog', 'Calling,Typo,25K,High,14.652,14.652,Off,Off,Off')
+        with self.assertRaises(builder.ValidationError) as caught:
+            self.build()
+        self.assertEqual(len(caught.exception.issues), 1)
+        self.assertIn("outside what the radio can tune", caught.exception.issues[0].message)
+
+    def test_unusual_offset_is_a_warning(self):
+        self.append_row('Analog', 'Calling,Xband,25K,High,146.94,441.94,Off,Off,Off')
+        warnings = self.build().warnings
+        self.assertTrue(any('unusual repeater offset' in text for text in warnings), warnings)
+
+    def test_band_sort_follows_the_band_plan(self):
+        inputs = [builder.read_csv_rows(self.input_path(name))
+                  for name in ('TalkGroups', 'Analog', 'Digital-Others', 'Digital-Repeaters')]
+
+        def zone_names(band_plan):
+            tables = builder.build_codeplug(*inputs, band_plan=band_plan, sorting='band-frequency', verbose=False)
+            return [row[1] for row in tables['zones.csv'][1:]]
+
+        default = zone_names(None)
+        only_70cm = zone_names([builder.BAND_PLAN_HEADERS, ['Amateur', '70cm', '420', '450', '5']])
+        self.assertLess(default.index('Calling'), default.index('Salem/MT'))  # 2m before 70cm
+        self.assertGreater(only_70cm.index('Calling'), only_70cm.index('Salem/MT'))  # 2m is now outside the bands
+
+
+class BuildServiceTest(TemplateInputs):
+    """Runs the --serve request handler on a thread pool instead of worker processes."""
+
+    def setUp(self):
+        super().setUp()
+        executor = ThreadPoolExecutor(max_workers=2, initializer=builder._init_serve_worker,
+                                      initargs=(builder.DEFAULT_CONFIG_DIRECTORY,))
+        self.addCleanup(executor.shutdown)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), builder.make_build_request_handler(executor, quiet=True))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def post(self, body, content_length=None, boundary='xyzzy'):
+        """Send a raw POST /build, returning (status, body)."""
+        headers = ["POST /build HTTP/1.1", "Host: localhost", "Connection: close",
+                   f"Content-Type: multipart/form-data; boundary={boundary}"]
+        if content_length is not None:
+            headers.append(f"Content-Length: {content_length}")
+        with socket.create_connection(self.server.server_address, timeout=10) as sock:
+            sock.sendall(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body)
+            sock.shutdown(socket.SHUT_WR)
+            response = b''
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                response += data
+        head, _, content = response.partition(b'\r\n\r\n')
+        return int(head.split()[1]), content
+
+    def form(self, files=None, fields=(), boundary='xyzzy'):
+        if files is None:
+            files = {}
+            for field, name in (('analog-csv', 'Analog'), ('digital-others-csv', 'Digital-Others'),
+                                ('digital-repeaters-csv', 'Digital-Repeaters'), ('talkgroups-csv', 'TalkGroups')):
+                with open(self.input_path(name), 'rb') as fh:
+                    files[field] = fh.read()
+        body = b''
+        for name, value in list(fields) + list(files.items()):
+            value = value.encode('utf-8') if isinstance(value, str) else value
+            body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n").encode('latin-1')
+            body += value + b'\r\n'
+        return body + f"--{boundary}--\r\n".encode('latin-1')
+
+    def test_builds_a_zip(self):
+        body = self.form()
+        status, content = self.post(body, len(body))
+        self.assertEqual(status, 200)
+        self.assertTrue(content.startswith(b'PK'))
+
+    def test_rejects_missing_or_bad_content_length(self):
+        body = self.form()
+        for content_length in (None, 'abc', '-1', ''):
+            status, content = self.post(body, content_length)
+            self.assertEqual(status, 400, content_length)
+            self.assertIn(b'Content-Length', content)
+
+    def test_rejects_files_that_are_not_utf8(self):
+        files = dict((name, b'') for name in builder.SERVE_FILE_FIELDS[:4])
+        files['analog-csv'] = b'Zone,Channel Name\xff\xfe\n'
+        body = self.form(files)
+        status, content = self.post(body, len(body))
+        self.assertEqual(status, 400)
+        self.assertIn(b'analog-csv', content)
+
+    def test_rejects_options_that_are_not_utf8(self):
+        body = self.form(fields=[('sorting', b'\xff')])
+        status, _ = self.post(body, len(body))
+        self.assertEqual(status, 400)
+
+    def test_rejects_malformed_forms(self):
+        for body in (b'not a form at all', self.form(fields=[('no-such-option', 'x')]), self.form(files={}),
+                     self.form(fields=[('sorting', '--serve')]), self.form(fields=[('contacts-limit', 'lots')])):
+            status, content = self.post(body, len(body))
+            self.assertEqual(status, 400, body[:40])
+            self.assertTrue(content.startswith(b'ERROR:'))
+
+    def test_unexpected_failures_answer_500(self):
+        def broken_build(files, options):
+            raise OSError("disk full")
+        original = builder._serve_build
+        builder._serve_build = broken_build
+        self.addCleanup(setattr, builder, '_serve_build', original)
+        body = self.form()
+        status, content = self.post(body, len(body))
+        self.assertEqual(status, 500)
+        self.assertIn(b'disk full', content)
+
+    def test_rejects_oversized_uploads(self):
+        status, _ = self.post(b'', builder.SERVE_MAX_UPLOAD_BYTES + 1)
+        self.assertEqual(status, 413)
+
+
+class ServeCommandLineTest(unittest.TestCase):
+
+    def run_builder(self, *args):
+        return subprocess.Popen([sys.executable, builder.__file__, *args], stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, text=True)
+
+    def test_port_zero_serves_on_a_free_port(self):
+        process = self.run_builder('--serve', '0')
+        try:
+            line = process.stdout.readline()
+        finally:
+            process.terminate()
+            process.communicate(timeout=30)
+        self.assertRegex(line, r'^Serving codeplug builds on http://127\.0\.0\.1:[1-9][0-9]*/build')
+
+    def test_rejects_ports_out_of_range(self):
+        process = self.run_builder('--serve', '70000')
+        _, error = process.communicate(timeout=30)
+        self.assertEqual(process.returncode, 2)
+        self.assertIn('--serve needs a port from 0 to 65535', error)
+
+if __name__ == '__main__':
+    unittest.main()